@@ -1,219 +1,227 @@
 # Load required libraries
 import openpyxl
 import pandas as pd
-from Bio import Entrez
-from collections import Counter
-import re
-import time
+import os
+from functools import partial
+from instrumentation import RunRecorder
+from artifacts import save_table, load_table, save_feature_matrix
+from entrez_client import EntrezClient
+from entrez_fetch import (SEARCH_RETMAX, search_pmids_cached, fetch_mesh_terms_batched, fetch_mesh_terms_per_pmid,
+                          fetch_mesh_terms_cached, join_mesh_terms, build_pmid_index, count_fetch_requests)
+from mesh_cache import open_mesh_cache
+from mesh_tree import MeshTree, rollup_counts
+from pubmed_local_index import open_local_index, search_local_pmids, get_local_mesh
+from term_matrix import (DEFAULT_SOURCE_WEIGHTS, DEFAULT_REMOVE_TERMS, count_terms, drop_terms, most_common_terms,
+                         row_summaries, row_term_lists, top_terms_per_row, weighted_terms_string,
+                         build_feature_matrix, TermWeighting)
+
+config = {
+    'pmid_source': 'entrez',  # 'entrez' queries NCBI, 'local' resolves queries against an ingested PubMed dump
+    'local_index_path': 'pubmed_index.sqlite',  # Built with `python pubmed_local_index.py ingest ...`
+    'entrez_email': "sarkisj@uci.edu",
+    'entrez_api_key': os.environ.get('NCBI_API_KEY'),  # Raises the NCBI limit from 3 to 10 requests/second
+    'entrez_max_workers': 4,
+    'search_mindate': "2020",
+    'search_maxdate': "2025",
+    'search_retmax': SEARCH_RETMAX,  # Most PMIDs kept per faculty query, by esearch and by the local index alike
+    'fetch_mode': 'batched',  # 'batched' posts each IdList to the history server, 'per_pmid' fetches one PMID per request
+    'efetch_batch_size': 200,
+    'cache_path': 'mesh_cache.sqlite',
+    'mesh_cache_max_age_days': 365,  # MeSH headings of a published paper rarely change
+    'search_cache_max_age_days': 30,  # Re-run esearch monthly to pick up new papers
+    'source_weights': dict(DEFAULT_SOURCE_WEIGHTS),  # Per-source term weights (proposals 3, keywords 2, publications 1)
+    'remove_terms': list(DEFAULT_REMOVE_TERMS),  # Generic terms dropped before ranking (also applied by projection.py)
+    'mesh_tree_path': None,  # mesh_tree.json from `python mesh_tree.py build desc2025.xml`; None keeps leaf terms as features
+    'mesh_rollup_depth': 3,  # Tree depth descriptors are rolled up to (depth 2 maps C04.588.274 to C04.588)
+    'mesh_exclude_branches': [],  # Tree-number prefixes left out of the features, e.g. ['B01', 'M01'] (organisms, persons)
+    'term_weighting': 'proportion',  # 'proportion' (counts / total), 'tfidf', 'bm25' or 'log_entropy'
+    'stop_term_max_df': None,  # Drop features found in more than this fraction of faculty (e.g. 0.5); None keeps all
+    'stop_term_min_df': 1,  # Drop features found in fewer faculty than this
+    'term_weighting_path': 'term_weighting.json',  # Fitted weights, applied to new faculty by projection.py
+    'top_n_terms': 150,
+    # The PCA matrix has always left out the 27 most common of the top terms
+    # (previously through a positional column drop), so they do not dominate the components
+    'skip_most_common_terms': 27,
+    'pulled_mesh_terms_path': 'faculty_pulled_mesh_terms.parquet',
+    'matrix_path': 'mesh_terms_matrix.npz',  # Read by clustering_analyses.py and PCA_Analyses_debug.py
+    'export_excel_reports': False,  # Also write the .xlsx copies of the outputs
+    'run_report_path': 'run_report_pipeline.json',  # Per-stage timings and Entrez statistics; None turns them off
+}
+
+recorder = RunRecorder('Biopython_Entrez', enabled=config['run_report_path'] is not None)
 
 # Load dataframes
+recorder.begin('load_spreadsheets')
 faculty_df = pd.read_excel('biosci_faculty.xlsx', sheet_name='minus_teaching')
 research_keywords_df = pd.read_excel('research_keywords.xlsx')
 faculty_proposal_mesh_terms_df = pd.read_excel('faculty_proposal_abstracts.xlsx', sheet_name='proposal_abstracts_sheet')
 mapped_mesh_terms_df = pd.read_excel('research_keywords_cleaned_mesh_terms.xlsx', usecols=['Faculty_Full_Name', 'Mapped_Mesh_Terms'])
 
-# Set Entrez email
-Entrez.email = "sarkisj@uci.edu"
-
-# Fetch PMIDs for each faculty member
-faculty_df["pmids"] = None
-for index, row in faculty_df.iterrows():
-    search_term = row["Faculty_Author_Affiliation"]
-    handle_search = Entrez.esearch(db="pubmed", mindate="2020", maxdate="2025", term=search_term)
-    record = Entrez.read(handle_search)
-    faculty_df.at[index, "pmids"] = record["IdList"]
-    handle_search.close()
-
-# Fetch MeSH terms for each PMID
-faculty_df['pub_mesh_terms'] = None
-for index, row in faculty_df.iterrows():
-    pmid_list = row['pmids'] 
-    mesh_term_texts = []
-    for pmid in pmid_list:
-        handle_mesh = Entrez.efetch(db="pubmed", id=pmid, rettype="xml")
-        record = Entrez.read(handle_mesh)
-        if record["PubmedArticle"]:
-            medline = record["PubmedArticle"][0]["MedlineCitation"]
-            mesh_headings = medline.get("MeshHeadingList", [])
-            for mesh_heading in mesh_headings:
-                descriptor_name_element = mesh_heading.get("DescriptorName")
-                if descriptor_name_element:
-                    descriptor_name = str(descriptor_name_element)  # Convert StringElement to string
-                    mesh_term_texts.append(descriptor_name)
-        handle_mesh.close()
-        time.sleep(0.5)
-
-    faculty_df.at[index, 'pub_mesh_terms'] = '; '.join(mesh_term_texts)
-
-output_file = 'faculty_pulled_mesh_terms.csv'
-faculty_df.to_csv(output_file, index=False)
-
-output_file = 'faculty_pulled_mesh_terms.csv'
-faculty_df = pd.read_csv(output_file)
+if config['pmid_source'] == 'local':
+    # Resolve the Faculty_Author_Affiliation queries and MeSH headings from the local PubMed index
+    recorder.begin('local_pubmed_index')
+    local_index = open_local_index(config['local_index_path'])
+    faculty_df["pmids"] = faculty_df["Faculty_Author_Affiliation"].apply(
+        lambda search_term: search_local_pmids(local_index, search_term, config['search_mindate'],
+                                               config['search_maxdate'], config['search_retmax']))
+    pmid_index = build_pmid_index(faculty_df['Faculty'], faculty_df['pmids'])
+    mesh_by_pmid = get_local_mesh(local_index, pmid_index)
+    faculty_df['pub_mesh_terms'] = faculty_df['pmids'].apply(lambda pmid_list: join_mesh_terms(pmid_list, mesh_by_pmid))
+    local_index.close()
+else:
+    # Set up the rate-limited Entrez client
+    client = EntrezClient(email=config['entrez_email'], api_key=config['entrez_api_key'],
+                          max_workers=config['entrez_max_workers'], recorder=recorder)
+
+    # Open the PMID/esearch cache so reruns only go to NCBI for new or stale entries
+    mesh_cache = open_mesh_cache(config['cache_path'])
+
+    # Fetch PMIDs for each faculty member
+    recorder.begin('esearch')
+    faculty_df["pmids"] = search_pmids_cached(mesh_cache, client, faculty_df["Faculty_Author_Affiliation"].tolist(),
+                                              config['search_mindate'], config['search_maxdate'],
+                                              config['search_cache_max_age_days'], config['search_retmax'])
+
+    # Fetch MeSH terms for each PMID
+    if config['fetch_mode'] == 'batched':
+        fetch = partial(fetch_mesh_terms_batched, batch_size=config['efetch_batch_size'])
+    else:
+        fetch = fetch_mesh_terms_per_pmid
+
+    # Co-authored papers appear in several faculty IdLists, so fetch every unique PMID once
+    recorder.begin('efetch')
+    pmid_index = build_pmid_index(faculty_df['Faculty'], faculty_df['pmids'])
+    mesh_by_pmid, fetched_pmids = fetch_mesh_terms_cached(mesh_cache, client, list(pmid_index), fetch,
+                                                          config['mesh_cache_max_age_days'])
+    faculty_df['pub_mesh_terms'] = faculty_df['pmids'].apply(lambda pmid_list: join_mesh_terms(pmid_list, mesh_by_pmid))
+
+    # Report how much the deduplication saved compared to fetching each faculty member's IdList separately
+    fetched_pmids = set(fetched_pmids)
+    total_pmid_refs = sum(len(authors) for authors in pmid_index.values())
+    shared_pmids = sum(1 for authors in pmid_index.values() if len(authors) > 1)
+    per_faculty_requests = sum(
+        count_fetch_requests(sum(1 for pmid in pmid_list if str(pmid) in fetched_pmids), config['fetch_mode'],
+                             config['efetch_batch_size'])
+        for pmid_list in faculty_df['pmids'])
+    dedup_requests = count_fetch_requests(len(fetched_pmids), config['fetch_mode'], config['efetch_batch_size'])
+    print(f"{total_pmid_refs} PMID references, {len(pmid_index)} unique articles ({shared_pmids} shared by 2+ faculty)")
+    print(f"Fetched {len(fetched_pmids)} articles in {dedup_requests} requests "
+          f"(per-faculty fetching would need {per_faculty_requests}, saved {per_faculty_requests - dedup_requests})")
+    recorder.record('unique_pmids', len(pmid_index))
+    recorder.record('fetched_pmids', len(fetched_pmids))
+    recorder.record('saved_requests', per_faculty_requests - dedup_requests)
+
+    mesh_cache.close()
+
+recorder.begin('save_pulled_terms')
+output_file = config['pulled_mesh_terms_path']
+save_table(faculty_df, output_file)
+
+faculty_df = load_table(output_file)
 
 # Process proposal MeSH terms
+recorder.begin('merge_sources')
 faculty_proposal_mesh_terms_df['Proposal_Mesh_Terms'] = faculty_proposal_mesh_terms_df['Proposal_Mesh_Terms'].astype(str)
 
-proposal_mesh_terms_df = faculty_proposal_mesh_terms_df.groupby('Faculty')['Proposal_Mesh_Terms'].agg(lambda x: '; '.join(x)).reset_index()
-
-def repeat_mesh_terms(mesh_terms, repetitions):
-    if pd.notna(mesh_terms) and mesh_terms != "":
-        repeated_terms = "; ".join([str(mesh_terms)] * repetitions)
-        return repeated_terms
-    return mesh_terms
-
-# Apply doubling
-mapped_mesh_terms_df['Mapped_Mesh_Terms'] = mapped_mesh_terms_df['Mapped_Mesh_Terms'].apply(lambda x: repeat_mesh_terms(x, 2))
-
-# Apply tripling
-proposal_mesh_terms_df['Proposal_Mesh_Terms'] = proposal_mesh_terms_df['Proposal_Mesh_Terms'].apply(lambda x: repeat_mesh_terms(x, 3))
+# Keep each faculty member's proposal term strings as a list; they are tokenized once by count_terms
+proposal_mesh_terms_df = faculty_proposal_mesh_terms_df.groupby('Faculty')['Proposal_Mesh_Terms'].agg(list).reset_index()
 
 # Merge dataframes
 merged_df = pd.merge(faculty_df, proposal_mesh_terms_df, on='Faculty', how='left')
 merged_df.drop(columns=['Faculty_Author', 'Faculty_Author_Affiliation'], inplace=True)
 combined_faculty_df = pd.merge(merged_df, mapped_mesh_terms_df, on="Faculty_Full_Name", how='left')
 
-# Combine MeSH terms - corrected version
-# First, replace NaN values with empty strings
-combined_faculty_df['Proposal_Mesh_Terms'] = combined_faculty_df['Proposal_Mesh_Terms'].fillna('')
-combined_faculty_df['Mapped_Mesh_Terms'] = combined_faculty_df['Mapped_Mesh_Terms'].fillna('')
-combined_faculty_df['pub_mesh_terms'] = combined_faculty_df['pub_mesh_terms'].fillna('')
-
-# Create a function to combine terms properly
-def combine_mesh_terms(row):
-    terms = []
-    if row['Proposal_Mesh_Terms'] and row['Proposal_Mesh_Terms'].strip():
-        terms.append(row['Proposal_Mesh_Terms'])
-    if row['Mapped_Mesh_Terms'] and row['Mapped_Mesh_Terms'].strip():
-        terms.append(row['Mapped_Mesh_Terms'])
-    if row['pub_mesh_terms'] and row['pub_mesh_terms'].strip():
-        terms.append(row['pub_mesh_terms'])
-    
-    return '; '.join(terms)
-
-# Apply the function to create the combined column
-combined_faculty_df['Combined_Mesh_Terms'] = combined_faculty_df.apply(combine_mesh_terms, axis=1)
+# Stream (faculty, term id, source weight) triples from every source into sparse faculty x term counts
+recorder.begin('term_counts')
+term_counts, vocabulary, first_seen = count_terms(combined_faculty_df, config['source_weights'], first_seen=True)
+
+# Report column: every source's terms repeated by its weight, without the removed terms
+source_columns = list(config['source_weights'])
+combined_faculty_df['Combined_Mesh_Terms'] = [
+    weighted_terms_string(values, config['source_weights'].values(), config['remove_terms'])
+    for values in zip(*(combined_faculty_df[column] for column in source_columns))]
 
 # Drop original columns if needed
 combined_faculty_df.drop(columns=['Proposal_Mesh_Terms', 'Mapped_Mesh_Terms', 'pmids', 'pub_mesh_terms'], inplace=True)
 
 # Remove unhelpful MeSH terms
-remove_terms = [
-    "Animals", "Biology", "Humans", "Rats", "Mice", "Male", "Female",
-    "Disease Models, Animal", "Mice, Transgenic", "Mice, Inbred C57BL",
-    "Mice, Knockout", "Adult", "Middle Aged", "Models, Theoretical",
-    "Models, Biological", "Models, Animal", "Mentors", "Mentoring",
-    "Universities", "Drosophila", "Mammals", "Faculty", "Research Design",
-    "Follow-Up Studies", "United States", "Goals", "Preliminary Data", "Students", "Feedback"
-]
-
-def remove_terms_from_string(terms_string, terms_to_remove):
-    terms_list = terms_string.split('; ')
-    filtered_terms = [term for term in terms_list if term not in terms_to_remove]
-    cleaned_string = '; '.join(filtered_terms).strip('; ')
-    cleaned_string = re.sub(r';\s*;', ';', cleaned_string)
-    return cleaned_string
-
-combined_faculty_df['Combined_Mesh_Terms'] = combined_faculty_df['Combined_Mesh_Terms'].apply(lambda x: remove_terms_from_string(x, remove_terms))
-
-# Calculate most common item and average frequency
-def find_most_common_item(data):
-    items = data.split('; ')
-    item_counts = Counter(items)
-    if not item_counts:
-        return None, 0
-    most_common_item, max_count = item_counts.most_common(1)[0]
-    average_frequency = sum(item_counts.values()) / len(item_counts)
-    return most_common_item, average_frequency
-
-combined_faculty_df['most_common_item'] = None
-combined_faculty_df['average_frequency'] = None
-
-for index, row in combined_faculty_df.iterrows():
-    most_common, average_freq = find_most_common_item(row['Combined_Mesh_Terms'])
-    combined_faculty_df.at[index, 'most_common_item'] = most_common
-    combined_faculty_df.at[index, 'average_frequency'] = average_freq
+first_seen, _ = drop_terms(first_seen, vocabulary, config['remove_terms'])
+term_counts, vocabulary = drop_terms(term_counts, vocabulary, config['remove_terms'])
 
-# Count top MeSH terms
-counter = Counter()
-for string in combined_faculty_df['Combined_Mesh_Terms']:
-    items = str(string).split("; ")
-    counter.update(items)
+recorder.matrix('term_counts', term_counts)
+
+# Per-faculty summaries straight from the counts: most common term (ties going to the term the
+# faculty member's sources list first, as Counter.most_common did) and average frequency
+recorder.begin('term_reports')
+most_common_ids, average_frequency, _ = row_summaries(term_counts, first_seen)
+combined_faculty_df['most_common_item'] = [vocabulary.terms[term_id] if term_id >= 0 else None
+                                           for term_id in most_common_ids]
+combined_faculty_df['average_frequency'] = average_frequency
 
-total_items = sum(counter.values())
-top_items = counter.most_common(150)
+# Count top MeSH terms
+total_items = term_counts.sum()
+top_items = most_common_terms(term_counts, vocabulary, config['top_n_terms'])
 
 for item, count in top_items:
     proportion = count / total_items
-    print(f"{item}: {count} ({proportion:.2%})")
-
-# Calculate normalized scores
-def calculate_normalized_scores(faculty_string, top_items):
-    faculty_counter = Counter(str(faculty_string).split("; "))
-    total_count = sum(faculty_counter.values())
-    item_names = [item[0] for item in top_items]
-    scores = {item: faculty_counter.get(item, 0) / total_count for item in item_names}
-    return scores
-
-combined_faculty_df['Normalized_Scores'] = combined_faculty_df['Combined_Mesh_Terms'].apply(lambda x: calculate_normalized_scores(x, top_items))
-
-# Calculate top MeSH terms for each faculty
-def calculate_top_mesh_terms(faculty_mesh_terms_dict):
-    for faculty, mesh_terms in faculty_mesh_terms_dict.items():
-        if mesh_terms:
-            term_counts = Counter(mesh_terms)
-            top_terms = term_counts.most_common(5)
-            print(f"{faculty}: ", end="")
-            for i, (term, count) in enumerate(top_terms):
-                print(f"{term}", end="")
-            print()
-        else:
-            print(f"No MeSH terms found for {faculty}.")
-
-combined_faculty_df['Mesh_Terms_List'] = combined_faculty_df['Combined_Mesh_Terms'].str.split(';')
-combined_faculty_df['Mesh_Terms_List'] = combined_faculty_df['Mesh_Terms_List'].apply(lambda x: [item.strip() for item in x] if isinstance(x, list) else [])
-
-# Create a dictionary with Faculty_Full_Name as keys and Mesh_Terms_List as values
-faculty_mesh_terms_dict = dict(zip(combined_faculty_df['Faculty_Full_Name'], combined_faculty_df['Mesh_Terms_List']))
-calculate_top_mesh_terms(faculty_mesh_terms_dict)
-
-def get_unique_terms(combined_faculty_df):
-    unique_terms = {}
-    for index, row in combined_faculty_df.iterrows():
-        faculty_name, terms = row['Faculty'], row['Combined_Mesh_Terms']
-        terms_list = [term.strip() for term in terms.split(';')]
-        unique_terms[faculty_name] = "; ".join(sorted(set(terms_list)))  # Sort for consistency
-
-    return unique_terms
-
-# Get unique MeSH terms
-unique_mesh_terms = get_unique_terms(combined_faculty_df)
-
-# Create and save DataFrame of unique terms
-unique_terms_df = pd.DataFrame(list(unique_mesh_terms.items()), columns=['Faculty', 'Unique_Mesh_Terms'])
-unique_terms_df.to_excel('faculty_unique_mesh_terms.xlsx', index=False)
-
-# Convert 'Normalized_Scores' dictionary column to separate columns
-normalized_scores_df = combined_faculty_df['Normalized_Scores'].apply(pd.Series)
-
-# Add prefix to new columns
-normalized_scores_df = normalized_scores_df.add_prefix('Normalized_')
-
-# Align indices
-normalized_scores_df.index = combined_faculty_df.index
+    print(f"{item}: {count:g} ({proportion:.2%})")
+
+# Print the top 5 MeSH terms of each faculty member
+for faculty, top_terms in zip(combined_faculty_df['Faculty_Full_Name'],
+                              top_terms_per_row(term_counts, vocabulary.terms, 5)[0]):
+    if top_terms:
+        print(f"{faculty}: {'; '.join(top_terms)}")
+    else:
+        print(f"No MeSH terms found for {faculty}.")
+
+# Create and save DataFrame of each faculty member's unique MeSH terms (sorted for consistency)
+unique_terms_df = pd.DataFrame({'Faculty': combined_faculty_df['Faculty'],
+                                'Unique_Mesh_Terms': ['; '.join(terms) for terms
+                                                      in row_term_lists(term_counts, vocabulary, order='alpha')]})
+unique_terms_df = unique_terms_df.drop_duplicates('Faculty', keep='last').reset_index(drop=True)
+save_table(unique_terms_df, 'faculty_unique_mesh_terms.parquet')
+if config['export_excel_reports']:
+    unique_terms_df.to_excel('faculty_unique_mesh_terms.xlsx', index=False)
+
+# Optionally roll descriptors up the MeSH tree so related leaf terms share one feature column
+recorder.begin('feature_matrix')
+feature_counts, feature_vocabulary = term_counts, vocabulary
+if config['mesh_tree_path']:
+    feature_counts, feature_vocabulary = rollup_counts(term_counts, vocabulary, MeshTree.load(config['mesh_tree_path']),
+                                                       config['mesh_rollup_depth'], config['mesh_exclude_branches'])
+    print(f"Rolled {len(vocabulary)} terms up to {len(feature_vocabulary)} at MeSH depth {config['mesh_rollup_depth']}")
+
+# Fit the corpus term weights and drop the stop terms flagged by document frequency
+term_weighting = TermWeighting(config['term_weighting'], config['stop_term_max_df'],
+                               config['stop_term_min_df']).fit(feature_counts, feature_vocabulary)
+if term_weighting.stop_terms:
+    feature_counts, feature_vocabulary = drop_terms(feature_counts, feature_vocabulary, term_weighting.stop_terms)
+    print(f"Dropped {len(term_weighting.stop_terms)} stop terms: {'; '.join(term_weighting.stop_terms[:20])}")
+term_weighting.save(config['term_weighting_path'])
+
+# Build the normalized faculty x term feature matrix (sparse) over the top terms
+features, faculty_index, term_index = build_feature_matrix(feature_counts, feature_vocabulary,
+                                                           combined_faculty_df['Faculty_Full_Name'],
+                                                           config['top_n_terms'], weighting=term_weighting)
+normalized_scores_df = pd.DataFrame(features.toarray(), columns='Normalized_' + term_index,
+                                    index=combined_faculty_df.index)
+
+recorder.matrix('features', features)
 
 # Concatenate normalized scores to original DataFrame
+recorder.begin('save_outputs')
 combined_faculty_df = pd.concat([combined_faculty_df, normalized_scores_df], axis=1)
 
-# Save the updated DataFrame to Excel
-combined_faculty_df.to_excel('faculty_mesh_terms.xlsx', index=False)
-
-# Prepare PCA matrix
-pd.options.display.max_columns = None
-pd.options.display.max_rows = None
+# Save the updated DataFrame
+save_table(combined_faculty_df, 'faculty_mesh_terms.parquet')
+if config['export_excel_reports']:
+    combined_faculty_df.to_excel('faculty_mesh_terms.xlsx', index=False)
 
-# Drop columns to prepare for PCA
-pca_matrix = combined_faculty_df.drop(combined_faculty_df.columns[1:36], axis=1)
+# Save the PCA matrix (leaving out the most common terms) for the analysis scripts
+skip = config['skip_most_common_terms']
+save_feature_matrix(config['matrix_path'], features[:, skip:], faculty_index, term_index[skip:])
+if config['export_excel_reports']:
+    pca_matrix = pd.concat([combined_faculty_df[['Faculty_Full_Name']], normalized_scores_df.iloc[:, skip:]], axis=1)
+    pca_matrix.to_excel('mesh_terms_matrix_5yrs_and_keywords.xlsx', index=False)
 
-# Save PCA matrix to Excel
-pca_matrix.to_excel('mesh_terms_matrix_5yrs_and_keywords.xlsx', index=False)
\ No newline at end of file
+recorder.write(config['run_report_path'])
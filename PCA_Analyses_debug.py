@@ -1,94 +1,180 @@
 import pandas as pd
 import numpy as np
+from scipy import sparse
 import streamlit as st
-from sklearn.decomposition import PCA
 import umap
 from umap import UMAP
 import plotly.express as px
 import plotly.graph_objects as go
 from sklearn.manifold import TSNE
 from sklearn.cluster import KMeans, DBSCAN
-from sklearn.neighbors import NearestNeighbors
 from sklearn.metrics import silhouette_score
 import matplotlib.pyplot as plt
 import seaborn as sns
-from collections import Counter
-import statsmodels.api as sm
-from statsmodels.formula.api import ols
 from statsmodels.stats.multicomp import pairwise_tukeyhsd
-from statsmodels.stats.multitest import multipletests
 import os
 import kaleido
-import networkx as nx
 import leidenalg as la
-import igraph as ig
 from sklearn.preprocessing import StandardScaler
+from artifacts import load_feature_matrix, file_hash
+from cluster_stats import cluster_feature_tests
+from term_matrix import top_terms_per_row
+from embedding_store import open_embedding_store, umap_on_pca
+from reduction import fit_pca
+from neighbor_graph import neighbor_graph, suggest_eps
+from instrumentation import RunRecorder, load_run_report
 
 # Configuration
 config = {
-    'file_path': 'mesh_terms_matrix_5yrs_and_keywords.xlsx',
+    'file_path': 'mesh_terms_matrix.npz',  # Written by Biopython_Entrez.py (.xlsx exports still load)
     'pca_components_to_try': range(1, 7),
     'dbscan_eps': 0.05,
     'dbscan_min_samples': 2,
+    'leiden_n_neighbors': 15,
+    'leiden_weighted': False,  # Weight Leiden's kNN edges by similarity instead of counting them equally
     'anova_alpha': 0.05,
+    'anova_method': 'anova',  # 'anova' (one-way F-test) or 'kruskal' (Kruskal-Wallis, for skewed zero-heavy terms)
     'top_n_features_to_plot': 10,
     'cluster_output_path': 'Professors_in_clusters.csv',
     'anova_output_path': 'Significant_terms_per_cluster.csv', 
     'top_mesh_terms_output_path': 'Top_Mesh_Terms_Per_Professor.csv',
+    'embedding_store_path': 'umap_embeddings',  # Written by `python embedding_store.py precompute`
+    'umap_cache_entries': 10,  # One UMAP per PCA component count on the slider
+    'cluster_cache_entries': 64,  # Clusterings / significance tests kept per parameter combination
+    'show_timings': True,  # Time every rerun's stages and show them with the scripts' run reports
+    'run_report_paths': {  # Written at the end of each script run
+        'Biopython_Entrez.py': 'run_report_pipeline.json',
+        'clustering_analyses.py': 'run_report_clustering.json',
+    },
+    'run_report_path': 'run_report_dashboard.json',  # This rerun's timings, written by "Save outputs"
 }
 
 # Helper functions
 def load_and_preprocess_data(file_path, index_col='Faculty_Full_Name'):
-    raw_data = pd.read_excel(file_path, index_col=index_col)
-    raw_data.reset_index(inplace=True)
-    faculty_names_df = pd.read_excel(file_path, usecols=['Faculty_Full_Name'])
-    feature_matrix = raw_data.drop(columns=['Faculty_Full_Name'])
+    """Also returns the features as a sparse matrix for PCA."""
+    if file_path.endswith('.npz'):
+        features, faculty_index, term_index = load_feature_matrix(file_path)
+        raw_data = pd.DataFrame(features.toarray(), columns=['Normalized_' + term for term in term_index])
+        raw_data.insert(0, index_col, faculty_index)
+    else:
+        raw_data = pd.read_excel(file_path)
+        features = None
+    faculty_names_df = raw_data[[index_col]].copy()
+    feature_matrix = raw_data.drop(columns=[index_col])
     raw_data.columns = raw_data.columns.str.replace(' ', '_').str.replace('-', '_').str.replace(',', '_')
     feature_matrix.columns = feature_matrix.columns.str.replace(' ', '_').str.replace('-', '_').str.replace(',', '_')
-    return raw_data, feature_matrix, faculty_names_df
+    if features is None:
+        features = sparse.csr_matrix(feature_matrix.to_numpy(dtype=float))
+    return raw_data, feature_matrix, faculty_names_df, features
+
+def top_mesh_terms_table(raw_data, feature_matrix, k, index_col='Faculty_Full_Name'):
+    """Each faculty member's k highest weighted terms (and weights) as plain lists."""
+    terms = [column.replace('Normalized_', '') for column in feature_matrix.columns]
+    top_terms, top_weights = top_terms_per_row(feature_matrix.to_numpy(dtype=float), terms, k)
+    return pd.DataFrame({'Top_Mesh_Terms': top_terms, 'Top_Mesh_Term_Weights': top_weights},
+                        index=pd.Index(raw_data[index_col], name=index_col))
+
+def save_top_mesh_terms(top_mesh_terms_df, path):
+    """Writes the top terms table with '; ' separated terms and weights."""
+    top_mesh_terms_df.assign(
+        Top_Mesh_Terms=top_mesh_terms_df['Top_Mesh_Terms'].str.join('; '),
+        Top_Mesh_Term_Weights=top_mesh_terms_df['Top_Mesh_Term_Weights'].map(
+            lambda weights: '; '.join(f'{weight:.4g}' for weight in weights))
+    ).to_csv(path)
 
 def format_mesh_terms(mesh_terms):
-    if isinstance(mesh_terms, list) and len(mesh_terms) > 0 and isinstance(mesh_terms[0], list):
-        mesh_terms = mesh_terms[0]
-    return ', '.join([term.replace('_', ' ') for term in mesh_terms[:5] if isinstance(term, str)])
+    return ', '.join(term.replace('_', ' ') for term in mesh_terms[:5])
+
+# Memoized computations. Streamlit reruns the whole script on every widget change, so each
+# expensive step is cached on the input-data hash plus its own parameters. Arguments with a
+# leading underscore are not hashed; data_hash stands in for them.
+@st.cache_data(max_entries=2)
+def load_data(file_path, data_hash):
+    return load_and_preprocess_data(file_path)
+
+@st.cache_data(max_entries=2)
+def compute_top_mesh_terms(data_hash, _raw_data, _feature_matrix):
+    return top_mesh_terms_table(_raw_data, _feature_matrix, 3)
+
+@st.cache_data(max_entries=2)
+def compute_pca(data_hash, _feature_matrix):
+    pca, pca_embeddings = fit_pca(_feature_matrix)  # Only the components the slider reaches
+    return pca_embeddings, pca.explained_variance_ratio_
+
+@st.cache_data(max_entries=2)
+def compute_umap(data_hash, _feature_matrix):
+    return UMAP(random_state=123).fit_transform(_feature_matrix)
+
+@st.cache_data(max_entries=config['umap_cache_entries'])
+def compute_umap_on_pca(data_hash, num_components, _pca_embeddings):
+    return umap_on_pca(_pca_embeddings, num_components)
+
+@st.cache_resource
+def load_embedding_store(store_path, data_hash):
+    return open_embedding_store(store_path, data_hash)
+
+@st.cache_data(max_entries=config['cluster_cache_entries'])
+def compute_clusters(data_hash, num_components, clustering_method, params, _umap_result):
+    if clustering_method == "K-means":
+        n_clusters, = params
+        kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+        return kmeans.fit_predict(_umap_result)
+    if clustering_method == "DBSCAN":
+        eps, min_samples = params
+        dbscan = DBSCAN(eps=eps, min_samples=min_samples)
+        return dbscan.fit_predict(_umap_result)
+    # Leiden on the kNN graph of the embedding, built straight from the neighbor index arrays
+    resolution, = params
+    graph = neighbor_graph(_umap_result, config['leiden_n_neighbors']).to_igraph()
+    partition = la.find_partition(graph, la.CPMVertexPartition, resolution_parameter=resolution,
+                                  weights='weight' if config['leiden_weighted'] else None)
+    return np.asarray(partition.membership)
+
+@st.cache_data(max_entries=config['cluster_cache_entries'])
+def compute_feature_tests(data_hash, num_components, clustering_method, params, method, alpha,
+                          _feature_matrix, _cluster_labels):
+    return cluster_feature_tests(_feature_matrix, _cluster_labels, method=method, alpha=alpha)
+
+def timing_panel(report, title):
+    """Stage timings (and Entrez request statistics) of one run report."""
+    st.markdown(f"**{title}**: {report['started_at']}, {report['wall_s']:.1f}s wall, "
+                f"peak RSS {report['max_rss_mb']:.0f} MB")
+    stages_df = pd.DataFrame(report['stages'])
+    if not stages_df.empty:
+        st.bar_chart(stages_df.set_index('stage')['wall_s'])
+        st.dataframe(stages_df.round(3), hide_index=True)
+    if report['requests']:
+        st.dataframe(pd.DataFrame(report['requests']).T.drop(columns='histogram').round(1))
+    if report['matrices']:
+        st.dataframe(pd.DataFrame(report['matrices']).T)
+
+recorder = RunRecorder('PCA_Analyses_debug', enabled=config['show_timings'])
 
 # Load and preprocess data
-raw_data, feature_matrix, faculty_names_df = load_and_preprocess_data(config['file_path'])
+recorder.begin('load_data')
+data_hash = file_hash(config['file_path'])
+raw_data, feature_matrix, faculty_names_df, sparse_features = load_data(config['file_path'], data_hash)
 mesh_term_columns = [col for col in feature_matrix.columns]
 
 # Calculate top MeSH terms
-top_mesh_terms_list = []
-faculty_names = []
-for index, row in raw_data.iterrows():
-    professor_name = row['Faculty_Full_Name']
-    mesh_term_counts = Counter()
-    for term in mesh_term_columns:
-        count = row[term]
-        if count > 0:
-            mesh_term_counts[term] = count
-    top_3_terms = [term for term, count in mesh_term_counts.most_common(3)]
-    top_mesh_terms_list.append([top_3_terms])
-    faculty_names.append(professor_name)
-
-top_mesh_terms_df = pd.DataFrame({'Faculty_Full_Name': faculty_names, 'Top_Mesh_Terms': top_mesh_terms_list})
-top_mesh_terms_df.set_index('Faculty_Full_Name', inplace=True)
-top_mesh_terms_df.to_csv(config['top_mesh_terms_output_path'])
+recorder.begin('top_terms')
+top_mesh_terms_df = compute_top_mesh_terms(data_hash, raw_data, feature_matrix)
 
 # PCA
-pca = PCA()
-pca_embeddings = pca.fit_transform(feature_matrix)
+recorder.begin('pca')
+pca_embeddings, explained_variance = compute_pca(data_hash, sparse_features)
 
 # Streamlit app
 st.title("Faculty Research Analysis")
 
 # PCA Explained Variance
+recorder.begin('pca_plots')
 st.subheader("PCA Explained Variance")
 st.write("""
 **Plot Description:** This plot shows the cumulative percentage of variance captured by the principal components (PCs).
 The x-axis represents the number of PCs included, and the y-axis shows the total variance explained.
 It helps determine how many PCs are needed to retain a significant amount of information.
 """)
-explained_variance = pca.explained_variance_ratio_
 fig, ax = plt.subplots()
 ax.plot(np.cumsum(explained_variance))
 ax.set_xlabel('Number of Components')
@@ -114,12 +200,13 @@ fig.update_traces(
 st.plotly_chart(fig)
 
 # UMAP 2D
+recorder.begin('umap')
 st.subheader("UMAP 2D Projection")
 st.write("""
 **Plot Description:** This plot shows a 2D UMAP representation of the original high-dimensional data.
 It aims to preserve both local and global structure. Hover over points to see faculty names and top MeSH terms.
 """)
-umap_embeddings = UMAP().fit_transform(feature_matrix)
+umap_embeddings = compute_umap(data_hash, feature_matrix)
 umap_embeddings_df = pd.DataFrame(umap_embeddings, columns=["V1", "V2"])
 umap_embeddings_df['Faculty_Full_Name'] = raw_data['Faculty_Full_Name']
 umap_embeddings_df = umap_embeddings_df.merge(top_mesh_terms_df, on='Faculty_Full_Name', how='left')
@@ -133,10 +220,14 @@ fig.update_traces(
 st.plotly_chart(fig)
 
 # UMAP with PCA components
+recorder.begin('umap_on_pca')
 st.subheader("UMAP on PCA Components")
 num_components = st.slider("Number of PCA components", min_value=1, max_value=10, value=3)
-pca_reduced_features = pca_embeddings[:, :num_components]
-umap_result = UMAP(random_state=123).fit_transform(pca_reduced_features)
+# Served from the precomputed store when it matches the data, computed (and cached) otherwise
+embedding_store = load_embedding_store(config['embedding_store_path'], data_hash)
+umap_result = embedding_store.get(num_components) if embedding_store is not None else None
+if umap_result is None:
+    umap_result = compute_umap_on_pca(data_hash, num_components, pca_embeddings)
 umap_df_pca = pd.DataFrame(umap_result, columns=["V1", "V2"])
 umap_df_pca['Faculty_Full_Name'] = raw_data['Faculty_Full_Name']
 umap_df_pca = umap_df_pca.merge(top_mesh_terms_df, on='Faculty_Full_Name', how='left')
@@ -150,33 +241,24 @@ fig.update_traces(
 st.plotly_chart(fig)
 
 # Clustering
+recorder.begin('clustering')
 st.subheader("Clustering")
 clustering_method = st.selectbox("Select clustering method", ["K-means", "DBSCAN", "Leiden"])
 
 if clustering_method == "K-means":
     n_clusters = st.slider("Number of clusters", min_value=2, max_value=20, value=8)
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
-    cluster_labels = kmeans.fit_predict(umap_result)
-    umap_df_pca['cluster'] = cluster_labels
+    cluster_params = (n_clusters,)
 elif clustering_method == "DBSCAN":
-    eps = st.slider("DBSCAN eps", min_value=0.01, max_value=1.0, value=0.05, step=0.01)
     min_samples = st.slider("DBSCAN min_samples", min_value=2, max_value=10, value=2)
-    dbscan = DBSCAN(eps=eps, min_samples=min_samples)
-    cluster_labels = dbscan.fit_predict(umap_result)
-    umap_df_pca['cluster'] = cluster_labels
+    k_distances = neighbor_graph(umap_result, 10).k_distances(min_samples)
+    st.caption(f"Knee of the {min_samples - 1}-NN distance curve (suggested eps): {suggest_eps(k_distances):.3f}")
+    eps = st.slider("DBSCAN eps", min_value=0.01, max_value=1.0, value=0.05, step=0.01)
+    cluster_params = (eps, min_samples)
 else:  # Leiden
     resolution = st.slider("Leiden resolution", min_value=0.1, max_value=2.0, value=0.8, step=0.1)
-    knn = NearestNeighbors(n_neighbors=15)
-    knn.fit(umap_result)
-    _, indices = knn.kneighbors(umap_result)
-    graph = nx.Graph()
-    for i in range(len(umap_result)):
-        for j in indices[i]:
-            if i != j:
-                graph.add_edge(i, j)
-    g_ig = ig.Graph.from_networkx(graph)
-    partition = la.find_partition(g_ig, la.CPMVertexPartition, resolution_parameter=resolution)
-    umap_df_pca['cluster'] = partition.membership
+    cluster_params = (resolution,)
+cluster_labels = compute_clusters(data_hash, num_components, clustering_method, cluster_params, umap_result)
+umap_df_pca['cluster'] = cluster_labels
 
 fig = px.scatter(umap_df_pca, x="V1", y="V2", color='cluster', title=f"UMAP with {clustering_method} Clustering",
                  hover_name="Faculty_Full_Name", hover_data={"V1": False, "V2": False, 'Top_Mesh_Terms': True},
@@ -188,42 +270,22 @@ fig.update_traces(
 st.plotly_chart(fig)
 
 # ANOVA and feature significance
+recorder.begin('feature_tests')
 st.subheader("Feature Significance Analysis")
 filtered_data_df = pd.DataFrame(feature_matrix)
 filtered_data_df['cluster'] = umap_df_pca['cluster']
 cluster_feature_matrix = filtered_data_df
 feature_names = [col for col in cluster_feature_matrix.columns if col != 'cluster']
 
-def get_anova_pvalues(feature, data):
-    model = ols(f"{feature} ~ C(cluster)", data=data).fit()
-    anova_table = sm.stats.anova_lm(model, typ=2)
-    return anova_table["PR(>F)"][0]
-
-feature_p_values = {}
-for feature in feature_names:
-    try:
-        feature_p_values[feature] = get_anova_pvalues(feature, cluster_feature_matrix)
-    except:
-        print(f"Error processing feature: {feature}")
-        feature_p_values[feature] = 1.0
-
-feature_list = list(feature_p_values.keys())
-pval_list = list(feature_p_values.values())
-_, adjusted_p_values, _, _ = multipletests(pval_list, method='fdr_bh', alpha=0.05)
-
-results_df = pd.DataFrame({
-    'Feature': feature_list,
-    'p_value': pval_list,
-    'adjusted_p_values': adjusted_p_values,
-    'significant': adjusted_p_values < 0.05
-})
-
-results_df = results_df.sort_values('adjusted_p_values')
+results_df = compute_feature_tests(data_hash, num_components, clustering_method, cluster_params,
+                                   config['anova_method'], config['anova_alpha'],
+                                   cluster_feature_matrix[feature_names], cluster_feature_matrix['cluster'])
 significant_features_df = results_df[results_df['significant']]
 st.write(f"Found {len(significant_features_df)} significant features:")
 st.write(significant_features_df[['Feature', 'adjusted_p_values']])
 
 # Visualize top significant features
+recorder.begin('feature_plots')
 st.subheader("Top Significant Features")
 top_n = st.slider("Number of top features to display", min_value=1, max_value=20, value=10)
 
@@ -246,8 +308,19 @@ if len(significant_features_df) > 0:
     fig = plot_top_features(cluster_feature_matrix, significant_features_df, top_n)
     st.pyplot(fig)
 
-# Save outputs
-umap_df_pca.to_csv(config['cluster_output_path'], index=False)
-significant_features_df.to_csv(config['anova_output_path'], index=False)
+# Save outputs (only on request, so widget interactions never touch the disk)
+if st.button("Save outputs"):
+    save_top_mesh_terms(top_mesh_terms_df, config['top_mesh_terms_output_path'])
+    umap_df_pca.to_csv(config['cluster_output_path'], index=False)
+    significant_features_df.to_csv(config['anova_output_path'], index=False)
+    recorder.write(config['run_report_path'])
+    st.success("Output files have been saved.")
 
-st.success("Analysis complete! Output files have been saved.")
\ No newline at end of file
+# Timing panel: this rerun (cached steps take almost no time) and the last run of each script
+if config['show_timings']:
+    with st.expander("Run timings"):
+        timing_panel(recorder.report(), "This rerun")
+        for script, report_path in config['run_report_paths'].items():
+            report = load_run_report(report_path)
+            if report is not None:
+                timing_panel(report, script)
\ No newline at end of file
@@ -0,0 +1,43 @@
+# Binary intermediate artifacts passed between the pipeline stages
+#
+# Tables are stored as Parquet and the sparse faculty x term matrix as an uncompressed
+# .npz holding the CSR arrays plus the faculty and term indexes, so each loads in one pass.
+import hashlib
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def save_table(df, path):
+    """Writes a DataFrame to Parquet."""
+    df.to_parquet(path, index=False)
+
+
+def load_table(path, columns=None):
+    """Reads a Parquet table (optionally only some columns)."""
+    return pd.read_parquet(path, columns=columns)
+
+
+def save_feature_matrix(path, features, faculty_index, term_index):
+    """Writes a sparse faculty x term matrix with its row and column indexes."""
+    features = sparse.csr_matrix(features)
+    np.savez(path,
+             data=features.data, indices=features.indices, indptr=features.indptr,
+             shape=np.asarray(features.shape),
+             faculty=np.asarray(faculty_index, dtype=str),
+             terms=np.asarray(term_index, dtype=str))
+
+
+def load_feature_matrix(path):
+    """Returns (csr_matrix, faculty index array, term index array) saved by save_feature_matrix."""
+    with np.load(path, allow_pickle=False) as artifact:
+        features = sparse.csr_matrix((artifact['data'], artifact['indices'], artifact['indptr']),
+                                     shape=tuple(artifact['shape']))
+        return features, artifact['faculty'], artifact['terms']
+
+
+def file_hash(file_path):
+    """SHA-256 of a file's contents, used to tie derived artifacts to their input."""
+    with open(file_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
@@ -0,0 +1,205 @@
+# Times every pipeline stage on synthetic data and writes the results as JSON
+#
+# Each stage is timed with perf_counter and its peak Python/numpy allocation is measured
+# with tracemalloc. Memory allocated inside numba code (UMAP, pynndescent) is not seen by
+# tracemalloc; process_peak_rss_mb covers it, but it is the whole process' high-water mark
+# so far (it never goes down), not the stage's own peak, and is left out of `compare`.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.run --size department --output benchmark_department.json
+#   python -m benchmarks.run --faculty 10000 --terms 30000 --stages term_counts feature_matrix pca
+#   python -m benchmarks.run compare benchmark_before.json benchmark_after.json
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from importlib.metadata import version, PackageNotFoundError
+
+import leidenalg as la
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans, DBSCAN
+
+from benchmarks.synthetic import synthetic_faculty, synthetic_efetch_xml, DEFAULT_TERMS_PER_SOURCE
+from cluster_stats import cluster_feature_tests, cluster_similarity_report
+from embedding_store import umap_on_pca
+from faculty_search import FacultySearchIndex
+from mesh_parser import iter_articles
+from neighbor_graph import neighbor_graph, suggest_eps
+from reduction import fit_pca
+from term_matrix import (DEFAULT_SOURCE_WEIGHTS, DEFAULT_REMOVE_TERMS, count_terms, drop_terms, build_feature_matrix,
+                         TermWeighting)
+
+SIZES = {  # (faculty, vocabulary terms)
+    'department': (100, 2_000),
+    'school': (1_000, 10_000),
+    'university': (10_000, 30_000),
+}
+STAGES = ['parse_efetch', 'term_counts', 'term_weighting', 'feature_matrix', 'pca', 'umap', 'kmeans', 'dbscan',
+          'leiden', 'anova', 'similarity', 'search']
+PACKAGES = ['numpy', 'scipy', 'pandas', 'scikit-learn', 'umap-learn', 'pynndescent', 'leidenalg', 'igraph']
+
+
+def measure(func, *args, **kwargs):
+    """Runs func once; returns (result, {'seconds', 'peak_mb', 'process_peak_rss_mb'})."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    process_peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result, {'seconds': seconds, 'peak_mb': peak / 2 ** 20, 'process_peak_rss_mb': process_peak_rss_kb / 2 ** 10}
+
+
+def _term_counts(df):
+    return drop_terms(*count_terms(df, DEFAULT_SOURCE_WEIGHTS), DEFAULT_REMOVE_TERMS)
+
+
+def _leiden(embedding, resolution=0.8, random_state=123):
+    graph = neighbor_graph(embedding, 15).to_igraph()
+    partition = la.find_partition(graph, la.CPMVertexPartition, seed=random_state, resolution_parameter=resolution)
+    return np.asarray(partition.membership)
+
+
+def _dbscan(embedding, min_samples=2):
+    eps = suggest_eps(neighbor_graph(embedding, min_samples).k_distances(min_samples))
+    return DBSCAN(eps=eps, min_samples=min_samples).fit(embedding).labels_
+
+
+def _search(features, faculty, terms, n_queries, k=10):
+    index = FacultySearchIndex(features, faculty, terms)
+    return [index.similar_to_faculty(name, k) for name in faculty[:n_queries]]
+
+
+def run_benchmarks(n_faculty, n_terms, n_articles=None, top_n=150, num_components=1, n_clusters=20,
+                   n_queries=100, stages=STAGES, seed=0):
+    """Generates the synthetic inputs and returns one result dict per requested stage.
+
+    Stages consume each other's outputs in pipeline order, so the stages up to the last
+    requested one all run but only the requested ones are recorded. UMAP's numba code is
+    compiled on a tiny input first so the timing excludes JIT compilation. DBSCAN's kNN
+    search is shared with Leiden through the graph cache, as in the dashboard.
+    """
+    n_articles = 2 * n_faculty if n_articles is None else n_articles
+    last_stage = max(STAGES.index(name) for name in stages)
+    results = []
+
+    def stage(name, func, *args, **kwargs):
+        result, measurements = measure(func, *args, **kwargs)
+        if name in stages:
+            results.append({'stage': name, **measurements})
+            print(f"{name:>15}: {measurements['seconds']:8.3f}s  peak {measurements['peak_mb']:9.1f} MB")
+        return result
+
+    faculty_df = synthetic_faculty(n_faculty, n_terms, seed=seed)
+    if 'parse_efetch' in stages:
+        payload = synthetic_efetch_xml(n_articles, n_terms, seed=seed)
+        stage('parse_efetch', lambda: sum(len(headings) for _, headings in iter_articles(payload)))
+    counts, vocabulary = stage('term_counts', _term_counts, faculty_df)
+    stage('term_weighting', lambda: TermWeighting('tfidf', max_df=0.5).fit(counts, vocabulary)
+          .transform(counts, vocabulary))
+    features, faculty_index, term_index = stage('feature_matrix', build_feature_matrix, counts, vocabulary,
+                                                faculty_df['Faculty_Full_Name'], top_n)
+    if last_stage < STAGES.index('pca'):
+        return results
+    _, pca_embeddings = stage('pca', fit_pca, features)
+    if last_stage < STAGES.index('umap'):
+        return results
+    umap_on_pca(np.random.default_rng(seed).random((50, num_components)), num_components)
+    embedding = stage('umap', umap_on_pca, pca_embeddings, num_components)
+    labels = stage('kmeans', KMeans(n_clusters=n_clusters, random_state=42, n_init=10).fit_predict, embedding)
+    stage('dbscan', _dbscan, embedding)
+    stage('leiden', _leiden, embedding)
+    stage('anova', cluster_feature_tests, pd.DataFrame(features.toarray(), columns=term_index), labels)
+    stage('similarity', cluster_similarity_report, features, labels)
+    stage('search', _search, features, faculty_index, term_index, n_queries)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _package_versions():
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = version(package)
+        except PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def compare(baseline_path, candidate_path):
+    """Table of per-stage time and peak memory ratios (candidate / baseline)."""
+    frames = []
+    for path in (baseline_path, candidate_path):
+        with open(path) as f:
+            frames.append(pd.DataFrame(json.load(f)['results']).set_index('stage'))
+    baseline, candidate = frames
+    return pd.DataFrame({
+        'baseline_s': baseline['seconds'], 'candidate_s': candidate['seconds'],
+        'time_ratio': candidate['seconds'] / baseline['seconds'],
+        'peak_ratio': candidate['peak_mb'] / baseline['peak_mb'],
+    }).dropna(how='all')
+
+
+def main():
+    if sys.argv[1:2] == ['compare']:
+        parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+        parser.add_argument('command')
+        parser.add_argument('baseline')
+        parser.add_argument('candidate')
+        args = parser.parse_args()
+        print(compare(args.baseline, args.candidate).to_string(float_format='{:.3f}'.format))
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic data.")
+    parser.add_argument('--size', choices=list(SIZES), default='department')
+    parser.add_argument('--faculty', type=int, help="Overrides the size's faculty count")
+    parser.add_argument('--terms', type=int, help="Overrides the size's vocabulary size")
+    parser.add_argument('--articles', type=int, help="efetch articles to parse (default: 2 per faculty member)")
+    parser.add_argument('--top-n', type=int, default=150, help="Feature terms kept in the matrix")
+    parser.add_argument('--components', type=int, default=1, help="PCA components fed to UMAP")
+    parser.add_argument('--clusters', type=int, default=20)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Results file (default: benchmark_<size>.json)")
+    args = parser.parse_args()
+
+    n_faculty, n_terms = SIZES[args.size]
+    n_faculty = args.faculty or n_faculty
+    n_terms = args.terms or n_terms
+    print(f"{n_faculty} faculty x {n_terms} terms")
+    results = run_benchmarks(n_faculty, n_terms, args.articles, args.top_n, args.components, args.clusters,
+                             stages=args.stages, seed=args.seed)
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'packages': _package_versions(),
+        'params': {'n_faculty': n_faculty, 'n_terms': n_terms, 'n_articles': args.articles or 2 * n_faculty,
+                   'top_n': args.top_n, 'num_components': args.components, 'n_clusters': args.clusters,
+                   'seed': args.seed, 'terms_per_source': DEFAULT_TERMS_PER_SOURCE},
+        'results': results,
+    }
+    output = args.output or f'benchmark_{args.size}.json'
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# Synthetic faculty x MeSH data at any scale, shaped like the real inputs
+#
+# Term frequencies follow a Zipf law. The most frequent terms are the generic ones the
+# pipeline removes ("Humans", "Mice", ...). Each faculty member belongs to a research
+# topic with its own Zipf ranking of the terms, so the data has cluster structure.
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+
+from term_matrix import DEFAULT_REMOVE_TERMS
+
+# Mean terms per faculty member from each source (proposals, research keywords, publications)
+DEFAULT_TERMS_PER_SOURCE = {
+    'Proposal_Mesh_Terms': 10,
+    'Mapped_Mesh_Terms': 6,
+    'pub_mesh_terms': 80,
+}
+
+
+def term_names(n_terms):
+    """The generic remove_terms first (the most frequent ranks), then numbered placeholder descriptors."""
+    generic = list(DEFAULT_REMOVE_TERMS[:n_terms])
+    return generic + [f"Synthetic Descriptor {i:05d}" for i in range(len(generic), n_terms)]
+
+
+def zipf_probabilities(n_terms, exponent=1.1):
+    weights = 1 / np.arange(1, n_terms + 1) ** exponent
+    return weights / weights.sum()
+
+
+class TermSampler:
+    """Draws term ids: a topic_share of the tokens from the faculty member's topic ranking, the rest globally."""
+
+    def __init__(self, n_terms, n_topics=20, exponent=1.1, topic_share=0.7, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.probabilities = zipf_probabilities(n_terms, exponent)
+        self.topic_share = topic_share
+        n_generic = min(len(DEFAULT_REMOVE_TERMS), n_terms)
+        # Topics reorder everything but the generic terms, which stay frequent everywhere
+        self.rankings = np.stack([np.concatenate([np.arange(n_generic),
+                                                  n_generic + self.rng.permutation(n_terms - n_generic)])
+                                  for _ in range(n_topics)])
+
+    def sample(self, topic, size):
+        ranks = self.rng.choice(len(self.probabilities), size, p=self.probabilities)
+        from_topic = self.rng.random(size) < self.topic_share
+        return np.where(from_topic, self.rankings[topic][ranks], ranks)
+
+
+def synthetic_faculty(n_faculty, n_terms, terms_per_source=None, n_topics=20, exponent=1.1, seed=0):
+    """DataFrame like the pipeline's combined_faculty_df: Faculty_Full_Name plus one ';' separated
+    term column per source, with Poisson-distributed term counts per faculty member."""
+    terms_per_source = DEFAULT_TERMS_PER_SOURCE if terms_per_source is None else terms_per_source
+    names = np.asarray(term_names(n_terms), dtype=object)
+    sampler = TermSampler(n_terms, n_topics, exponent, seed=seed)
+    topics = sampler.rng.integers(n_topics, size=n_faculty)
+    columns = {'Faculty_Full_Name': [f"Faculty, Synthetic {i:05d}" for i in range(n_faculty)]}
+    for column, mean_terms in terms_per_source.items():
+        sizes = sampler.rng.poisson(mean_terms, size=n_faculty)
+        columns[column] = ['; '.join(names[sampler.sample(topic, size)]) for topic, size in zip(topics, sizes)]
+    return pd.DataFrame(columns)
+
+
+def synthetic_efetch_xml(n_articles, n_terms, headings_per_article=12, n_topics=20, exponent=1.1, seed=0):
+    """A PubmedArticleSet efetch payload (bytes) with Zipf-distributed MeSH headings."""
+    names = [escape(name) for name in term_names(n_terms)]
+    sampler = TermSampler(n_terms, n_topics, exponent, seed=seed)
+    parts = ['<?xml version="1.0"?>\n<PubmedArticleSet>\n']
+    for pmid in range(1, n_articles + 1):
+        term_ids = np.unique(sampler.sample(pmid % n_topics, max(1, sampler.rng.poisson(headings_per_article))))
+        headings = ''.join(
+            f'<MeshHeading><DescriptorName UI="D{term_id:06d}" MajorTopicYN="{"Y" if i == 0 else "N"}">'
+            f'{names[term_id]}</DescriptorName></MeshHeading>'
+            for i, term_id in enumerate(term_ids))
+        parts.append(f'<PubmedArticle><MedlineCitation><PMID Version="1">{pmid}</PMID>'
+                     f'<MeshHeadingList>{headings}</MeshHeadingList></MedlineCitation></PubmedArticle>\n')
+    parts.append('</PubmedArticleSet>\n')
+    return ''.join(parts).encode()
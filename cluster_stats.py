@@ -0,0 +1,148 @@
+# Per-feature significance tests between clusters, computed for all features at once
+import numpy as np
+import pandas as pd
+from scipy import sparse, stats
+from sklearn.preprocessing import normalize
+from statsmodels.stats.multitest import multipletests
+
+
+def _group_indicator(labels):
+    """Returns (k x n sparse one-hot group matrix, group sizes)."""
+    groups, codes = np.unique(np.asarray(labels), return_inverse=True)
+    n = len(codes)
+    indicator = sparse.csr_matrix((np.ones(n), (codes, np.arange(n))), shape=(len(groups), n))
+    return indicator, np.bincount(codes, minlength=len(groups)).astype(float)
+
+
+def _as_array(X):
+    if isinstance(X, pd.DataFrame):
+        X = X.to_numpy(dtype=float)
+    if sparse.issparse(X):
+        return X.tocsr().astype(float)
+    return np.asarray(X, dtype=float)
+
+
+def anova_pvalues(X, labels):
+    """One-way ANOVA F-test p-value for every column of X (dense or sparse) across label groups.
+
+    Equivalent to fitting ols('feature ~ C(cluster)') and anova_lm per column. Columns
+    with no variation get p = 1.
+    """
+    X = _as_array(X)
+    indicator, group_sizes = _group_indicator(labels)
+    n, k = X.shape[0], len(group_sizes)
+    totals = np.asarray(X.sum(axis=0)).ravel()
+    group_sums = indicator @ X
+    group_sums = group_sums.toarray() if sparse.issparse(group_sums) else np.asarray(group_sums)
+    sum_squares = np.asarray((X.multiply(X) if sparse.issparse(X) else X * X).sum(axis=0)).ravel()
+    correction = totals ** 2 / n
+    ss_between = np.maximum((group_sums ** 2 / group_sizes[:, None]).sum(axis=0) - correction, 0)
+    ss_within = np.maximum(sum_squares - correction - ss_between, 0)
+    df_between, df_within = k - 1, n - k
+    if df_between < 1 or df_within < 1:
+        return np.ones(X.shape[1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f_stat = (ss_between / df_between) / (ss_within / df_within)
+    p_values = stats.f.sf(f_stat, df_between, df_within)
+    # Constant columns (0/0) are not significant
+    return np.where(np.isnan(p_values), 1.0, p_values)
+
+
+def kruskal_pvalues(X, labels):
+    """Kruskal-Wallis H-test p-value (tie corrected) for every column of X across label groups."""
+    X = _as_array(X)
+    if sparse.issparse(X):
+        X = X.toarray()
+    indicator, group_sizes = _group_indicator(labels)
+    n, k = X.shape[0], len(group_sizes)
+    if k < 2:
+        return np.ones(X.shape[1])
+    min_ranks = stats.rankdata(X, method='min', axis=0)
+    max_ranks = stats.rankdata(X, method='max', axis=0)
+    ranks = (min_ranks + max_ranks) / 2
+    # Every element of a tie group of size t contributes t^2 - 1, so the sum is sum(t^3 - t)
+    tie_sizes = max_ranks - min_ranks + 1
+    tie_correction = 1 - (tie_sizes ** 2 - 1).sum(axis=0) / (n ** 3 - n)
+    rank_sums = indicator @ ranks
+    h_stat = 12 / (n * (n + 1)) * (rank_sums ** 2 / group_sizes[:, None]).sum(axis=0) - 3 * (n + 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        h_stat = h_stat / tie_correction
+    p_values = stats.chi2.sf(h_stat, k - 1)
+    return np.where(np.isnan(p_values), 1.0, p_values)
+
+
+def cluster_feature_tests(feature_matrix, labels, method='anova', alpha=0.05, feature_names=None):
+    """Tests every feature for differences between clusters and applies the BH (FDR) correction.
+
+    method is 'anova' (one-way F-test) or 'kruskal' (Kruskal-Wallis, for skewed,
+    zero-heavy features). Returns a DataFrame with Feature, p_value, adjusted_p_values
+    and significant columns, sorted by adjusted p-value.
+    """
+    if feature_names is None:
+        feature_names = list(feature_matrix.columns)
+    if method == 'anova':
+        p_values = anova_pvalues(feature_matrix, labels)
+    elif method == 'kruskal':
+        p_values = kruskal_pvalues(feature_matrix, labels)
+    else:
+        raise ValueError(f"Unknown test method: {method!r}")
+    _, adjusted_p_values, _, _ = multipletests(p_values, method='fdr_bh', alpha=alpha)
+    results_df = pd.DataFrame({
+        'Feature': feature_names,
+        'p_value': p_values,
+        'adjusted_p_values': adjusted_p_values,
+        'significant': adjusted_p_values < alpha
+    })
+    return results_df.sort_values('adjusted_p_values')
+
+
+def cluster_similarity_report(X, labels):
+    """Within- and between-cluster mean cosine similarity plus per-cluster silhouettes, in one pass.
+
+    Rows are L2-normalized once and summed per cluster; with S_a the sum of cluster a's
+    unit vectors, the mean pairwise similarity between clusters a and b is S_a.S_b / (n_a n_b)
+    and within cluster a it is (|S_a|^2 - n_a) / (n_a (n_a - 1)), so no pairwise matrix is
+    built. The silhouette (cosine distance) of every row comes from the same sums.
+
+    Returns a DataFrame indexed by cluster with Size, Average_Similarity (within),
+    Mean_Silhouette and one Similarity_to_<cluster> column per cluster (the diagonal
+    repeats the within-cluster value).
+    """
+    X = normalize(_as_array(X))
+    indicator, group_sizes = _group_indicator(labels)
+    groups, codes = np.unique(np.asarray(labels), return_inverse=True)
+    cluster_sums = indicator @ X
+    cluster_sums = cluster_sums.toarray() if sparse.issparse(cluster_sums) else np.asarray(cluster_sums)
+    # Rows without terms normalize to zero vectors, so subtract the actual self-similarities
+    self_similarity = np.asarray((X.multiply(X) if sparse.issparse(X) else X * X).sum(axis=1)).ravel()
+    cluster_self_similarity = indicator @ self_similarity
+    gram = cluster_sums @ cluster_sums.T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        similarity = gram / np.outer(group_sizes, group_sizes)
+        within = (np.diag(gram) - cluster_self_similarity) / (group_sizes * (group_sizes - 1))
+    within[group_sizes <= 1] = np.nan
+    np.fill_diagonal(similarity, within)
+
+    # Mean cosine distance of every row to each cluster (its own cluster excludes the row itself)
+    row_cluster_similarity = np.asarray(X @ cluster_sums.T)
+    n = len(codes)
+    own_sizes = group_sizes[codes] - 1
+    row_cluster_similarity[np.arange(n), codes] -= self_similarity
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_distance = 1 - row_cluster_similarity / group_sizes
+        mean_distance[np.arange(n), codes] = 1 - row_cluster_similarity[np.arange(n), codes] / own_sizes
+    if len(groups) > 1:
+        intra = mean_distance[np.arange(n), codes]
+        mean_distance[np.arange(n), codes] = np.inf
+        nearest = mean_distance.min(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            silhouettes = np.where(own_sizes > 0, (nearest - intra) / np.maximum(intra, nearest), 0.0)
+        silhouettes = np.nan_to_num(silhouettes)
+        mean_silhouette = (indicator @ silhouettes) / group_sizes
+    else:
+        mean_silhouette = np.full(1, np.nan)
+
+    report = pd.DataFrame({'Size': group_sizes.astype(int), 'Average_Similarity': within,
+                           'Mean_Silhouette': mean_silhouette}, index=pd.Index(groups, name='cluster'))
+    between = pd.DataFrame(similarity, index=report.index, columns=[f'Similarity_to_{group}' for group in groups])
+    return pd.concat([report, between], axis=1)
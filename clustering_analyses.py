@@ -1,30 +1,36 @@
-from collections import Counter
 import pandas as pd
 import numpy as np
-from sklearn.decomposition import PCA
+from scipy import sparse
 import umap
 from umap import UMAP
 import plotly.express as px
 import plotly.graph_objects as go
 from sklearn.manifold import TSNE
 from sklearn.cluster import KMeans, DBSCAN
-from sklearn.neighbors import NearestNeighbors
 from sklearn.metrics import silhouette_score
 import matplotlib.pyplot as plt
 import seaborn as sns
-import statsmodels.api as sm
-from statsmodels.formula.api import ols
 from statsmodels.stats.multicomp import pairwise_tukeyhsd
-from statsmodels.stats.multitest import multipletests
 import os
 import kaleido
 import networkx as nx
 import leidenalg as la
 import igraph as ig
 from sklearn.preprocessing import StandardScaler
+from artifacts import load_feature_matrix, file_hash
+from cluster_stats import cluster_feature_tests, cluster_similarity_report
+from term_matrix import top_terms_per_row
+from embedding_store import open_embedding_store, DEFAULT_N_NEIGHBORS, DEFAULT_MIN_DIST
+from sweep import compute_embeddings, sweep_clusterers
+from neighbor_graph import neighbor_graph, suggest_eps
+from faculty_search import FacultySearchIndex
+from reduction import fit_pca
+from consensus import co_association, stability_report
+from instrumentation import RunRecorder
 
 config = {
-    'file_path': 'mesh_terms_matrix_5yrs_and_keywords.xlsx',
+    'file_path': 'mesh_terms_matrix.npz',  # Written by Biopython_Entrez.py (.xlsx exports still load)
+    'embedding_store_path': 'umap_embeddings',  # Written by `python embedding_store.py precompute`
     'pca_components_to_try': range(1, 7),
     'final_pca_components': 5,
     'dbscan_eps': 0.05,
@@ -33,22 +39,39 @@ config = {
     'leiden_resolution_umap': 0.8,
     'kmeans_n_clusters': 5,
     'silhouette_k_range': range(2, 20),
+    'sweep_jobs': -1,  # Worker processes for the UMAP / KMeans / silhouette sweeps (-1 = all cores)
+    'consensus_resamples': 0,  # Bootstrap resamples scoring the stability of the final clusters (e.g. 200); 0 skips
+    'consensus_faculty_fraction': 0.8,  # Share of faculty drawn per resample
+    'consensus_feature_fraction': 1.0,  # Share of terms drawn per resample
+    'cluster_stability_output_path': 'Cluster_stability.csv',
+    'faculty_stability_output_path': 'Faculty_cluster_stability.csv',
     'anova_alpha': 0.05,
+    'anova_method': 'anova',  # 'anova' (one-way F-test) or 'kruskal' (Kruskal-Wallis, for skewed zero-heavy terms)
     'top_n_features_to_plot': 10,
     'cluster_output_path': 'Professors_in_clusters.csv',
     'anova_output_path': 'significant_terms_per_cluster.csv', 
     'top_mesh_terms_output_path': 'Top_Mesh_Terms_Per_Professor.csv',
+    'run_report_path': 'run_report_clustering.json',  # Per-stage timings; None turns them off
 }
 
+recorder = RunRecorder('clustering_analyses', enabled=config['run_report_path'] is not None)
+
 def load_and_preprocess_data(file_path, index_col='Faculty_Full_Name'):
-    """Loads and preprocesses the raw data."""
-    raw_data = pd.read_excel(file_path, index_col=index_col)
-    raw_data.reset_index(inplace=True)
-    faculty_names_df = pd.read_excel(file_path, usecols=['Faculty_Full_Name'])
-    feature_matrix = raw_data.drop(columns=['Faculty_Full_Name'])
+    """Loads and preprocesses the raw data; also returns the features as a sparse matrix for PCA."""
+    if file_path.endswith('.npz'):
+        features, faculty_index, term_index = load_feature_matrix(file_path)
+        raw_data = pd.DataFrame(features.toarray(), columns=['Normalized_' + term for term in term_index])
+        raw_data.insert(0, index_col, faculty_index)
+    else:
+        raw_data = pd.read_excel(file_path)
+        features = None
+    faculty_names_df = raw_data[[index_col]].copy()
+    feature_matrix = raw_data.drop(columns=[index_col])
     raw_data.columns = raw_data.columns.str.replace(' ', '_').str.replace('-', '_').str.replace(',', '_')
     feature_matrix.columns = feature_matrix.columns.str.replace(' ', '_').str.replace('-', '_').str.replace(',', '_')
-    return raw_data, feature_matrix, faculty_names_df
+    if features is None:
+        features = sparse.csr_matrix(feature_matrix.to_numpy(dtype=float))
+    return raw_data, feature_matrix, faculty_names_df, features
 
 def fig_show(fig):
     fig.update_layout(plot_bgcolor='#255799')
@@ -58,32 +81,29 @@ def fig_show(fig):
     fig.update_yaxes(showticklabels=False)
     fig.show()
 
-raw_data, feature_matrix, faculty_names_df = load_and_preprocess_data(config['file_path'])
+recorder.begin('load_matrix')
+raw_data, feature_matrix, faculty_names_df, sparse_features = load_and_preprocess_data(config['file_path'])
+recorder.matrix('features', feature_matrix)
 
 mesh_term_columns = [col for col in feature_matrix.columns]
 
-# Calculate the top 3 MeSH terms for each professor
-top_mesh_terms_list = []
-faculty_names = []
-for index, row in raw_data.iterrows():
-    professor_name = row['Faculty_Full_Name']
-    mesh_term_counts = Counter()
-    for term in mesh_term_columns:
-        count = row[term]
-        if count > 0:
-            mesh_term_counts[term] = count
-    top_3_terms_with_prefix = [term for term, count in mesh_term_counts.most_common(5)]
-    top_3_terms_clean = [term.replace('Normalized_', '') for term in top_3_terms_with_prefix]
-    top_mesh_terms_list.append([top_3_terms_clean])  # Store as a list within a list
-    faculty_names.append(professor_name)
-
-top_mesh_terms_df = pd.DataFrame({'Faculty_Full_Name': faculty_names, 'Top_Mesh_Terms': top_mesh_terms_list})
+# Calculate the top 5 MeSH terms (and their weights) for each professor
+recorder.begin('top_terms')
+top_terms, top_weights = top_terms_per_row(feature_matrix.to_numpy(dtype=float),
+                                           [term.replace('Normalized_', '') for term in mesh_term_columns], 5)
+top_mesh_terms_df = pd.DataFrame({'Faculty_Full_Name': raw_data['Faculty_Full_Name'],
+                                  'Top_Mesh_Terms': top_terms, 'Top_Mesh_Term_Weights': top_weights})
 top_mesh_terms_df.set_index('Faculty_Full_Name', inplace=True)
-top_mesh_terms_df.to_csv(config['top_mesh_terms_output_path'])
+top_mesh_terms_df.assign(
+    Top_Mesh_Terms=top_mesh_terms_df['Top_Mesh_Terms'].str.join('; '),
+    Top_Mesh_Term_Weights=top_mesh_terms_df['Top_Mesh_Term_Weights'].map(
+        lambda weights: '; '.join(f'{weight:.4g}' for weight in weights))
+).to_csv(config['top_mesh_terms_output_path'])
 
+recorder.begin('pca')
 # Set up and run PCA on the raw data (columns = MeSH terms, rows = faculty members, values = frquency of terms)
-pca = PCA()
-pca_embeddings = pca.fit_transform(feature_matrix)
+# Only the first 10 components are used below, so only those are computed
+pca, pca_embeddings = fit_pca(sparse_features)
 
 # Visualize explained variance
 explained_variance = pca.explained_variance_ratio_
@@ -105,6 +125,7 @@ fig = px.scatter(pca_embeddings_df, x='PC1', y='PC2', hover_name='Faculty_Full_N
 fig.show()
 
 # Set up UMAP
+recorder.begin('umap_raw')
 ## UMAP is a non-linear dimensionality reduction technique that has more power than a PCA.
 umap_embeddings = UMAP().fit_transform(feature_matrix) # UMAP is running on the raw data
 
@@ -120,15 +141,14 @@ fig = px.scatter(umap_embeddings_df, x="V1", y="V2", title="UMAP", hover_name="F
 fig_show(fig)
 
 # Run an elbow plot
+recorder.begin('elbow')
 ## An elbow plot gives a rough value for the number of components to run UMAP on. Then, we will plug this number (where the elbow bends) into the num_components parameter in UMAP.
 numeric_data_umap = umap_embeddings_df.select_dtypes(include=['number'])
 scaler = StandardScaler()
 scaled_data_umap = scaler.fit_transform(numeric_data_umap)
-wcss = []
-for i in range(1, 11):
-    kmeans = KMeans(n_clusters=i, random_state=42, n_init="auto")
-    kmeans.fit(scaled_data_umap)
-    wcss.append(kmeans.inertia_)
+elbow_results = sweep_clusterers(scaled_data_umap, {'kmeans': {'n_clusters': range(1, 11), 'n_init': ['auto']}},
+                                random_state=42, n_jobs=config['sweep_jobs'])
+wcss = elbow_results['inertia'].tolist()
 plt.figure(figsize=(10, 6))
 plt.plot(range(1, 11), wcss, marker='o', linestyle='--')
 plt.title('Elbow Method (UMAP)')
@@ -139,8 +159,9 @@ plt.grid(True)
 plt.show()
 
 # Run UMAP with PCA components
+recorder.begin('umap_pca')
 # UMAP takes into account different dimensions and represnts the information in 2D. If you want smaller and more refined clusters, then use more components. But the starting number of components is usually based on the elbow plot.
-pca_result = PCA().fit_transform(feature_matrix)
+pca_result = pca_embeddings  # Reuse the PCA fitted above
 num_components = 3
 pca_reduced_features = pca_result[:, :num_components]
 umap_result = UMAP().fit_transform(pca_reduced_features)
@@ -154,9 +175,22 @@ fig = px.scatter(umap_df_pca, x="V1", y="V2", title="UMAP on PCA Components", ho
 fig_show(fig)
 
 # Run UMAPs by iterating through different number of PCA components
+recorder.begin('umap_component_sweep')
+# Precomputed embeddings are used when the store was built from this feature matrix
+embedding_store = (open_embedding_store(config['embedding_store_path'], file_hash(config['file_path']))
+                   if config['file_path'].endswith('.npz') else None)
+
+umap_results = {num_components: embedding_store.get(num_components) if embedding_store is not None else None
+                for num_components in [*config['pca_components_to_try'], 1]}
+# Whatever the store does not cover is computed in parallel
+missing_components = [num_components for num_components, umap_result in umap_results.items() if umap_result is None]
+computed = compute_embeddings(pca_result, [(num_components, DEFAULT_N_NEIGHBORS, DEFAULT_MIN_DIST)
+                                           for num_components in missing_components],
+                              n_jobs=config['sweep_jobs'])
+umap_results.update({num_components: umap_result for (num_components, _, _), umap_result in computed.items()})
+
 for num_components in config['pca_components_to_try']:
-    pca_reduced_features = pca_result[:, :num_components]
-    umap_result = UMAP(random_state=123).fit_transform(pca_reduced_features)
+    umap_result = umap_results[num_components]
     umap_df_pca = pd.DataFrame(umap_result, columns=["V1", "V2"])
     umap_df_pca['Faculty_Full_Name'] = raw_data['Faculty_Full_Name']
     umap_df_pca = umap_df_pca.merge(top_mesh_terms_df, on='Faculty_Full_Name', how='left')
@@ -170,35 +204,41 @@ for num_components in config['pca_components_to_try']:
 # Update the number of components after iteration and looking at the elbow plot. This update will be used for the rest of the analysis.
 num_components = 1
 pca_reduced_features = pca_result[:, :num_components]
-umap_result = UMAP(random_state=123).fit_transform(pca_reduced_features)
+umap_result = umap_results[num_components]
 umap_df_pca = pd.DataFrame(umap_result, columns=["V1", "V2"])
 umap_df_pca['Faculty_Full_Name'] = raw_data['Faculty_Full_Name']
 umap_df_pca = umap_df_pca.merge(top_mesh_terms_df, on='Faculty_Full_Name', how='left')
 
 # Cluster UMAP with DBSCAN
-knn = NearestNeighbors(n_neighbors=2)
-knn.fit(pca_reduced_features)
-distances, indices = knn.kneighbors(pca_reduced_features)
-dbscan_model = DBSCAN(eps=0.05, min_samples=2).fit(pca_reduced_features)
+recorder.begin('dbscan')
+## The knee of the k-distance curve (distance to the (min_samples - 1)-th neighbor) is a starting point for eps
+k_distances = neighbor_graph(pca_reduced_features, config['dbscan_min_samples']).k_distances(config['dbscan_min_samples'])
+plt.figure(figsize=(10, 6))
+plt.plot(k_distances)
+plt.axhline(config['dbscan_eps'], color='gray', linestyle='--')
+plt.xlabel('Faculty (sorted)')
+plt.ylabel(f"Distance to neighbor {config['dbscan_min_samples'] - 1}")
+plt.title('k-distance Curve (DBSCAN eps)')
+plt.grid(True)
+plt.show()
+print(f"Suggested DBSCAN eps from the k-distance curve: {suggest_eps(k_distances):.3f} (using {config['dbscan_eps']})")
+dbscan_model = DBSCAN(eps=config['dbscan_eps'], min_samples=config['dbscan_min_samples']).fit(pca_reduced_features)
 umap_df_pca['cluster'] = dbscan_model.labels_
 umap_df_pca['Faculty_Full_Name'] = raw_data['Faculty_Full_Name'] # Add faculty names back to dataframe
 
 # This section runs K-means clustering on UMAP coordinates.
 
 # Identify optimal number of clusters using silhouette score
+recorder.begin('silhouette')
 ## Can go with highest peak but then won't include as many clusters. Can have a rule that I want X number of clusters.
-def avg_silhouette(data, k):
-    kmeans = KMeans(n_clusters=k, random_state=123, n_init="auto").fit(data)
-    labels = kmeans.labels_
-    sil_score = silhouette_score(data, labels)
-    return sil_score
-
 # Create a clean dataframe with only numeric columns for clustering
 umap_embeddings_for_silhouette = umap_df_pca[['V1', 'V2']].copy()
 
-# Calculate silhouette scores for different K values
+# Calculate silhouette scores for different K values (all fits run in parallel)
 k_values = range(2, 10)
-silhouette_scores = [avg_silhouette(umap_embeddings_for_silhouette, k) for k in k_values]
+silhouette_results = sweep_clusterers(umap_embeddings_for_silhouette, {'kmeans': {'n_clusters': k_values, 'n_init': ['auto']}},
+                                      random_state=123, n_jobs=config['sweep_jobs'])
+silhouette_scores = silhouette_results['silhouette'].tolist()
 
 # Calculate silhouette scores for different K
 # Min number of clusters is 2. Max number of clusters is 50.
@@ -216,6 +256,7 @@ optimal_k = k_values[np.argmax(silhouette_scores)]
 print(f"Optimal number of clusters based on silhouette score: {optimal_k}")
 
 ### K-means clustering on UMAP coordinates
+recorder.begin('kmeans')
 # Number of clusters for K-means
 n_clusters = 20 # You can adjust this parameter to get desired number of clusters
 
@@ -245,7 +286,20 @@ fig = px.scatter(
 )
 fig_show(fig)
 
+# Stability of the K-means clusters: rerun PCA -> UMAP -> K-means on bootstrap resamples of the faculty
+if config['consensus_resamples']:
+    recorder.begin('consensus')
+    consensus = co_association(feature_matrix, config['consensus_resamples'], n_clusters, num_components=1,
+                               faculty_fraction=config['consensus_faculty_fraction'],
+                               feature_fraction=config['consensus_feature_fraction'], n_jobs=config['sweep_jobs'])
+    cluster_stability_df, faculty_stability_df = stability_report(consensus, cluster_labels,
+                                                                  raw_data['Faculty_Full_Name'])
+    print(cluster_stability_df.sort_values('Consensus').to_string())
+    cluster_stability_df.to_csv(config['cluster_stability_output_path'])
+    faculty_stability_df.to_csv(config['faculty_stability_output_path'], index=False)
+
 # Process clustering results and prepare for analysis
+recorder.begin('anova')
 ## This block creates a dataframe with numeric data, adds cluster labels, ensures proper data types, and identifies feature columns for further analysis
 filtered_data_df = pd.DataFrame(feature_matrix)  # Create a new dataframe with numeric data
 filtered_data_df['cluster'] = kmeans.labels_  # Add cluster labels to the dataframe
@@ -259,36 +313,9 @@ cluster_feature_matrix['cluster'] = cluster_feature_matrix['cluster'].astype('ca
 # Get feature names (all columns except 'cluster')
 feature_names = [col for col in cluster_feature_matrix.columns if col != 'cluster']
 
-# Function to run ANOVA for each feature
-def get_anova_pvalues(feature, data):
-    model = ols(f"{feature} ~ C(cluster)", data=data).fit()
-    anova_table = sm.stats.anova_lm(model, typ=2)
-    return anova_table["PR(>F)"][0]  # p-value
-
-# Calculate p-values for all features
-feature_p_values = {}
-for feature in feature_names:
-    try:
-        feature_p_values[feature] = get_anova_pvalues(feature, cluster_feature_matrix)
-    except:
-        print(f"Error processing feature: {feature}")
-        feature_p_values[feature] = 1.0  # Default to not significant
-
-# Adjust p-values using Benjamini-Hochberg method (FDR correction)
-feature_list = list(feature_p_values.keys())
-pval_list = list(feature_p_values.values())
-_, adjusted_p_values, _, _ = multipletests(pval_list, method='fdr_bh', alpha=0.05)
-
-# Create results dataframe
-results_df = pd.DataFrame({
-    'Feature': feature_list,
-    'p_value': pval_list,
-    'adjusted_p_values': adjusted_p_values,
-    'significant': adjusted_p_values < 0.05
-})
-
-# Sort by adjusted p-value
-results_df = results_df.sort_values('adjusted_p_values')
+# Test every feature for differences between clusters in one vectorized pass (ANOVA or Kruskal-Wallis), with BH (FDR) correction
+results_df = cluster_feature_tests(cluster_feature_matrix[feature_names], cluster_feature_matrix['cluster'],
+                                   method=config['anova_method'], alpha=config['anova_alpha'])
 
 # Print significant features
 significant_features_df = results_df[results_df['significant']]
@@ -313,35 +340,13 @@ def plot_top_features(cluster_feature_matrix, significant_features_df, top_n=10)
 if len(significant_features_df) > 0:
     plot_top_features(cluster_feature_matrix, significant_features_df)
 
-# Calculate average similarity within each cluster
-within_cluster_similarity = {}
-for cluster_id in cluster_feature_matrix['cluster'].unique():
-    # Get data for this cluster
-    cluster_data = cluster_feature_matrix[cluster_feature_matrix['cluster'] == cluster_id][feature_names]
-    
-    # Skip if only one member in cluster
-    if len(cluster_data) <= 1:
-        within_cluster_similarity[cluster_id] = float('nan')
-        continue
-        
-    # Calculate pairwise cosine similarities
-    from sklearn.metrics.pairwise import cosine_similarity
-    similarities = cosine_similarity(cluster_data)
-    
-    # Average similarity (excluding self-similarity on diagonal)
-    n = similarities.shape[0]
-    total_sim = similarities.sum() - n  # Subtract diagonal (self-similarities)
-    avg_sim = total_sim / (n * (n - 1))  # n(n-1) pairs
-    
-    within_cluster_similarity[cluster_id] = avg_sim
-
-# Create DataFrame and save
-similarity_df = pd.DataFrame.from_dict(within_cluster_similarity, 
-                                      orient='index', 
-                                      columns=['Average_Similarity'])
+# Average cosine similarity within each cluster and between every pair of clusters, plus each cluster's mean silhouette
+recorder.begin('similarity')
+similarity_df = cluster_similarity_report(cluster_feature_matrix[feature_names], cluster_feature_matrix['cluster'])
 similarity_df.to_csv("Within_cluster_similarity.csv")
 
 # Visualize Cluster Profiles
+recorder.begin('cluster_profiles')
 # Create a heatmap of top terms across clusters
 top_n = 20  # Number of top terms to include (adjust as needed)
 significant_terms = significant_features_df['Feature'].head(top_n).tolist()
@@ -363,28 +368,27 @@ feature_names = filtered_data_df.columns[:-1]
 umap_df_pca = umap_df_pca.drop(columns=['Faculty_Full_Name'])
 
 # Display all unique mesh terms associated with professor
-def get_faculty_mesh_terms(faculty_list, raw_data, mesh_term_columns):
-    faculty_mesh_terms = {}
-    all_terms = []
+recorder.begin('faculty_search')
+search_index = FacultySearchIndex(sparse_features, raw_data['Faculty_Full_Name'],
+                                  [term.replace('Normalized_', '') for term in mesh_term_columns])
 
+def get_faculty_mesh_terms(faculty_list, search_index):
+    faculty_mesh_terms = {}
     for faculty_name in faculty_list:
-        if faculty_name in raw_data['Faculty_Full_Name'].values:
-            faculty_row = raw_data[raw_data['Faculty_Full_Name'] == faculty_name].iloc[0]
-            unique_terms = [term for term in mesh_term_columns if faculty_row[term] > 0]
-            faculty_mesh_terms[faculty_name] = unique_terms
-            all_terms.extend(unique_terms)
-        else:
+        try:
+            faculty_mesh_terms[faculty_name] = search_index.faculty_terms(faculty_name)
+        except KeyError:
             faculty_mesh_terms[faculty_name] = f"Faculty member '{faculty_name}' not found in the data."
 
-    # Find overlapping terms
-    term_counts = Counter(all_terms)
-    overlapping_terms = {term for term, count in term_counts.items() if count == len(faculty_list) and term in [term for terms in faculty_mesh_terms.values() if isinstance(terms, list) for term in terms]}
+    # Terms shared by every faculty member in the list (none if anyone is missing)
+    term_sets = [set(terms) if isinstance(terms, list) else set() for terms in faculty_mesh_terms.values()]
+    overlapping_terms = set.intersection(*term_sets) if term_sets else set()
 
     return faculty_mesh_terms, overlapping_terms
 
 # Example Usage (assuming your raw_data and mesh_term_columns are already defined):
 faculty_to_check = ['Briscoe, Adriana', 'Emerson, J.J.', 'German, Donovan', 'Hammer, Tobin', 'Martiny, Jennifer', 'Mooney, Kailen', 'Rodriguez Verdugo, Alejandra']
-faculty_mesh_results, common_terms = get_faculty_mesh_terms(faculty_to_check, raw_data, mesh_term_columns)
+faculty_mesh_results, common_terms = get_faculty_mesh_terms(faculty_to_check, search_index)
 
 for faculty, terms in faculty_mesh_results.items():
     print(f"{faculty}: {terms}")
@@ -392,7 +396,13 @@ for faculty, terms in faculty_mesh_results.items():
 print("\nOverlapping MeSH terms:")
 print(common_terms)
 
+# Faculty whose profiles are most similar to the group's (see faculty_search.py for the CLI)
+print("\nFaculty most similar to this group:")
+for result in search_index.similar_to_group([name for name in faculty_to_check if name in search_index.faculty_ids], k=5):
+    print(f"{result.faculty} ({result.score:.3f}): {', '.join(term for term, _ in result.shared_terms)}")
+
 # Save outputs
+recorder.begin('save_outputs')
 sig_df_path = "significant_terms_per_cluster.csv"
 cluster_df_path = "faculty_in_clusters.csv"
 fig_path = "umap_professors_clusters.pdf"
@@ -418,4 +428,6 @@ significant_features_output_df = pd.DataFrame({
     'Feature': significant_features_df['Feature'].tolist(),
     'P-Value_Adjusted': results_df['adjusted_p_values'].tolist()[:len(significant_features_df)]
 })
-significant_features_output_df.to_csv(sig_df_path, index=True)
\ No newline at end of file
+significant_features_output_df.to_csv(sig_df_path, index=True)
+
+recorder.write(config['run_report_path'])
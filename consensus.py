@@ -0,0 +1,156 @@
+# Bootstrap consensus clustering: how stable are the PCA -> UMAP -> KMeans clusters?
+#
+# Every resample draws a subset of faculty (and optionally of terms), reruns the whole
+# PCA -> UMAP -> KMeans chain on it and records which sampled pairs land in the same
+# cluster. Resamples run in chunks on a joblib process pool; each chunk accumulates its
+# counts in condensed upper-triangular float32 buffers (one entry per faculty pair, the
+# layout of scipy's pdist), which are summed as the chunks finish.
+#
+# Usage:
+#   python consensus.py --input mesh_terms_matrix.npz --resamples 200 --clusters 20 --components 1
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed, effective_n_jobs
+from scipy import sparse
+from scipy.cluster.hierarchy import linkage, fcluster
+from sklearn.cluster import KMeans
+
+from artifacts import load_feature_matrix
+from embedding_store import DEFAULT_N_NEIGHBORS, DEFAULT_MIN_DIST, RANDOM_STATE, umap_on_pca
+from reduction import fit_pca
+
+
+def pair_indices(members, n):
+    """Condensed (pdist-order) indices of every pair among sorted row indices of an n-row matrix."""
+    members = np.asarray(members, dtype=np.int64)
+    i, j = np.triu_indices(len(members), 1)
+    a, b = members[i], members[j]
+    return n * a - a * (a + 1) // 2 + b - a - 1
+
+
+def _resample_labels(feature_matrix, seed, n_clusters, num_components, faculty_fraction, feature_fraction,
+                     n_neighbors, min_dist):
+    rng = np.random.default_rng(seed)
+    n_rows, n_features = feature_matrix.shape
+    rows = np.sort(rng.choice(n_rows, max(n_clusters + 1, round(faculty_fraction * n_rows)), replace=False))
+    columns = np.sort(rng.choice(n_features, max(num_components, round(feature_fraction * n_features)),
+                                 replace=False))
+    _, pca_embeddings = fit_pca(feature_matrix[rows][:, columns], num_components, int(seed))
+    embedding = umap_on_pca(pca_embeddings, num_components, n_neighbors, min_dist, random_state=int(seed))
+    labels = KMeans(n_clusters=n_clusters, random_state=int(seed), n_init=10).fit_predict(embedding)
+    return rows, labels
+
+
+def _co_association_chunk(feature_matrix, seeds, *resample_args):
+    n = feature_matrix.shape[0]
+    together = np.zeros(n * (n - 1) // 2, dtype=np.float32)
+    sampled = np.zeros_like(together)
+    for seed in seeds:
+        rows, labels = _resample_labels(feature_matrix, seed, *resample_args)
+        sampled[pair_indices(rows, n)] += 1
+        for cluster in np.unique(labels):
+            together[pair_indices(rows[labels == cluster], n)] += 1
+    return together, sampled
+
+
+def co_association(feature_matrix, n_resamples=100, n_clusters=20, num_components=1, faculty_fraction=0.8,
+                   feature_fraction=1.0, n_neighbors=DEFAULT_N_NEIGHBORS, min_dist=DEFAULT_MIN_DIST,
+                   random_state=RANDOM_STATE, n_jobs=-1):
+    """Condensed float32 consensus matrix: for every faculty pair, the fraction of the resamples
+    containing both in which they were clustered together (0 if never sampled together).
+
+    faculty_fraction and feature_fraction are the shares of rows and columns drawn (without
+    replacement) for each resample; every resample is seeded from random_state.
+    """
+    feature_matrix = sparse.csr_matrix(feature_matrix if sparse.issparse(feature_matrix) else np.asarray(feature_matrix),
+                                       dtype=float)
+    if feature_matrix.shape[0] <= n_clusters:
+        raise ValueError(f"Consensus clustering into {n_clusters} clusters needs more than {n_clusters} faculty; "
+                         f"the feature matrix has {feature_matrix.shape[0]} rows")
+    seeds = np.random.SeedSequence(random_state).generate_state(n_resamples)
+    n_chunks = min(n_resamples, 4 * effective_n_jobs(n_jobs))
+    resample_args = (n_clusters, num_components, faculty_fraction, feature_fraction, n_neighbors, min_dist)
+    n = feature_matrix.shape[0]
+    together = np.zeros(n * (n - 1) // 2, dtype=np.float32)
+    sampled = np.zeros_like(together)
+    chunks = Parallel(n_jobs=n_jobs, return_as='generator_unordered')(
+        delayed(_co_association_chunk)(feature_matrix, chunk_seeds, *resample_args)
+        for chunk_seeds in np.array_split(seeds, n_chunks))
+    for chunk_together, chunk_sampled in chunks:
+        together += chunk_together
+        sampled += chunk_sampled
+    return np.divide(together, sampled, out=np.zeros_like(together), where=sampled > 0)
+
+
+def consensus_labels(consensus, n_clusters):
+    """Clusters of the consensus matrix itself (average linkage on 1 - consensus), numbered from 0."""
+    return fcluster(linkage(1 - consensus, method='average'), n_clusters, criterion='maxclust') - 1
+
+
+def stability_report(consensus, labels, faculty):
+    """Per-cluster and per-faculty stability of a labeling under the consensus matrix.
+
+    Returns (cluster_df, faculty_df). Cluster consensus is the mean consensus of the pairs
+    within a cluster; a faculty member's item consensus is their mean consensus with the
+    rest of their cluster, and Best_Other_Consensus the highest mean consensus with any
+    other cluster (close to Item_Consensus means the assignment is ambiguous). Singleton
+    clusters have no pairs and get NaN.
+    """
+    labels = np.asarray(labels)
+    clusters, cluster_ids = np.unique(labels, return_inverse=True)
+    n = len(labels)
+    sizes = np.bincount(cluster_ids, minlength=len(clusters))
+    # Summed consensus of every faculty member with every cluster, one condensed row at a time:
+    # the pairs (a, a+1..n-1) are the contiguous slice starting at n*a - a*(a+1)/2
+    sums = np.zeros((n, len(clusters)))
+    offset = 0
+    for a in range(n - 1):
+        row = consensus[offset:offset + n - a - 1].astype(float)
+        sums[a] += np.bincount(cluster_ids[a + 1:], weights=row, minlength=len(clusters))
+        sums[a + 1:, cluster_ids[a]] += row
+        offset += n - a - 1
+    # Mean consensus with every cluster, leaving themselves out
+    others = sizes[None, :] - (cluster_ids[:, None] == np.arange(len(clusters)))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        item_consensus = sums / others
+    own = item_consensus[np.arange(n), cluster_ids]
+    other_clusters = item_consensus.copy()
+    other_clusters[np.arange(n), cluster_ids] = -np.inf
+    best_other = other_clusters.max(axis=1) if len(clusters) > 1 else np.full(n, np.nan)
+    cluster_consensus = np.array([consensus[pair_indices(np.flatnonzero(cluster_ids == cluster), n)].mean(dtype=float)
+                                  if size > 1 else np.nan for cluster, size in enumerate(sizes)])
+    cluster_df = pd.DataFrame({'Size': sizes, 'Consensus': cluster_consensus},
+                              index=pd.Index(clusters, name='cluster'))
+    faculty_df = pd.DataFrame({'Faculty_Full_Name': np.asarray(faculty), 'Cluster': labels,
+                               'Item_Consensus': own, 'Best_Other_Consensus': best_other})
+    return cluster_df, faculty_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bootstrap consensus clustering and cluster stability scores.")
+    parser.add_argument('--input', default='mesh_terms_matrix.npz', help="Feature matrix (.npz)")
+    parser.add_argument('--resamples', type=int, default=100)
+    parser.add_argument('--clusters', type=int, default=20, help="KMeans clusters per resample")
+    parser.add_argument('--components', type=int, default=1, help="PCA components fed to UMAP")
+    parser.add_argument('--faculty-fraction', type=float, default=0.8, help="Share of faculty drawn per resample")
+    parser.add_argument('--feature-fraction', type=float, default=1.0, help="Share of terms drawn per resample")
+    parser.add_argument('--jobs', type=int, default=-1, help="Worker processes (-1 = all cores)")
+    parser.add_argument('--output', default='consensus', help="Prefix of the _clusters.csv / _faculty.csv reports")
+    args = parser.parse_args()
+
+    features, faculty_index, _ = load_feature_matrix(args.input)
+    start = time.perf_counter()
+    consensus = co_association(features, args.resamples, args.clusters, args.components, args.faculty_fraction,
+                               args.feature_fraction, n_jobs=args.jobs)
+    print(f"{args.resamples} resamples in {time.perf_counter() - start:.1f}s")
+    cluster_df, faculty_df = stability_report(consensus, consensus_labels(consensus, args.clusters), faculty_index)
+    cluster_df.to_csv(f'{args.output}_clusters.csv')
+    faculty_df.to_csv(f'{args.output}_faculty.csv', index=False)
+    print(cluster_df.sort_values('Consensus').to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+# Precomputed UMAP-on-PCA embeddings served from one memory-mapped array
+#
+# The store is <name>.npy holding a float32 (n_configs x n_faculty x 2) array and
+# <name>.json indexing it by (num_components, n_neighbors, min_dist) plus the hash of the
+# feature matrix it was computed from. Lookups return views into the memory map.
+#
+# Usage:
+#   python embedding_store.py precompute --input mesh_terms_matrix.npz --store umap_embeddings
+#   python embedding_store.py precompute --n-neighbors 10 15 30 --min-dist 0.0 0.1 0.5
+import argparse
+import json
+import time
+import warnings
+
+import numpy as np
+from umap import UMAP
+
+from artifacts import load_feature_matrix, file_hash
+from neighbor_graph import neighbor_graph
+from reduction import fit_pca
+
+DEFAULT_COMPONENT_COUNTS = range(1, 11)  # The dashboard's PCA component slider
+DEFAULT_N_NEIGHBORS = 15
+DEFAULT_MIN_DIST = 0.1
+RANDOM_STATE = 123
+STORE_VERSION = 3  # Bumped when the way embeddings are computed changes
+
+
+def _config_key(num_components, n_neighbors, min_dist):
+    return int(num_components), int(n_neighbors), round(float(min_dist), 6)
+
+
+def fit_umap_on_pca(pca_embeddings, num_components, n_neighbors=DEFAULT_N_NEIGHBORS,
+                    min_dist=DEFAULT_MIN_DIST, random_state=RANDOM_STATE, knn=None, transformable=False):
+    """Fits a 2D UMAP on the first num_components principal components.
+
+    UMAP is fed the kNN graph of the reduced space (knn, or the shared cached graph),
+    so settings that differ only in n_neighbors/min_dist search the space once.
+    transformable attaches an NN-descent search index so UMAP.transform can place new
+    points; the embedding itself is the same.
+    """
+    reduced = pca_embeddings[:, :num_components]
+    knn = neighbor_graph(reduced, n_neighbors) if knn is None else knn
+    indices, distances, search_index = knn.umap_knn(n_neighbors)
+    if transformable and search_index is None:
+        from pynndescent import NNDescent
+        search_index = NNDescent(reduced, n_neighbors=n_neighbors, random_state=random_state)
+    with warnings.catch_warnings():
+        # Exact graphs carry no NNDescent index; only UMAP.transform would need one
+        warnings.filterwarnings('ignore', message='precomputed_knn')
+        return UMAP(n_neighbors=n_neighbors, min_dist=min_dist, random_state=random_state, n_jobs=1,
+                    precomputed_knn=(indices, distances, search_index)).fit(reduced)
+
+
+def umap_on_pca(pca_embeddings, num_components, n_neighbors=DEFAULT_N_NEIGHBORS,
+                min_dist=DEFAULT_MIN_DIST, random_state=RANDOM_STATE, knn=None):
+    """2D UMAP embedding of the first num_components principal components (see fit_umap_on_pca)."""
+    return fit_umap_on_pca(pca_embeddings, num_components, n_neighbors, min_dist, random_state, knn).embedding_
+
+
+class EmbeddingStore:
+    """Read-only view of a precomputed store; get() returns slices of the memory map."""
+
+    def __init__(self, path, embeddings, index):
+        self.path = path
+        self.embeddings = embeddings
+        self.data_hash = index['data_hash']
+        self.faculty = index['faculty']
+        self.slots = {_config_key(*key): slot for *key, slot in index['configs']}
+
+    def __contains__(self, key):
+        return _config_key(*key) in self.slots
+
+    def get(self, num_components, n_neighbors=DEFAULT_N_NEIGHBORS, min_dist=DEFAULT_MIN_DIST):
+        """Returns the (n_faculty x 2) embedding for the configuration, or None if it was not precomputed."""
+        slot = self.slots.get(_config_key(num_components, n_neighbors, min_dist))
+        return None if slot is None else self.embeddings[slot]
+
+
+def write_embedding_store(path, feature_matrix, faculty, data_hash, component_counts=DEFAULT_COMPONENT_COUNTS,
+                          n_neighbors_values=(DEFAULT_N_NEIGHBORS,), min_dist_values=(DEFAULT_MIN_DIST,)):
+    """Fits PCA once and writes the UMAP embedding of every parameter combination to path.npy/path.json.
+
+    feature_matrix may be sparse; only the largest requested component count is computed.
+    """
+    _, pca_embeddings = fit_pca(feature_matrix, max(component_counts), RANDOM_STATE)
+    configs = [_config_key(num_components, n_neighbors, min_dist)
+               for n_neighbors in n_neighbors_values for min_dist in min_dist_values
+               for num_components in component_counts
+               if num_components <= pca_embeddings.shape[1]]
+    embeddings = np.lib.format.open_memmap(f'{path}.npy', mode='w+', dtype=np.float32,
+                                           shape=(len(configs), len(faculty), 2))
+    max_neighbors = max(n_neighbors_values)
+    for slot, (num_components, n_neighbors, min_dist) in enumerate(configs):
+        start = time.perf_counter()
+        knn = neighbor_graph(pca_embeddings[:, :num_components], max_neighbors)
+        embeddings[slot] = umap_on_pca(pca_embeddings, num_components, n_neighbors, min_dist, knn=knn)
+        print(f"components={num_components} n_neighbors={n_neighbors} min_dist={min_dist}: "
+              f"{time.perf_counter() - start:.1f}s")
+    embeddings.flush()
+    del embeddings
+    with open(f'{path}.json', 'w') as f:
+        json.dump({'version': STORE_VERSION, 'data_hash': data_hash, 'random_state': RANDOM_STATE,
+                   'faculty': [str(name) for name in faculty],
+                   'configs': [[*config, slot] for slot, config in enumerate(configs)]}, f)
+    return configs
+
+
+def open_embedding_store(path, data_hash=None):
+    """Memory-maps a store; returns None if it is missing, outdated or built from other data than data_hash."""
+    try:
+        with open(f'{path}.json') as f:
+            index = json.load(f)
+        embeddings = np.load(f'{path}.npy', mmap_mode='r')
+    except FileNotFoundError:
+        return None
+    if index.get('version') != STORE_VERSION or (data_hash is not None and index['data_hash'] != data_hash):
+        return None
+    return EmbeddingStore(path, embeddings, index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute UMAP-on-PCA embeddings into a memory-mapped store.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    precompute_parser = subparsers.add_parser('precompute', help="Compute every configuration and write the store")
+    precompute_parser.add_argument('--input', default='mesh_terms_matrix.npz', help="Feature matrix (.npz)")
+    precompute_parser.add_argument('--store', default='umap_embeddings', help="Store path without extension")
+    precompute_parser.add_argument('--components', type=int, nargs='+', default=list(DEFAULT_COMPONENT_COUNTS))
+    precompute_parser.add_argument('--n-neighbors', type=int, nargs='+', default=[DEFAULT_N_NEIGHBORS])
+    precompute_parser.add_argument('--min-dist', type=float, nargs='+', default=[DEFAULT_MIN_DIST])
+    args = parser.parse_args()
+
+    features, faculty_index, _ = load_feature_matrix(args.input)
+    start = time.perf_counter()
+    configs = write_embedding_store(args.store, features, faculty_index, file_hash(args.input),
+                                    args.components, args.n_neighbors, args.min_dist)
+    print(f"Wrote {len(configs)} embeddings to {args.store}.npy in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
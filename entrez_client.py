@@ -0,0 +1,121 @@
+# Concurrent, rate-limited client for the NCBI E-utilities
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+EUTILS_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/"
+
+# NCBI allows 3 requests/second without an API key and 10 with one
+RATE_WITHOUT_API_KEY = 3
+RATE_WITH_API_KEY = 10
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a request may be sent."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class EntrezClient:
+    """Sends E-utility requests from a bounded thread pool under the NCBI rate limit.
+
+    Failed requests (HTTP 429/5xx or connection errors) are retried with exponential
+    backoff. base_url can point at a local stub server for offline testing. A recorder
+    (instrumentation.RunRecorder) gets the latency, size and retries of every request.
+    """
+
+    def __init__(self, email=None, api_key=None, tool="faculty_mapped_mesh_terms", base_url=EUTILS_URL,
+                 rate=None, max_workers=4, max_retries=5, backoff=0.5, timeout=60, recorder=None):
+        self.email = email
+        self.api_key = api_key
+        self.tool = tool
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+        if rate is None:
+            rate = RATE_WITH_API_KEY if api_key else RATE_WITHOUT_API_KEY
+        self.limiter = TokenBucket(rate)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.recorder = recorder
+
+    def _params(self, params):
+        params = {key: value for key, value in params.items() if value is not None}
+        if self.email:
+            params['email'] = self.email
+        if self.api_key:
+            params['api_key'] = self.api_key
+        if self.tool:
+            params['tool'] = self.tool
+        return params
+
+    def _backoff_delay(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return self.backoff * (2 ** attempt) * (1 + random.random())
+
+    def request(self, utility, **params):
+        """POSTs to <base_url><utility>.fcgi and returns the response body as bytes."""
+        url = f"{self.base_url}{utility}.fcgi"
+        data = urllib.parse.urlencode(self._params(params)).encode()
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(urllib.request.Request(url, data=data), timeout=self.timeout) as response:
+                    body = response.read()
+                if self.recorder is not None:
+                    self.recorder.request(utility, time.perf_counter() - start, len(body), attempt + 1)
+                return body
+            except urllib.error.HTTPError as error:
+                if error.code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt, error.headers.get('Retry-After'))
+            except (urllib.error.URLError, TimeoutError, ConnectionError):
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt)
+            time.sleep(delay)
+
+    def esearch(self, **params):
+        return self.request('esearch', **params)
+
+    def epost(self, **params):
+        return self.request('epost', **params)
+
+    def efetch(self, **params):
+        return self.request('efetch', **params)
+
+    def map(self, func, items):
+        """Applies func to every item on the client's thread pool, preserving order."""
+        items = list(items)
+        if self.max_workers <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(func, items))
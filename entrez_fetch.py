@@ -0,0 +1,118 @@
+# Helpers for pulling PubMed MeSH headings through Entrez
+import io
+import math
+
+from Bio import Entrez
+
+from mesh_parser import iter_articles
+from mesh_cache import get_cached_mesh, put_cached_mesh, get_cached_search, put_cached_search
+
+EFETCH_BATCH_SIZE = 200
+SEARCH_RETMAX = 20  # esearch's default IdList size; the local index applies the same limit
+
+
+def read_entrez(payload):
+    """Parses an E-utility XML response (bytes) with Bio.Entrez."""
+    return Entrez.read(io.BytesIO(payload))
+
+
+def search_pmids(client, search_term, mindate="2020", maxdate="2025", retmax=SEARCH_RETMAX):
+    """Returns the PubMed IdList (at most retmax PMIDs, newest first) for an esearch query."""
+    record = read_entrez(client.esearch(db="pubmed", mindate=mindate, maxdate=maxdate, term=search_term,
+                                        retmax=retmax))
+    return list(record["IdList"])
+
+
+def fetch_mesh_terms_per_pmid(client, pmid_list):
+    """Fetches MeSH headings with one efetch request per PMID."""
+    mesh_by_pmid = {}
+    for articles in client.map(lambda pmid: dict(iter_articles(client.efetch(db="pubmed", id=pmid, rettype="xml"))),
+                               pmid_list):
+        mesh_by_pmid.update(articles)
+    return mesh_by_pmid
+
+
+def post_pmids(client, pmid_list):
+    """Posts PMIDs to the Entrez history server and returns (WebEnv, query_key)."""
+    record = read_entrez(client.epost(db="pubmed", id=",".join(str(pmid) for pmid in pmid_list)))
+    return record["WebEnv"], record["QueryKey"]
+
+
+def fetch_mesh_terms_batched(client, pmid_list, batch_size=EFETCH_BATCH_SIZE):
+    """Fetches MeSH headings for many PMIDs using one epost and concurrent, chunked efetch calls."""
+    mesh_by_pmid = {}
+    if not pmid_list:
+        return mesh_by_pmid
+    webenv, query_key = post_pmids(client, pmid_list)
+
+    def fetch_chunk(retstart):
+        payload = client.efetch(db="pubmed", rettype="xml", retstart=retstart, retmax=batch_size,
+                                WebEnv=webenv, query_key=query_key)
+        return dict(iter_articles(payload))
+
+    for articles in client.map(fetch_chunk, range(0, len(pmid_list), batch_size)):
+        mesh_by_pmid.update(articles)
+    return mesh_by_pmid
+
+
+def count_fetch_requests(n_pmids, fetch_mode='batched', batch_size=EFETCH_BATCH_SIZE):
+    """Number of E-utility requests needed to fetch n_pmids articles in one call of the given mode."""
+    if n_pmids == 0:
+        return 0
+    if fetch_mode == 'batched':
+        return 1 + math.ceil(n_pmids / batch_size)  # One epost plus the efetch chunks
+    return n_pmids
+
+
+def build_pmid_index(faculty_names, pmid_lists):
+    """Returns the inverted PMID -> [faculty, ...] index (in first-seen PMID order)."""
+    pmid_index = {}
+    for faculty_name, pmid_list in zip(faculty_names, pmid_lists):
+        for pmid in pmid_list:
+            authors = pmid_index.setdefault(str(pmid), [])
+            if faculty_name not in authors:
+                authors.append(faculty_name)
+    return pmid_index
+
+
+def list_mesh_terms(pmid_list, mesh_by_pmid):
+    """Returns the descriptors of a PMID list (in list order)."""
+    return [heading.descriptor for pmid in pmid_list for heading in mesh_by_pmid.get(str(pmid), [])]
+
+
+def join_mesh_terms(pmid_list, mesh_by_pmid):
+    """Joins the descriptors of a PMID list (in list order) into a '; ' separated string."""
+    return '; '.join(list_mesh_terms(pmid_list, mesh_by_pmid))
+
+
+def search_pmids_cached(conn, client, search_terms, mindate="2020", maxdate="2025", max_age_days=30,
+                        retmax=SEARCH_RETMAX):
+    """Returns one IdList per search term, running esearch concurrently only for uncached or stale queries.
+
+    Cached IdLists are cut to retmax; raising retmax needs the search cache to expire first.
+    """
+    pmid_lists = [get_cached_search(conn, term, mindate, maxdate, max_age_days) for term in search_terms]
+    missing = [term for term, pmid_list in zip(search_terms, pmid_lists) if pmid_list is None]
+    searched = dict(zip(missing, client.map(lambda term: search_pmids(client, term, mindate, maxdate, retmax),
+                                            missing)))
+    for term, pmid_list in searched.items():
+        put_cached_search(conn, term, mindate, maxdate, pmid_list)
+    return [searched[term] if pmid_list is None else pmid_list[:retmax]
+            for term, pmid_list in zip(search_terms, pmid_lists)]
+
+
+def fetch_mesh_terms_cached(conn, client, pmid_list, fetch=fetch_mesh_terms_batched, max_age_days=365):
+    """Returns ({pmid: [MeshHeading, ...]}, missing) for a list of unique PMIDs.
+
+    fetch(client, pmids) is only called for the PMIDs missing from the cache or older
+    than max_age_days; those are returned as `missing`.
+    """
+    mesh_by_pmid = get_cached_mesh(conn, pmid_list, max_age_days)
+    missing = [str(pmid) for pmid in pmid_list if str(pmid) not in mesh_by_pmid]
+    if missing:
+        fetched = fetch(client, missing)
+        # Remember PMIDs that came back without a PubmedArticle so they are not re-requested every run
+        fetched.update({pmid: [] for pmid in missing if pmid not in fetched})
+        put_cached_mesh(conn, fetched)
+        mesh_by_pmid.update(fetched)
+    return mesh_by_pmid, missing
@@ -0,0 +1,173 @@
+# "Who works on things like X": cosine similarity search over the faculty x term matrix
+#
+# The index holds the L2-normalized rows of the feature matrix (saved like any other
+# feature matrix artifact) plus name and term lookups, so a query is one sparse
+# mat-vec and a partial sort. backend='ann' answers from a pynndescent graph instead; only
+# its kNN graph is saved (pickled sparse pynndescent indexes cannot be queried after loading).
+#
+# Usage:
+#   python faculty_search.py build --input mesh_terms_matrix.npz --index faculty_index.npz
+#   python faculty_search.py query --index faculty_index.npz --faculty "Allison, Steven"
+#   python faculty_search.py query --index faculty_index.npz --terms Soil Droughts -k 5
+#   python faculty_search.py query --index faculty_index.npz --group "Allison, Steven" "Martiny, Jennifer"
+import argparse
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from artifacts import load_feature_matrix, save_feature_matrix
+
+SearchResult = namedtuple('SearchResult', ['faculty', 'score', 'shared_terms'])
+
+
+class FacultySearchIndex:
+    """Top-k cosine similarity search over faculty term profiles."""
+
+    def __init__(self, features, faculty, terms, backend='exact'):
+        if backend not in ('exact', 'ann'):
+            raise ValueError(f"Unknown search backend: {backend!r}")
+        self.features = normalize(sparse.csr_matrix(features, dtype=float))
+        self.faculty = np.asarray(faculty, dtype=str)
+        self.terms = np.asarray(terms, dtype=str)
+        self.faculty_ids = {name: row for row, name in enumerate(self.faculty)}
+        self.term_ids = {term.lower(): column for column, term in enumerate(self.terms)}
+        self.backend = backend
+        self._ann_index = None
+        self._ann_graph = None
+
+    @classmethod
+    def load(cls, path, backend='exact'):
+        features, faculty, terms = load_feature_matrix(path)
+        index = cls(features, faculty, terms, backend)
+        if backend == 'ann' and os.path.exists(f'{path}.ann'):
+            with open(f'{path}.ann', 'rb') as f:
+                graph = np.load(f)
+                index._ann_graph = graph['indices'], graph['distances']
+        return index
+
+    def save(self, path):
+        """Writes the normalized matrix (and the ANN kNN graph, if built) next to path."""
+        save_feature_matrix(path, self.features, self.faculty, self.terms)
+        if self._ann_index is not None:
+            indices, distances = self._ann_index.neighbor_graph
+            with open(f'{path}.ann', 'wb') as f:
+                np.savez(f, indices=indices, distances=distances)
+
+    def ann_index(self):
+        """The pynndescent index over the sparse rows, built on first use (from the saved kNN graph, if loaded)."""
+        if self._ann_index is None:
+            from pynndescent import NNDescent
+            init_graph, init_dist = self._ann_graph if self._ann_graph is not None else (None, None)
+            self._ann_index = NNDescent(self.features, metric='cosine',
+                                        n_neighbors=min(30, self.features.shape[0] - 1), random_state=0,
+                                        init_graph=init_graph, init_dist=init_dist, tree_init=init_graph is None)
+            self._ann_index.prepare()
+        return self._ann_index
+
+    def faculty_row(self, name):
+        try:
+            return self.faculty_ids[name]
+        except KeyError:
+            raise KeyError(f"Faculty member not in the index: {name!r}") from None
+
+    def faculty_terms(self, name):
+        """The terms in a faculty member's profile, highest weight first."""
+        row = self.features.getrow(self.faculty_row(name))
+        return self.terms[row.indices[np.argsort(-row.data, kind='stable')]].tolist()
+
+    def term_vector(self, terms):
+        """Unit query vector over the given terms (matched case-insensitively); unknown terms raise KeyError."""
+        unknown = [term for term in terms if term.lower() not in self.term_ids]
+        if unknown:
+            raise KeyError(f"Terms not in the index: {unknown}")
+        columns = sorted({self.term_ids[term.lower()] for term in terms})
+        query = np.zeros(self.features.shape[1])
+        query[columns] = 1 / np.sqrt(len(columns))
+        return query
+
+    def _explain(self, row, query, n_terms):
+        start, end = self.features.indptr[row], self.features.indptr[row + 1]
+        columns = self.features.indices[start:end]
+        contributions = self.features.data[start:end] * query[columns]
+        shared = np.flatnonzero(contributions > 0)
+        shared = shared[np.argsort(-contributions[shared], kind='stable')[:n_terms]]
+        return [(self.terms[columns[i]], float(contributions[i])) for i in shared]
+
+    def search(self, query, k=10, exclude=(), n_terms=5):
+        """Top-k faculty by cosine similarity to a query vector, with their most shared terms."""
+        exclude = set(exclude)
+        n_candidates = min(k + len(exclude), self.features.shape[0])
+        if self.backend == 'ann':
+            rows, distances = self.ann_index().query(sparse.csr_matrix(query[None, :]), k=n_candidates)
+            rows, scores = rows[0], 1 - distances[0]
+        else:
+            scores = self.features @ query
+            rows = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+            rows = rows[np.lexsort((rows, -scores[rows]))]
+            scores = scores[rows]
+        return [SearchResult(self.faculty[row], float(score), self._explain(row, query, n_terms))
+                for row, score in zip(rows, scores) if row not in exclude][:k]
+
+    def similar_to_faculty(self, name, k=10, n_terms=5):
+        row = self.faculty_row(name)
+        query = self.features.getrow(row).toarray().ravel()
+        return self.search(query, k, exclude={row}, n_terms=n_terms)
+
+    def similar_to_terms(self, terms, k=10, n_terms=5):
+        return self.search(self.term_vector(terms), k, n_terms=n_terms)
+
+    def similar_to_group(self, names, k=10, n_terms=5):
+        """Faculty closest to the centroid of a group's profiles (group members excluded)."""
+        rows = [self.faculty_row(name) for name in names]
+        query = np.asarray(self.features[rows].mean(axis=0)).ravel()
+        norm = np.linalg.norm(query)
+        return self.search(query / norm if norm > 0 else query, k, exclude=rows, n_terms=n_terms)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the faculty similarity search index.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="Build the index from a feature matrix")
+    build_parser.add_argument('--input', default='mesh_terms_matrix.npz', help="Feature matrix (.npz)")
+    build_parser.add_argument('--index', default='faculty_index.npz')
+    build_parser.add_argument('--ann', action='store_true', help="Also build the approximate (pynndescent) graph")
+    query_parser = subparsers.add_parser('query', help="Find similar faculty")
+    query_parser.add_argument('--index', default='faculty_index.npz')
+    query_group = query_parser.add_mutually_exclusive_group(required=True)
+    query_group.add_argument('--faculty', help="Faculty_Full_Name to find neighbors of")
+    query_group.add_argument('--terms', nargs='+', help="MeSH terms")
+    query_group.add_argument('--group', nargs='+', help="Several Faculty_Full_Names")
+    query_parser.add_argument('-k', type=int, default=10)
+    query_parser.add_argument('--ann', action='store_true', help="Use the approximate backend")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        features, faculty_index, term_index = load_feature_matrix(args.input)
+        index = FacultySearchIndex(features, faculty_index, term_index, 'ann' if args.ann else 'exact')
+        if args.ann:
+            index.ann_index()
+        index.save(args.index)
+        print(f"Indexed {len(index.faculty)} faculty x {len(index.terms)} terms in {args.index}")
+        return
+
+    index = FacultySearchIndex.load(args.index, 'ann' if args.ann else 'exact')
+    start = time.perf_counter()
+    if args.faculty:
+        results = index.similar_to_faculty(args.faculty, args.k)
+    elif args.terms:
+        results = index.similar_to_terms(args.terms, args.k)
+    else:
+        results = index.similar_to_group(args.group, args.k)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    for result in results:
+        shared = ', '.join(f"{term} ({contribution:.3f})" for term, contribution in result.shared_terms)
+        print(f"{result.score:.3f}  {result.faculty}  [{shared}]")
+    print(f"{len(results)} results in {elapsed_ms:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# Per-stage timings, Entrez request statistics and matrix shapes, written as a JSON run report
+#
+# Scripts mark their stages with recorder.begin('name') (which ends the previous stage) or
+# `with recorder.stage('name'):`. Each stage records wall time, CPU time of this process
+# (joblib worker processes are not included) and the peak RSS reached so far. A disabled
+# recorder does nothing: begin() returns at once and stage() hands out a shared no-op context.
+import contextlib
+import json
+import math
+import resource
+import threading
+import time
+
+# Upper bounds (ms) of the request latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, math.inf)
+
+_NO_OP = contextlib.nullcontext()
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _bucket_label(upper):
+    return f"<= {upper} ms" if math.isfinite(upper) else f"> {LATENCY_BUCKETS_MS[-2]} ms"
+
+
+class RunRecorder:
+    """Collects the measurements of one script run; report() / write() turn them into JSON."""
+
+    def __init__(self, run_name, enabled=True):
+        self.run_name = run_name
+        self.enabled = enabled
+        self.started_at = time.time()
+        self.stages = []
+        self.requests = {}
+        self.matrices = {}
+        self.values = {}
+        self._current = None
+        self._lock = threading.Lock()
+
+    def _start(self, name):
+        return name, time.perf_counter(), time.process_time(), _max_rss_mb()
+
+    def _finish(self, started):
+        name, wall, cpu, rss_before = started
+        max_rss = _max_rss_mb()
+        self.stages.append({'stage': name, 'wall_s': time.perf_counter() - wall, 'cpu_s': time.process_time() - cpu,
+                            'max_rss_mb': max_rss, 'rss_growth_mb': max_rss - rss_before})
+
+    def begin(self, name):
+        """Ends the running stage (if any) and starts the next one."""
+        if not self.enabled:
+            return
+        self.end()
+        self._current = self._start(name)
+
+    def end(self):
+        """Ends the running stage started by begin()."""
+        if self._current is not None:
+            self._finish(self._current)
+            self._current = None
+
+    def stage(self, name):
+        """Context manager recording one stage."""
+        if not self.enabled:
+            return _NO_OP
+        return self._stage(name)
+
+    @contextlib.contextmanager
+    def _stage(self, name):
+        started = self._start(name)
+        try:
+            yield
+        finally:
+            self._finish(started)
+
+    def request(self, utility, seconds, n_bytes, attempts=1):
+        """Records one Entrez request (thread-safe): its latency, response size and retries."""
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self.requests.get(utility)
+            if stats is None:
+                stats = self.requests[utility] = {'count': 0, 'bytes': 0, 'retries': 0, 'seconds': 0.0,
+                                                  'max_ms': 0.0, 'histogram': [0] * len(LATENCY_BUCKETS_MS)}
+            latency_ms = seconds * 1000
+            stats['count'] += 1
+            stats['bytes'] += n_bytes
+            stats['retries'] += attempts - 1
+            stats['seconds'] += seconds
+            stats['max_ms'] = max(stats['max_ms'], latency_ms)
+            stats['histogram'][next(i for i, upper in enumerate(LATENCY_BUCKETS_MS) if latency_ms <= upper)] += 1
+
+    def matrix(self, name, matrix):
+        """Records a matrix's shape, stored entries and density."""
+        if not self.enabled:
+            return
+        n_rows, n_cols = matrix.shape
+        nnz = matrix.nnz if hasattr(matrix, 'nnz') else int((matrix != 0).sum().sum())
+        self.matrices[name] = {'shape': [n_rows, n_cols], 'nnz': int(nnz),
+                               'density': nnz / (n_rows * n_cols) if n_rows * n_cols else 0.0}
+
+    def record(self, key, value):
+        """Records any other JSON-serializable value."""
+        if self.enabled:
+            self.values[key] = value
+
+    def report(self):
+        self.end()
+        requests = {utility: {**stats, 'mean_ms': stats['seconds'] * 1000 / stats['count'],
+                              'histogram': dict(zip(map(_bucket_label, LATENCY_BUCKETS_MS), stats['histogram']))}
+                    for utility, stats in self.requests.items()}
+        return {
+            'run': self.run_name,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started_at)),
+            'wall_s': time.time() - self.started_at,
+            'max_rss_mb': _max_rss_mb(),
+            'stages': self.stages,
+            'requests': requests,
+            'matrices': self.matrices,
+            'values': self.values,
+        }
+
+    def write(self, path):
+        """Writes the run report to path (nothing when disabled)."""
+        if not self.enabled:
+            return
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, default=str)
+
+
+def load_run_report(path):
+    """Reads a run report; returns None if it does not exist."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
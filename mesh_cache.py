@@ -0,0 +1,81 @@
+# On-disk SQLite cache for esearch results and PMID -> MeSH heading lists
+import json
+import sqlite3
+import time
+
+from mesh_parser import MeshHeading
+
+SECONDS_PER_DAY = 86400
+
+
+def open_mesh_cache(path='mesh_cache.sqlite'):
+    """Opens (and creates if needed) the cache database."""
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pmid_mesh_headings (
+            pmid TEXT PRIMARY KEY,
+            headings TEXT NOT NULL,
+            fetched_at REAL NOT NULL
+        )""")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS esearch (
+            query TEXT NOT NULL,
+            mindate TEXT NOT NULL,
+            maxdate TEXT NOT NULL,
+            pmids TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (query, mindate, maxdate)
+        )""")
+    conn.commit()
+    return conn
+
+
+def _cutoff(max_age_days):
+    if max_age_days is None:
+        return float('-inf')
+    return time.time() - max_age_days * SECONDS_PER_DAY
+
+
+def get_cached_mesh(conn, pmid_list, max_age_days=None):
+    """Returns {pmid: [MeshHeading, ...]} for the PMIDs cached more recently than max_age_days."""
+    cutoff = _cutoff(max_age_days)
+    pmids = [str(pmid) for pmid in pmid_list]
+    mesh_by_pmid = {}
+    # Stay under SQLite's bound-parameter limit
+    for start in range(0, len(pmids), 500):
+        chunk = pmids[start:start + 500]
+        placeholders = ','.join('?' * len(chunk))
+        rows = conn.execute(
+            f"SELECT pmid, headings FROM pmid_mesh_headings WHERE fetched_at >= ? AND pmid IN ({placeholders})",
+            [cutoff, *chunk])
+        for pmid, headings in rows:
+            mesh_by_pmid[pmid] = [MeshHeading(pmid, descriptor, descriptor_ui, major_topic, tuple(qualifiers))
+                                  for descriptor, descriptor_ui, major_topic, qualifiers in json.loads(headings)]
+    return mesh_by_pmid
+
+
+def put_cached_mesh(conn, mesh_by_pmid):
+    """Stores (or refreshes) the MeshHeading lists of the given PMIDs."""
+    fetched_at = time.time()
+    conn.executemany(
+        "INSERT OR REPLACE INTO pmid_mesh_headings (pmid, headings, fetched_at) VALUES (?, ?, ?)",
+        [(str(pmid), json.dumps([list(heading[1:]) for heading in headings]), fetched_at)
+         for pmid, headings in mesh_by_pmid.items()])
+    conn.commit()
+
+
+def get_cached_search(conn, query, mindate, maxdate, max_age_days=None):
+    """Returns the cached IdList for an esearch query, or None if missing or stale."""
+    row = conn.execute(
+        "SELECT pmids, fetched_at FROM esearch WHERE query = ? AND mindate = ? AND maxdate = ?",
+        (query, str(mindate), str(maxdate))).fetchone()
+    if row is None or row[1] < _cutoff(max_age_days):
+        return None
+    return json.loads(row[0])
+
+
+def put_cached_search(conn, query, mindate, maxdate, pmid_list):
+    conn.execute(
+        "INSERT OR REPLACE INTO esearch (query, mindate, maxdate, pmids, fetched_at) VALUES (?, ?, ?, ?, ?)",
+        (query, str(mindate), str(maxdate), json.dumps([str(pmid) for pmid in pmid_list]), time.time()))
+    conn.commit()
@@ -0,0 +1,66 @@
+# Streaming extraction of MeSH headings from PubMed efetch / baseline XML
+import io
+from collections import namedtuple
+from xml.etree.ElementTree import iterparse
+
+MeshHeading = namedtuple('MeshHeading', ['pmid', 'descriptor', 'descriptor_ui', 'major_topic', 'qualifiers'])
+
+ARTICLE_TAGS = {'PubmedArticle', 'PubmedBookArticle'}
+PMID_PARENTS = {'MedlineCitation', 'BookDocument'}
+
+
+def _open_source(source):
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    return source
+
+
+def iter_articles(source):
+    """Yields (pmid, [MeshHeading, ...]) for every article in a PubmedArticleSet.
+
+    source may be a path, a binary file object or the raw XML bytes. Each article
+    element is cleared once it has been read, so memory stays flat however many
+    articles the payload holds. Articles without a MeshHeadingList yield an empty list.
+    """
+    stack = []
+    root = None
+    pmid = None
+    headings = []
+    descriptor = descriptor_ui = None
+    major_topic = False
+    qualifiers = []
+    for event, elem in iterparse(_open_source(source), events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            if root is None:
+                root = elem
+            stack.append(tag)
+            if tag in ARTICLE_TAGS:
+                pmid, headings = None, []
+            elif tag == 'MeshHeading':
+                descriptor, descriptor_ui, major_topic, qualifiers = None, None, False, []
+            continue
+
+        stack.pop()
+        if tag == 'PMID' and pmid is None and stack and stack[-1] in PMID_PARENTS:
+            pmid = (elem.text or '').strip()
+        elif tag == 'DescriptorName':
+            descriptor = (elem.text or '').strip()
+            descriptor_ui = elem.get('UI')
+            major_topic = major_topic or elem.get('MajorTopicYN') == 'Y'
+        elif tag == 'QualifierName':
+            qualifiers.append((elem.text or '').strip())
+            major_topic = major_topic or elem.get('MajorTopicYN') == 'Y'
+        elif tag == 'MeshHeading':
+            if descriptor:
+                headings.append(MeshHeading(pmid, descriptor, descriptor_ui, major_topic, tuple(qualifiers)))
+        elif tag in ARTICLE_TAGS:
+            if pmid:
+                yield pmid, [heading._replace(pmid=pmid) for heading in headings]
+            root.clear()
+
+
+def iter_mesh_headings(source):
+    """Yields a MeshHeading (pmid, descriptor, descriptor_ui, major_topic, qualifiers) per heading."""
+    for _, headings in iter_articles(source):
+        yield from headings
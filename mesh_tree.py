@@ -0,0 +1,152 @@
+# MeSH descriptor hierarchy: roll term counts up to a fixed tree depth
+#
+# The NLM descriptor file (desc<year>.xml) is streamed once into a compact index of
+# descriptor name -> tree numbers, saved as JSON. Rolling up maps every descriptor to its
+# ancestors at the chosen depth through one sparse (terms x ancestors) aggregation matrix,
+# so related leaf terms ("Soil", "Soil Microbiology") share a column.
+#
+# Usage:
+#   python mesh_tree.py build desc2025.xml --output mesh_tree.json
+#   python mesh_tree.py rollup --tree mesh_tree.json --depth 2 Soil "Soil Microbiology" Nitrification
+import argparse
+import json
+import time
+from xml.etree.ElementTree import iterparse
+
+import numpy as np
+from scipy import sparse
+
+from term_matrix import TermVocabulary
+
+
+def tree_prefix(tree_number, depth):
+    """The tree number of the ancestor at depth (C04.588.274 -> C04.588 at depth 2; shallower ones unchanged)."""
+    return '.'.join(tree_number.split('.')[:depth])
+
+
+class MeshTree:
+    """Descriptor name -> tree numbers, with the reverse lookup used to name ancestors."""
+
+    def __init__(self, tree_numbers):
+        self.tree_numbers = {name: tuple(numbers) for name, numbers in tree_numbers.items()}
+        self.names = {number: name for name, numbers in self.tree_numbers.items() for number in numbers}
+        self.folded_names = {name.casefold(): name for name in self.tree_numbers}
+
+    def __len__(self):
+        return len(self.tree_numbers)
+
+    def __contains__(self, term):
+        return self.descriptor(term) is not None
+
+    @classmethod
+    def from_descriptor_file(cls, source):
+        """Streams a desc*.xml DescriptorRecordSet; each record is cleared once read."""
+        tree_numbers = {}
+        root = None
+        name, numbers = None, []
+        for event, elem in iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                if elem.tag == 'DescriptorRecord':
+                    name, numbers = None, []
+                continue
+            if elem.tag == 'DescriptorName' and name is None:
+                # The record's own name comes before any DescriptorReferredTo names
+                name = (elem.findtext('String') or '').strip()
+            elif elem.tag == 'TreeNumber':
+                numbers.append((elem.text or '').strip())
+            elif elem.tag == 'DescriptorRecord':
+                if name and numbers:
+                    tree_numbers[name] = numbers
+                root.clear()
+        return cls(tree_numbers)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({name: list(numbers) for name, numbers in self.tree_numbers.items()}, f)
+
+    def descriptor(self, term):
+        """The descriptor name a term refers to (matched case-insensitively), or None."""
+        if term in self.tree_numbers:
+            return term
+        return self.folded_names.get(term.casefold())
+
+    def ancestors(self, term, depth, exclude_branches=()):
+        """Names of the term's ancestors at depth, one per distinct branch, in tree-number order.
+
+        Terms shallower than depth are their own ancestor. Tree numbers under any of the
+        exclude_branches prefixes (e.g. 'B01' organisms, 'M01' persons) are ignored.
+        """
+        descriptor = self.descriptor(term)
+        if descriptor is None:
+            return []
+        prefixes = sorted({tree_prefix(number, depth) for number in self.tree_numbers[descriptor]
+                           if not number.startswith(tuple(exclude_branches))})
+        return list(dict.fromkeys(self.names.get(prefix, prefix) for prefix in prefixes))
+
+
+def rollup_matrix(terms, mesh_tree, depth, exclude_branches=(), keep_unmapped=True):
+    """Sparse (len(terms) x n_ancestors) aggregation matrix and the ancestor vocabulary.
+
+    A term under several branches splits its weight equally between their ancestors, so
+    row totals are preserved. Terms missing from the tree keep their own column when
+    keep_unmapped (research keywords that are not descriptors), and are dropped otherwise;
+    terms whose every branch is excluded are dropped.
+    """
+    rolled = TermVocabulary()
+    rows, columns, weights = [], [], []
+    for row, term in enumerate(terms):
+        if term in mesh_tree:
+            ancestors = mesh_tree.ancestors(term, depth, exclude_branches)
+        else:
+            ancestors = [term] if keep_unmapped else []
+        for ancestor in ancestors:
+            rows.append(row)
+            columns.append(rolled.intern(ancestor))
+            weights.append(1 / len(ancestors))
+    aggregation = sparse.csr_matrix((np.asarray(weights, dtype=float), (rows, columns)),
+                                    shape=(len(terms), len(rolled)))
+    return aggregation, rolled
+
+
+def rollup_counts(counts, vocabulary, mesh_tree, depth, exclude_branches=(), keep_unmapped=True):
+    """Rolls a faculty x term count matrix up to MeSH depth; returns (counts, ancestor vocabulary)."""
+    aggregation, rolled = rollup_matrix(vocabulary.terms, mesh_tree, depth, exclude_branches, keep_unmapped)
+    return (counts @ aggregation).tocsr(), rolled
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the MeSH tree index or inspect a roll-up.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="Index an NLM descriptor file (desc*.xml)")
+    build_parser.add_argument('descriptor_file')
+    build_parser.add_argument('--output', default='mesh_tree.json')
+    rollup_parser = subparsers.add_parser('rollup', help="Show the ancestors terms roll up to")
+    rollup_parser.add_argument('terms', nargs='+')
+    rollup_parser.add_argument('--tree', default='mesh_tree.json')
+    rollup_parser.add_argument('--depth', type=int, default=2)
+    rollup_parser.add_argument('--exclude-branches', nargs='*', default=[])
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        mesh_tree = MeshTree.from_descriptor_file(args.descriptor_file)
+        mesh_tree.save(args.output)
+        print(f"Indexed {len(mesh_tree)} descriptors ({len(mesh_tree.names)} tree numbers) in "
+              f"{time.perf_counter() - start:.1f}s")
+        return
+
+    mesh_tree = MeshTree.load(args.tree)
+    for term in args.terms:
+        ancestors = mesh_tree.ancestors(term, args.depth, args.exclude_branches) if term in mesh_tree else None
+        print(f"{term}: {'; '.join(ancestors) if ancestors is not None else '(not a descriptor)'}")
+
+
+if __name__ == '__main__':
+    main()
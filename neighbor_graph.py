@@ -0,0 +1,118 @@
+# Shared k-nearest-neighbor graph reused by UMAP, DBSCAN and Leiden
+#
+# The kNN of a feature space is computed once (exactly with sklearn, or approximately with
+# pynndescent) and cached per array contents; smaller k are served by slicing the cached
+# graph. Following UMAP, each point's own index is its first neighbor.
+import hashlib
+from collections import OrderedDict
+
+import igraph as ig
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+
+CACHE_ENTRIES = 16
+
+_graph_cache = OrderedDict()
+
+
+class NeighborGraph:
+    """kNN indices and distances (n x k, self first) of one feature space."""
+
+    def __init__(self, indices, distances, search_index=None):
+        self.indices = indices
+        self.distances = distances
+        self.search_index = search_index
+
+    @property
+    def n_neighbors(self):
+        return self.indices.shape[1]
+
+    def truncate(self, n_neighbors):
+        """Returns the graph restricted to the n_neighbors nearest neighbors."""
+        if n_neighbors > self.n_neighbors:
+            raise ValueError(f"Graph has {self.n_neighbors} neighbors, {n_neighbors} requested")
+        if n_neighbors == self.n_neighbors:
+            return self
+        return NeighborGraph(self.indices[:, :n_neighbors], self.distances[:, :n_neighbors], self.search_index)
+
+    def umap_knn(self, n_neighbors):
+        """The (indices, distances, search_index) tuple UMAP takes as precomputed_knn."""
+        graph = self.truncate(n_neighbors)
+        return graph.indices, graph.distances.astype(np.float32), graph.search_index
+
+    def k_distances(self, min_samples):
+        """Sorted distance of every point to its (min_samples - 1)-th other neighbor.
+
+        This is the k-distance curve used to choose DBSCAN's eps for the same min_samples
+        (which counts the point itself).
+        """
+        return np.sort(self.distances[:, min_samples - 1])
+
+    def to_igraph(self, n_neighbors=None):
+        """Undirected igraph of the kNN edges with a 'weight' similarity attribute.
+
+        Weights are exp(-d^2 / (sigma_i * sigma_j)) with sigma the distance to each
+        point's farthest neighbor (self-tuning kernel), so they lie in (0, 1].
+        """
+        graph = self if n_neighbors is None else self.truncate(n_neighbors)
+        n = graph.indices.shape[0]
+        rows = np.repeat(np.arange(n), graph.n_neighbors)
+        cols = graph.indices.ravel()
+        distances = graph.distances.ravel()
+        keep = (rows != cols) & (cols >= 0)
+        rows, cols, distances = rows[keep], cols[keep], distances[keep]
+        # Each undirected edge once, keyed by (low, high) endpoint
+        low, high = np.minimum(rows, cols), np.maximum(rows, cols)
+        _, first = np.unique(low.astype(np.int64) * n + high, return_index=True)
+        low, high, distances = low[first], high[first], distances[first]
+        sigma = np.maximum(graph.distances[:, -1], np.finfo(float).tiny)
+        weights = np.exp(-distances ** 2 / (sigma[low] * sigma[high]))
+        igraph = ig.Graph(n=n, edges=np.column_stack([low, high]))
+        igraph.es['weight'] = weights.tolist()
+        return igraph
+
+
+def _digest(X, params):
+    X = np.ascontiguousarray(X)
+    digest = hashlib.blake2b(X.view(np.uint8), digest_size=16)
+    digest.update(repr((X.shape, X.dtype.str, params)).encode())
+    return digest.hexdigest()
+
+
+def compute_neighbor_graph(X, n_neighbors=15, approximate=False, metric='euclidean', random_state=None):
+    """Computes the kNN graph of X (uncached); approximate uses pynndescent's NN-descent."""
+    X = np.asarray(X, dtype=float)
+    n_neighbors = min(n_neighbors, len(X))
+    if approximate:
+        from pynndescent import NNDescent
+        search_index = NNDescent(X, n_neighbors=n_neighbors, metric=metric, random_state=random_state)
+        indices, distances = search_index.neighbor_graph
+        return NeighborGraph(indices, distances, search_index)
+    knn = NearestNeighbors(n_neighbors=n_neighbors, metric=metric).fit(X)
+    distances, indices = knn.kneighbors(X)
+    return NeighborGraph(indices, distances)
+
+
+def neighbor_graph(X, n_neighbors=15, approximate=False, metric='euclidean', random_state=None):
+    """Cached compute_neighbor_graph: the same X (by contents) is only searched once per k."""
+    X = np.asarray(X, dtype=float)
+    key = _digest(X, (approximate, metric, random_state))
+    graph = _graph_cache.get(key)
+    if graph is None or graph.n_neighbors < min(n_neighbors, len(X)):
+        graph = compute_neighbor_graph(X, n_neighbors, approximate, metric, random_state)
+        _graph_cache[key] = graph
+        if len(_graph_cache) > CACHE_ENTRIES:
+            _graph_cache.popitem(last=False)
+    _graph_cache.move_to_end(key)
+    return graph.truncate(min(n_neighbors, graph.n_neighbors))
+
+
+def suggest_eps(k_distances):
+    """Knee of a sorted k-distance curve: the point farthest below the chord joining its ends."""
+    k_distances = np.asarray(k_distances, dtype=float)
+    if len(k_distances) < 3:
+        return float(k_distances[-1]) if len(k_distances) else float('nan')
+    x = np.linspace(0, 1, len(k_distances))
+    span = k_distances[-1] - k_distances[0]
+    y = (k_distances - k_distances[0]) / span if span > 0 else np.zeros_like(k_distances)
+    return float(k_distances[np.argmax(x - y)])
@@ -0,0 +1,199 @@
+# Versioned faculty model (terms, PCA, UMAP, KMeans) and out-of-sample projection of new faculty
+#
+# `fit` saves the fitted models as models/faculty_model_v<N>.joblib; `project` fetches and
+# vectorizes only the new faculty, places them in the saved embedding with UMAP.transform
+# and assigns clusters with KMeans.predict, so existing faculty keep their cluster labels.
+#
+# Usage:
+#   python projection.py fit --input mesh_terms_matrix.npz --components 1 --clusters 20
+#   python projection.py project new_faculty.xlsx --output projected_faculty.csv
+import argparse
+import glob
+import os
+import re
+import time
+
+import joblib
+import pandas as pd
+from sklearn.cluster import KMeans
+
+from artifacts import load_feature_matrix, file_hash
+from embedding_store import DEFAULT_N_NEIGHBORS, DEFAULT_MIN_DIST, RANDOM_STATE, fit_umap_on_pca
+from mesh_tree import MeshTree, rollup_counts
+from reduction import fit_pca
+from term_matrix import (DEFAULT_SOURCE_WEIGHTS, DEFAULT_REMOVE_TERMS, count_terms, drop_terms, project_feature_matrix,
+                         TermWeighting)
+
+MODEL_FORMAT = 1
+MODEL_FILE = re.compile(r'faculty_model_v(\d+)\.joblib$')
+
+
+def fit_faculty_model(features, faculty, terms, num_components=1, n_clusters=20, n_neighbors=DEFAULT_N_NEIGHBORS,
+                      min_dist=DEFAULT_MIN_DIST, random_state=RANDOM_STATE, kmeans_random_state=42,
+                      source_weights=None, remove_terms=None, mesh_rollup=None, term_weighting=None):
+    """Fits PCA, UMAP (on num_components PCs) and KMeans the way clustering_analyses.py does.
+
+    mesh_rollup is None for leaf-term features, or {'tree': MeshTree, 'depth': int,
+    'exclude_branches': [...]} if the matrix was rolled up by Biopython_Entrez.py, and
+    term_weighting the TermWeighting it was weighted with (None for the proportion default).
+    Returns the model dict saved by save_model; its UMAP can transform new points.
+    """
+    pca, pca_embeddings = fit_pca(features, num_components)
+    umap_model = fit_umap_on_pca(pca_embeddings, num_components, n_neighbors, min_dist, random_state,
+                                 transformable=True)
+    kmeans = KMeans(n_clusters=n_clusters, random_state=kmeans_random_state, n_init=10).fit(umap_model.embedding_)
+    return {
+        'format': MODEL_FORMAT,
+        'terms': [str(term) for term in terms],
+        'source_weights': dict(DEFAULT_SOURCE_WEIGHTS if source_weights is None else source_weights),
+        'remove_terms': list(DEFAULT_REMOVE_TERMS if remove_terms is None else remove_terms),
+        'mesh_rollup': mesh_rollup,
+        'term_weighting': term_weighting,
+        'num_components': num_components,
+        'pca': pca,
+        'umap': umap_model,
+        'kmeans': kmeans,
+        'faculty': [str(name) for name in faculty],
+        'labels': kmeans.labels_,
+    }
+
+
+def model_versions(directory='models'):
+    """Returns {version: path} of the saved models in directory."""
+    versions = {}
+    for path in glob.glob(os.path.join(directory, 'faculty_model_v*.joblib')):
+        match = MODEL_FILE.search(path)
+        if match:
+            versions[int(match.group(1))] = path
+    return versions
+
+
+def save_model(model, directory='models', **metadata):
+    """Saves the model as the next version in directory and returns its path."""
+    os.makedirs(directory, exist_ok=True)
+    version = max(model_versions(directory), default=0) + 1
+    path = os.path.join(directory, f'faculty_model_v{version:04d}.joblib')
+    joblib.dump({**model, 'version': version, 'created_at': time.time(), **metadata}, path)
+    return path
+
+
+def load_model(directory='models', version=None):
+    """Loads a saved model (the latest version unless one is given)."""
+    versions = model_versions(directory)
+    if not versions:
+        raise FileNotFoundError(f"No faculty models in {directory!r}; run `python projection.py fit` first")
+    if version is None:
+        version = max(versions)
+    elif version not in versions:
+        raise FileNotFoundError(f"No faculty model version {version} in {directory!r}")
+    model = joblib.load(versions[version])
+    if model.get('format') != MODEL_FORMAT:
+        raise ValueError(f"{versions[version]} was saved in an unsupported model format")
+    return model
+
+
+def vectorize_faculty(model, df):
+    """Feature rows of new faculty over the model's terms, from their ';' separated term strings (or lists of them)."""
+    source_weights = {column: weight for column, weight in model['source_weights'].items() if column in df}
+    counts, vocabulary = drop_terms(*count_terms(df, source_weights), model['remove_terms'])
+    if model.get('mesh_rollup'):
+        rollup = model['mesh_rollup']
+        counts, vocabulary = rollup_counts(counts, vocabulary, rollup['tree'], rollup['depth'],
+                                           rollup['exclude_branches'])
+    return project_feature_matrix(counts, vocabulary, model['terms'], model.get('term_weighting'))
+
+
+def project_faculty(model, features):
+    """Returns (2D embedding, cluster labels) of new feature rows in the model's embedding."""
+    reduced = model['pca'].transform(features)[:, :model['num_components']]
+    embedding = model['umap'].transform(reduced)
+    return embedding, model['kmeans'].predict(embedding)
+
+
+def fetch_pub_mesh_terms(faculty_df, args):
+    """Adds pmids and pub_mesh_terms columns for the new faculty only (Entrez with the shared cache, or local)."""
+    from entrez_fetch import (SEARCH_RETMAX, search_pmids_cached, fetch_mesh_terms_cached, list_mesh_terms,
+                              build_pmid_index)
+    retmax = SEARCH_RETMAX if args.retmax is None else args.retmax
+    if args.pmid_source == 'local':
+        from pubmed_local_index import open_local_index, search_local_pmids, get_local_mesh
+        local_index = open_local_index(args.local_index_path)
+        faculty_df['pmids'] = [search_local_pmids(local_index, search_term, args.mindate, args.maxdate, retmax)
+                               for search_term in faculty_df['Faculty_Author_Affiliation']]
+        mesh_by_pmid = get_local_mesh(local_index, build_pmid_index(faculty_df['Faculty_Full_Name'],
+                                                                    faculty_df['pmids']))
+        local_index.close()
+    else:
+        from entrez_client import EntrezClient
+        from mesh_cache import open_mesh_cache
+        client = EntrezClient(email=args.email, api_key=os.environ.get('NCBI_API_KEY'))
+        mesh_cache = open_mesh_cache(args.cache_path)
+        faculty_df['pmids'] = search_pmids_cached(mesh_cache, client, faculty_df['Faculty_Author_Affiliation'].tolist(),
+                                                  args.mindate, args.maxdate, retmax=retmax)
+        pmid_index = build_pmid_index(faculty_df['Faculty_Full_Name'], faculty_df['pmids'])
+        mesh_by_pmid, _ = fetch_mesh_terms_cached(mesh_cache, client, list(pmid_index))
+        mesh_cache.close()
+    faculty_df['pub_mesh_terms'] = [list_mesh_terms(pmid_list, mesh_by_pmid) for pmid_list in faculty_df['pmids']]
+    return faculty_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit the versioned faculty model or project new faculty into it.")
+    parser.add_argument('--models', default='models', help="Directory of versioned model files")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    fit_parser = subparsers.add_parser('fit', help="Fit PCA/UMAP/KMeans on the feature matrix and save a new version")
+    fit_parser.add_argument('--input', default='mesh_terms_matrix.npz', help="Feature matrix (.npz)")
+    fit_parser.add_argument('--components', type=int, default=1, help="PCA components fed to UMAP")
+    fit_parser.add_argument('--clusters', type=int, default=20, help="KMeans clusters")
+    fit_parser.add_argument('--mesh-tree', help="mesh_tree.json, if the matrix was built with a MeSH roll-up")
+    fit_parser.add_argument('--mesh-depth', type=int, default=3, help="Roll-up depth the matrix was built with")
+    fit_parser.add_argument('--exclude-branches', nargs='*', default=[], help="Excluded tree-number prefixes")
+    fit_parser.add_argument('--term-weighting', default='term_weighting.json',
+                            help="Term weights saved by Biopython_Entrez.py (skipped if missing)")
+    project_parser = subparsers.add_parser('project', help="Place new faculty in the saved embedding")
+    project_parser.add_argument('faculty_file', help="Spreadsheet with Faculty_Full_Name, Faculty_Author_Affiliation "
+                                                     "and optional Proposal_Mesh_Terms / Mapped_Mesh_Terms")
+    project_parser.add_argument('--version', type=int, help="Model version (default: latest)")
+    project_parser.add_argument('--output', default='projected_faculty.csv')
+    project_parser.add_argument('--pmid-source', choices=['entrez', 'local'], default='entrez')
+    project_parser.add_argument('--local-index-path', default='pubmed_index.sqlite')
+    project_parser.add_argument('--cache-path', default='mesh_cache.sqlite')
+    project_parser.add_argument('--email', default="sarkisj@uci.edu")
+    project_parser.add_argument('--mindate', default="2020")
+    project_parser.add_argument('--maxdate', default="2025")
+    project_parser.add_argument('--retmax', type=int, help="Most PMIDs per faculty query (default: esearch's 20)")
+    args = parser.parse_args()
+
+    if args.command == 'fit':
+        features, faculty_index, term_index = load_feature_matrix(args.input)
+        start = time.perf_counter()
+        mesh_rollup = None
+        if args.mesh_tree:
+            mesh_rollup = {'tree': MeshTree.load(args.mesh_tree), 'depth': args.mesh_depth,
+                           'exclude_branches': args.exclude_branches}
+        term_weighting = TermWeighting.load(args.term_weighting) if os.path.exists(args.term_weighting) else None
+        model = fit_faculty_model(features, faculty_index, term_index, args.components, args.clusters,
+                                  mesh_rollup=mesh_rollup, term_weighting=term_weighting)
+        path = save_model(model, args.models, data_hash=file_hash(args.input))
+        print(f"Saved {path} ({len(faculty_index)} faculty, {args.clusters} clusters) "
+              f"in {time.perf_counter() - start:.1f}s")
+        return
+
+    model = load_model(args.models, args.version)
+    start = time.perf_counter()
+    if args.faculty_file.endswith('.csv'):
+        faculty_df = pd.read_csv(args.faculty_file)
+    else:
+        faculty_df = pd.read_excel(args.faculty_file)
+    faculty_df = fetch_pub_mesh_terms(faculty_df, args)
+    embedding, labels = project_faculty(model, vectorize_faculty(model, faculty_df))
+    projected_df = pd.DataFrame({'Faculty_Full_Name': faculty_df['Faculty_Full_Name'],
+                                 'V1': embedding[:, 0], 'V2': embedding[:, 1], 'Cluster': labels})
+    projected_df.to_csv(args.output, index=False)
+    print(projected_df.to_string(index=False))
+    print(f"Projected {len(projected_df)} faculty with model v{model['version']} "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+# Offline PubMed index built from local baseline/updatefile XML dumps
+#
+# Usage:
+#   python pubmed_local_index.py ingest --index pubmed_index.sqlite baseline/*.xml.gz updatefiles/*.xml.gz
+#   python pubmed_local_index.py query --index pubmed_index.sqlite "Allison, Steven[Author] AND Irvine[Affiliation]"
+import argparse
+import gzip
+import json
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree.ElementTree import iterparse
+
+from entrez_fetch import SEARCH_RETMAX
+from mesh_parser import MeshHeading
+
+QUERY_CLAUSE = re.compile(r'^\s*"?(?P<value>[^\[\]"]+?)"?\s*\[(?P<field>[^\]]+)\]\s*$')
+FIELD_ALIASES = {'author': 'author', 'au': 'author', 'affiliation': 'affiliation', 'ad': 'affiliation'}
+
+
+def open_local_index(path='pubmed_index.sqlite'):
+    """Opens (and creates if needed) the local author/affiliation -> PMID -> MeSH index."""
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS articles (
+            pmid INTEGER PRIMARY KEY,
+            year INTEGER,
+            headings TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS authors (
+            last_name TEXT NOT NULL,
+            fore_name TEXT NOT NULL,
+            initials TEXT NOT NULL,
+            pmid INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS affiliations (
+            pmid INTEGER NOT NULL,
+            affiliation TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS authors_last_name ON authors (last_name);
+        CREATE INDEX IF NOT EXISTS authors_pmid ON authors (pmid);
+        CREATE INDEX IF NOT EXISTS affiliations_pmid ON affiliations (pmid);
+    """)
+    return conn
+
+
+def _text(elem, path):
+    found = elem.find(path)
+    return (found.text or '').strip() if found is not None and found.text else ''
+
+
+def _publication_year(citation):
+    pub_date = citation.find('Article/Journal/JournalIssue/PubDate')
+    if pub_date is None:
+        return None
+    year = _text(pub_date, 'Year') or _text(pub_date, 'MedlineDate')[:4]
+    return int(year) if year.isdigit() else None
+
+
+def parse_pubmed_file(path):
+    """Parses one baseline/update file into (articles, deleted_pmids, n_skipped).
+
+    Each article is (pmid, year, headings, authors, affiliations) with authors as
+    (last_name, fore_name, initials) tuples; citations without a numeric PMID are
+    skipped and counted in n_skipped. Runs in a worker process.
+    """
+    articles = []
+    deleted_pmids = []
+    n_skipped = 0
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as handle:
+        root = None
+        for event, elem in iterparse(handle, events=('start', 'end')):
+            if root is None:
+                root = elem
+                continue
+            if event != 'end':
+                continue
+            if elem.tag == 'PubmedArticle':
+                citation = elem.find('MedlineCitation')
+                pmid = _text(citation, 'PMID') if citation is not None else ''
+                if not pmid.isdigit():
+                    n_skipped += 1
+                    root.clear()
+                    continue
+                pmid = int(pmid)
+                headings = []
+                for mesh_heading in citation.iterfind('MeshHeadingList/MeshHeading'):
+                    descriptor = mesh_heading.find('DescriptorName')
+                    if descriptor is None or not descriptor.text:
+                        continue
+                    qualifiers = mesh_heading.findall('QualifierName')
+                    major_topic = descriptor.get('MajorTopicYN') == 'Y' or any(
+                        qualifier.get('MajorTopicYN') == 'Y' for qualifier in qualifiers)
+                    headings.append([descriptor.text.strip(), descriptor.get('UI'), major_topic,
+                                     [(qualifier.text or '').strip() for qualifier in qualifiers]])
+                authors = []
+                affiliations = set()
+                for author in citation.iterfind('Article/AuthorList/Author'):
+                    last_name = _text(author, 'LastName')
+                    if last_name:
+                        authors.append((last_name.lower(), _text(author, 'ForeName').lower(),
+                                        _text(author, 'Initials').lower()))
+                    for affiliation in author.iterfind('AffiliationInfo/Affiliation'):
+                        if affiliation.text:
+                            affiliations.add(affiliation.text.strip())
+                articles.append((pmid, _publication_year(citation), headings, authors, sorted(affiliations)))
+                root.clear()
+            elif elem.tag == 'DeleteCitation':
+                deleted_pmids.extend(int(pmid.text) for pmid in elem.iterfind('PMID'))
+                root.clear()
+    return articles, deleted_pmids, n_skipped
+
+
+def _delete_pmids(conn, pmids):
+    for table in ('articles', 'authors', 'affiliations'):
+        conn.executemany(f"DELETE FROM {table} WHERE pmid = ?", [(pmid,) for pmid in pmids])
+
+
+def ingest_files(conn, paths, processes=None):
+    """Parses the dump files in parallel (one process per file) and loads them into the index.
+
+    Files are applied in the order given, so later update files replace or delete
+    records from earlier ones.
+    """
+    n_articles = 0
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for path, (articles, deleted_pmids, n_skipped) in zip(paths, executor.map(parse_pubmed_file, paths)):
+            _delete_pmids(conn, [article[0] for article in articles] + deleted_pmids)
+            conn.executemany("INSERT INTO articles (pmid, year, headings) VALUES (?, ?, ?)",
+                             [(pmid, year, json.dumps(headings)) for pmid, year, headings, _, _ in articles])
+            conn.executemany("INSERT INTO authors (last_name, fore_name, initials, pmid) VALUES (?, ?, ?, ?)",
+                             [(*author, pmid) for pmid, _, _, authors, _ in articles for author in authors])
+            conn.executemany("INSERT INTO affiliations (pmid, affiliation) VALUES (?, ?)",
+                             [(pmid, affiliation) for pmid, _, _, _, affiliations in articles
+                              for affiliation in affiliations])
+            conn.commit()
+            n_articles += len(articles)
+            print(f"{os.path.basename(path)}: {len(articles)} articles, {len(deleted_pmids)} deletions"
+                  + (f", {n_skipped} citations without a PMID skipped" if n_skipped else ""))
+    return n_articles
+
+
+def parse_query(search_term):
+    """Splits an esearch-style query such as 'Allison, Steven[Author] AND Irvine[Affiliation]' into clauses."""
+    clauses = []
+    for clause in re.split(r'\s+AND\s+', search_term.strip()):
+        match = QUERY_CLAUSE.match(clause)
+        if match is None or match.group('field').strip().lower() not in FIELD_ALIASES:
+            raise ValueError(f"Unsupported query clause for the local index: {clause!r}")
+        clauses.append((FIELD_ALIASES[match.group('field').strip().lower()], match.group('value').strip()))
+    return clauses
+
+
+def _author_pmids(conn, author):
+    if ',' in author:
+        last_name, fore_name = (part.strip().lower() for part in author.split(',', 1))
+        rows = conn.execute("SELECT pmid FROM authors WHERE last_name = ? AND fore_name LIKE ? || '%'",
+                            (last_name, fore_name))
+    else:
+        # PubMed style "Allison SD": last name followed by initials
+        last_name, _, initials = author.lower().rpartition(' ')
+        if not last_name:
+            last_name, initials = initials, ''
+        rows = conn.execute("SELECT pmid FROM authors WHERE last_name = ? AND initials LIKE ? || '%'",
+                            (last_name, initials))
+    return {pmid for pmid, in rows}
+
+
+def search_local_pmids(conn, search_term, mindate=None, maxdate=None, retmax=SEARCH_RETMAX):
+    """Resolves an esearch-style author/affiliation query against the local index, newest PMIDs first.
+
+    Like esearch, at most retmax PMIDs are returned.
+    """
+    pmids = None
+    affiliations = []
+    for field, value in parse_query(search_term):
+        if field == 'author':
+            author_pmids = _author_pmids(conn, value)
+            pmids = author_pmids if pmids is None else pmids & author_pmids
+        else:
+            affiliations.append(value.lower())
+    if pmids is None:
+        raise ValueError("The local index needs at least one [Author] clause")
+    result = []
+    for pmid in sorted(pmids, reverse=True):
+        if len(result) == retmax:
+            break
+        year = conn.execute("SELECT year FROM articles WHERE pmid = ?", (pmid,)).fetchone()
+        if year is None:
+            continue
+        if year[0] is not None and ((mindate and year[0] < int(str(mindate)[:4]))
+                                    or (maxdate and year[0] > int(str(maxdate)[:4]))):
+            continue
+        if affiliations:
+            article_affiliations = [affiliation.lower() for affiliation, in
+                                    conn.execute("SELECT affiliation FROM affiliations WHERE pmid = ?", (pmid,))]
+            if not all(any(term in affiliation for affiliation in article_affiliations) for term in affiliations):
+                continue
+        result.append(str(pmid))
+    return result
+
+
+def get_local_mesh(conn, pmid_list):
+    """Returns {pmid: [MeshHeading, ...]} for the PMIDs present in the local index."""
+    mesh_by_pmid = {}
+    for pmid in pmid_list:
+        row = conn.execute("SELECT headings FROM articles WHERE pmid = ?", (int(pmid),)).fetchone()
+        if row is not None:
+            mesh_by_pmid[str(pmid)] = [MeshHeading(str(pmid), descriptor, descriptor_ui, major_topic, tuple(qualifiers))
+                                       for descriptor, descriptor_ui, major_topic, qualifiers in json.loads(row[0])]
+    return mesh_by_pmid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query a local PubMed author/affiliation -> MeSH index.")
+    parser.add_argument('--index', default='pubmed_index.sqlite', help="Path of the SQLite index")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = subparsers.add_parser('ingest', help="Load baseline/updatefile *.xml.gz dumps")
+    ingest_parser.add_argument('files', nargs='+')
+    ingest_parser.add_argument('--processes', type=int, default=None)
+    query_parser = subparsers.add_parser('query', help="Resolve a Faculty_Author_Affiliation query")
+    query_parser.add_argument('search_term')
+    query_parser.add_argument('--mindate')
+    query_parser.add_argument('--maxdate')
+    query_parser.add_argument('--retmax', type=int, default=SEARCH_RETMAX, help="Most PMIDs returned, as in esearch")
+    args = parser.parse_args()
+
+    conn = open_local_index(args.index)
+    if args.command == 'ingest':
+        start = time.perf_counter()
+        n_articles = ingest_files(conn, sorted(args.files), args.processes)
+        print(f"Indexed {n_articles} articles in {time.perf_counter() - start:.1f}s")
+    else:
+        start = time.perf_counter()
+        pmid_list = search_local_pmids(conn, args.search_term, args.mindate, args.maxdate, args.retmax)
+        mesh_by_pmid = get_local_mesh(conn, pmid_list)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        for pmid in pmid_list:
+            print(f"{pmid}: {'; '.join(heading.descriptor for heading in mesh_by_pmid.get(pmid, []))}")
+        print(f"{len(pmid_list)} PMIDs in {elapsed_ms:.1f} ms")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
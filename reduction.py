@@ -0,0 +1,28 @@
+# PCA of the faculty x term matrix computing only the components that are used
+#
+# Every consumer (UMAP on 1..10 components, the explained-variance plots, projection)
+# reads at most the first DEFAULT_PCA_COMPONENTS components, so only those are computed:
+# sklearn's ARPACK solver finds the top k singular vectors of the implicitly centered
+# matrix, so sparse input is never densified. Fit once and pass the embeddings around.
+import numpy as np
+from scipy import sparse
+from sklearn.decomposition import PCA
+
+DEFAULT_PCA_COMPONENTS = 10  # The dashboard's PCA component slider
+RANDOM_STATE = 123
+
+
+def fit_pca(features, n_components=DEFAULT_PCA_COMPONENTS, random_state=RANDOM_STATE):
+    """Fits a PCA with n_components components; returns (pca, embeddings).
+
+    Sparse (or dense) input is reduced with truncated ARPACK SVD. Matrices too small for
+    it (n_components >= the smaller dimension), or n_components=None, get the full PCA()
+    on the dense matrix, as before.
+    """
+    if n_components is None or n_components >= min(features.shape):
+        dense = features.toarray() if sparse.issparse(features) else np.asarray(features, dtype=float)
+        pca = PCA(n_components=None if n_components is None else min(n_components, *dense.shape))
+        return pca, pca.fit_transform(dense)
+    pca = PCA(n_components=n_components, svd_solver='arpack', random_state=random_state)
+    features = features.astype(float) if sparse.issparse(features) else np.asarray(features, dtype=float)
+    return pca, pca.fit_transform(features)
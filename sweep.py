@@ -0,0 +1,161 @@
+# Parallel hyperparameter sweeps over PCA components x UMAP params x clusterer params
+#
+# PCA is fitted once, each distinct (num_components, n_neighbors, min_dist) embedding is
+# computed once, and every clusterer fit reuses its embedding (and, for Leiden, the
+# embedding's shared neighbor graph). Fits run on a joblib process pool; loky workers do
+# not re-import the calling script, so the analysis scripts can sweep without a __main__ guard.
+#
+# Usage:
+#   python sweep.py --input mesh_terms_matrix.npz --components 1 2 3 4 5 6 --k 2 3 4 5 6 7 8 9 --output sweep_results.csv
+import argparse
+import itertools
+import time
+
+import leidenalg as la
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.cluster import KMeans, DBSCAN
+from sklearn.metrics import silhouette_score, davies_bouldin_score
+
+from artifacts import load_feature_matrix, save_table
+from embedding_store import DEFAULT_N_NEIGHBORS, DEFAULT_MIN_DIST, RANDOM_STATE, umap_on_pca
+from neighbor_graph import neighbor_graph
+from reduction import fit_pca
+
+LEIDEN_N_NEIGHBORS = 15
+
+
+def expand_grid(param_grid):
+    """Expands {name: values} into the list of every {name: value} combination."""
+    names = list(param_grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(param_grid[name] for name in names))]
+
+
+def _fit_clusterer(embedding, clusterer, params, random_state, knn=None):
+    if clusterer == 'kmeans':
+        model = KMeans(random_state=random_state, **params).fit(embedding)
+        return model.labels_, model.inertia_
+    if clusterer == 'dbscan':
+        return DBSCAN(**params).fit(embedding).labels_, np.nan
+    if clusterer == 'leiden':
+        graph = knn.to_igraph()
+        partition = la.find_partition(graph, la.CPMVertexPartition, seed=random_state,
+                                      weights='weight' if params.get('weighted') else None,
+                                      resolution_parameter=params['resolution'])
+        return np.asarray(partition.membership), np.nan
+    raise ValueError(f"Unknown clusterer: {clusterer!r}")
+
+
+def _score_clusterer(embedding, clusterer, params, random_state, knn=None):
+    labels, inertia = _fit_clusterer(embedding, clusterer, params, random_state, knn)
+    groups, sizes = np.unique(labels, return_counts=True)
+    scoreable = 2 <= len(groups) < len(labels)
+    return {
+        'n_clusters': int((groups >= 0).sum()),
+        'inertia': inertia,
+        'silhouette': silhouette_score(embedding, labels) if scoreable else np.nan,
+        'davies_bouldin': davies_bouldin_score(embedding, labels) if scoreable else np.nan,
+        'cluster_sizes': sorted(sizes.tolist(), reverse=True),
+    }
+
+
+def compute_embeddings(pca_embeddings, embedding_configs, random_state=RANDOM_STATE, n_jobs=-1):
+    """Returns {(num_components, n_neighbors, min_dist): 2D UMAP embedding}, computed in parallel.
+
+    The kNN graph of each PCA component count is searched once (for the largest
+    n_neighbors) and shared by all of its UMAP settings.
+    """
+    embedding_configs = list(dict.fromkeys(embedding_configs))
+    max_neighbors = {}
+    for num_components, n_neighbors, _ in embedding_configs:
+        max_neighbors[num_components] = max(n_neighbors, max_neighbors.get(num_components, 0))
+    graphs = {num_components: neighbor_graph(pca_embeddings[:, :num_components], n_neighbors)
+              for num_components, n_neighbors in max_neighbors.items()}
+    embeddings = Parallel(n_jobs=n_jobs)(
+        delayed(umap_on_pca)(pca_embeddings, num_components, n_neighbors, min_dist, random_state,
+                             graphs[num_components])
+        for num_components, n_neighbors, min_dist in embedding_configs)
+    return dict(zip(embedding_configs, embeddings))
+
+
+def _clusterer_tasks(embedding, clusterer_grid, random_state):
+    knn = neighbor_graph(embedding, LEIDEN_N_NEIGHBORS) if 'leiden' in clusterer_grid else None
+    for clusterer, param_grid in clusterer_grid.items():
+        for params in expand_grid(param_grid):
+            yield clusterer, params, delayed(_score_clusterer)(embedding, clusterer, params, random_state, knn)
+
+
+def sweep_clusterers(embedding, clusterer_grid, random_state=RANDOM_STATE, n_jobs=-1):
+    """Fits every clusterer setting on one embedding in parallel; returns one results row per fit.
+
+    clusterer_grid maps 'kmeans', 'dbscan' or 'leiden' to {parameter: values}; KMeans and
+    DBSCAN parameters are passed to the sklearn estimators, Leiden takes 'resolution' and
+    optionally 'weighted' (use the kNN graph's similarity weights).
+    """
+    tasks = list(_clusterer_tasks(np.asarray(embedding), clusterer_grid, random_state))
+    scores = Parallel(n_jobs=n_jobs)(task for _, _, task in tasks)
+    return pd.DataFrame([{'clusterer': clusterer, **params, **score}
+                         for (clusterer, params, _), score in zip(tasks, scores)])
+
+
+def run_sweep(feature_matrix, grid, random_state=RANDOM_STATE, n_jobs=-1):
+    """Runs a full sweep and returns the results table (one row per embedding x clusterer setting).
+
+    grid has 'num_components', 'n_neighbors' and 'min_dist' value lists plus a 'clusterers'
+    dict as taken by sweep_clusterers. Every fit uses the same random_state. feature_matrix
+    may be sparse; PCA computes only the largest requested component count.
+    """
+    _, pca_embeddings = fit_pca(feature_matrix, max(grid['num_components']), random_state)
+    embedding_configs = [(num_components, n_neighbors, min_dist)
+                         for num_components in grid['num_components']
+                         for n_neighbors in grid.get('n_neighbors', [DEFAULT_N_NEIGHBORS])
+                         for min_dist in grid.get('min_dist', [DEFAULT_MIN_DIST])]
+    embeddings = compute_embeddings(pca_embeddings, embedding_configs, random_state, n_jobs)
+    tasks = [(config, clusterer, params, task)
+             for config, embedding in embeddings.items()
+             for clusterer, params, task in _clusterer_tasks(embedding, grid['clusterers'], random_state)]
+    scores = Parallel(n_jobs=n_jobs)(task for *_, task in tasks)
+    return pd.DataFrame([{'num_components': num_components, 'n_neighbors': n_neighbors, 'min_dist': min_dist,
+                          'clusterer': clusterer, **params, **score}
+                         for ((num_components, n_neighbors, min_dist), clusterer, params, _), score
+                         in zip(tasks, scores)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep PCA components, UMAP parameters and clusterers.")
+    parser.add_argument('--input', default='mesh_terms_matrix.npz', help="Feature matrix (.npz)")
+    parser.add_argument('--output', default='sweep_results.csv', help="Results table (.csv or .parquet)")
+    parser.add_argument('--components', type=int, nargs='+', default=list(range(1, 7)))
+    parser.add_argument('--n-neighbors', type=int, nargs='+', default=[DEFAULT_N_NEIGHBORS])
+    parser.add_argument('--min-dist', type=float, nargs='+', default=[DEFAULT_MIN_DIST])
+    parser.add_argument('--k', type=int, nargs='*', default=list(range(2, 10)), help="KMeans cluster counts")
+    parser.add_argument('--eps', type=float, nargs='*', default=[0.05], help="DBSCAN eps values")
+    parser.add_argument('--min-samples', type=int, nargs='+', default=[2], help="DBSCAN min_samples values")
+    parser.add_argument('--resolution', type=float, nargs='*', default=[0.2, 0.8], help="Leiden resolutions")
+    parser.add_argument('--jobs', type=int, default=-1, help="Worker processes (-1 = all cores)")
+    args = parser.parse_args()
+
+    clusterers = {}
+    if args.k:
+        clusterers['kmeans'] = {'n_clusters': args.k, 'n_init': [10]}
+    if args.eps:
+        clusterers['dbscan'] = {'eps': args.eps, 'min_samples': args.min_samples}
+    if args.resolution:
+        clusterers['leiden'] = {'resolution': args.resolution}
+    grid = {'num_components': args.components, 'n_neighbors': args.n_neighbors, 'min_dist': args.min_dist,
+            'clusterers': clusterers}
+
+    features, _, _ = load_feature_matrix(args.input)
+    start = time.perf_counter()
+    results = run_sweep(features, grid, n_jobs=args.jobs)
+    print(f"{len(results)} fits in {time.perf_counter() - start:.1f}s")
+    if args.output.endswith('.parquet'):
+        save_table(results, args.output)
+    else:
+        results.to_csv(args.output, index=False)
+    print(results.sort_values('silhouette', ascending=False).head(10).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
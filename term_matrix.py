@@ -0,0 +1,413 @@
+# Sparse faculty x MeSH term counts streamed from ';' separated term strings
+import json
+from array import array
+
+import numpy as np
+from scipy import sparse
+
+# Default per-source weights (proposal terms count 3x, research keywords 2x, publications 1x)
+DEFAULT_SOURCE_WEIGHTS = {
+    'Proposal_Mesh_Terms': 3,
+    'Mapped_Mesh_Terms': 2,
+    'pub_mesh_terms': 1,
+}
+
+# Generic MeSH terms (organisms, demographics, study design) that say nothing about a research area
+DEFAULT_REMOVE_TERMS = [
+    "Animals", "Biology", "Humans", "Rats", "Mice", "Male", "Female",
+    "Disease Models, Animal", "Mice, Transgenic", "Mice, Inbred C57BL",
+    "Mice, Knockout", "Adult", "Middle Aged", "Models, Theoretical",
+    "Models, Biological", "Models, Animal", "Mentors", "Mentoring",
+    "Universities", "Drosophila", "Mammals", "Faculty", "Research Design",
+    "Follow-Up Studies", "United States", "Goals", "Preliminary Data", "Students", "Feedback"
+]
+
+
+def iter_terms(value):
+    """Yields the stripped, non-empty terms of a ';' separated string or of a list of such strings."""
+    if isinstance(value, str):
+        value = (value,)
+    elif not isinstance(value, (list, tuple, np.ndarray)):
+        return
+    for terms_string in value:
+        if not isinstance(terms_string, str):
+            continue
+        for term in terms_string.split(';'):
+            term = term.strip()
+            if term:
+                yield term
+
+
+def weighted_terms_string(values, weights, remove_terms=()):
+    """'; ' joined terms of one faculty member's sources, each source's terms repeated weight times.
+
+    This is the Combined_Mesh_Terms report format; values and weights are in source order.
+    """
+    remove_terms = set(remove_terms)
+    terms = []
+    for value, weight in zip(values, weights):
+        terms.extend([term for term in iter_terms(value) if term not in remove_terms] * int(weight))
+    return '; '.join(terms)
+
+
+class TermVocabulary:
+    """Interns term strings to consecutive integer ids (in first-seen order)."""
+
+    def __init__(self, terms=()):
+        self.terms = []
+        self.term_ids = {}
+        for term in terms:
+            self.intern(term)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def intern(self, term):
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            term_id = self.term_ids[term] = len(self.terms)
+            self.terms.append(term)
+        return term_id
+
+
+def iter_term_triples(df, source_weights, vocabulary):
+    """Yields (faculty_id, term_id, weight) for every term of every source column, row by row.
+
+    faculty_id is the row position in df and weight the source's weight; terms are interned
+    into vocabulary as they stream past, so no joined or split term strings are kept.
+    """
+    columns = list(source_weights)
+    for faculty_id, values in enumerate(zip(*(df[column] for column in columns))):
+        for column, value in zip(columns, values):
+            weight = source_weights[column]
+            for term in iter_terms(value):
+                yield faculty_id, vocabulary.intern(term), weight
+
+
+class TermTripleStore:
+    """Append-only (faculty_id, term_id, weight) triples held in typed arrays (16 bytes each).
+
+    Term strings live once in the TermVocabulary; to_counts() sums repeated
+    (faculty, term) pairs into the sparse count matrix every summary is computed from.
+    """
+
+    def __init__(self):
+        self.faculty_ids = array('i')
+        self.term_ids = array('i')
+        self.weights = array('d')
+
+    def __len__(self):
+        return len(self.weights)
+
+    def extend(self, triples):
+        add_faculty, add_term, add_weight = self.faculty_ids.append, self.term_ids.append, self.weights.append
+        for faculty_id, term_id, weight in triples:
+            add_faculty(faculty_id)
+            add_term(term_id)
+            add_weight(weight)
+        return self
+
+    def to_counts(self, n_faculty, n_terms):
+        """csr_matrix of summed weights, n_faculty x n_terms."""
+        rows = np.frombuffer(self.faculty_ids, dtype=np.int32)
+        cols = np.frombuffer(self.term_ids, dtype=np.int32)
+        weights = np.frombuffer(self.weights, dtype=float)
+        return sparse.csr_matrix((weights, (rows, cols)), shape=(n_faculty, n_terms))
+
+    def first_seen(self, n_faculty, n_terms):
+        """csr_matrix (same entries as to_counts) of each pair's first position in the stream, counted from 1."""
+        rows = np.frombuffer(self.faculty_ids, dtype=np.int32)
+        cols = np.frombuffer(self.term_ids, dtype=np.int32)
+        order = np.lexsort((cols, rows))
+        first = order[np.r_[True, (np.diff(rows[order]) != 0) | (np.diff(cols[order]) != 0)]] if len(order) else order
+        return sparse.csr_matrix((first + 1.0, (rows[first], cols[first])), shape=(n_faculty, n_terms))
+
+
+def count_terms(df, source_weights, vocabulary=None, first_seen=False):
+    """Streams every source column of df into a weighted sparse faculty x term count matrix.
+
+    Returns (csr_matrix, vocabulary); terms are interned row by row in source_weights order.
+    With first_seen=True, also returns TermTripleStore.first_seen, the order in which each
+    faculty member's terms first appeared (row_summaries breaks ties with it).
+    """
+    vocabulary = TermVocabulary() if vocabulary is None else vocabulary
+    store = TermTripleStore().extend(iter_term_triples(df, source_weights, vocabulary))
+    counts = store.to_counts(len(df), len(vocabulary))
+    if first_seen:
+        return counts, vocabulary, store.first_seen(len(df), len(vocabulary))
+    return counts, vocabulary
+
+
+def drop_terms(counts, vocabulary, terms_to_remove):
+    """Removes the given terms' columns; returns (counts, vocabulary) for the remaining terms."""
+    terms_to_remove = set(terms_to_remove)
+    keep = [term_id for term_id, term in enumerate(vocabulary.terms) if term not in terms_to_remove]
+    return counts[:, keep].tocsr(), TermVocabulary(vocabulary.terms[term_id] for term_id in keep)
+
+
+def select_top_terms(counts, n, skip=0):
+    """Returns the ids of the terms ranked skip..n by column total (ties in vocabulary order)."""
+    totals = np.asarray(counts.sum(axis=0)).ravel()
+    order = np.argsort(-totals, kind='stable')[:n]
+    order = order[totals[order] > 0]
+    return order[skip:]
+
+
+def most_common_terms(counts, vocabulary, n):
+    """Returns the n (term, count) pairs with the largest column totals, ties in vocabulary order."""
+    totals = np.asarray(counts.sum(axis=0)).ravel()
+    return [(vocabulary.terms[term_id], totals[term_id]) for term_id in select_top_terms(counts, n)]
+
+
+def normalize_rows(counts):
+    """Divides every row by its total (rows without terms stay zero)."""
+    row_totals = np.asarray(counts.sum(axis=1)).ravel()
+    row_totals[row_totals == 0] = 1
+    return (sparse.diags(1 / row_totals) @ counts).tocsr()
+
+
+def normalize_rows_l2(matrix):
+    """Scales every row to unit Euclidean length (rows without terms stay zero)."""
+    row_norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    row_norms[row_norms == 0] = 1
+    return (sparse.diags(1 / row_norms) @ matrix).tocsr()
+
+
+def document_frequency(counts):
+    """Number of rows each term occurs in."""
+    counts = sparse.csr_matrix(counts)
+    return np.bincount(counts.indices[counts.data != 0], minlength=counts.shape[1])
+
+
+TERM_WEIGHTING_SCHEMES = ('proportion', 'tfidf', 'bm25', 'log_entropy')
+
+
+class TermWeighting:
+    """Corpus-level term weighting scheme plus stop terms detected from document frequency.
+
+    fit() learns each term's global weight (idf, BM25 idf or entropy weight) from a count
+    matrix; transform() weights count rows over any vocabulary, so new faculty are weighted
+    like the corpus (terms unseen in fit get the weight of a term occurring in no row).
+    Schemes:
+      proportion   counts / row total (the original normalization)
+      tfidf        counts x smoothed idf, rows scaled to unit length
+      bm25         BM25 saturated term frequency (k1, b) x BM25 idf
+      log_entropy  log(1 + counts) x (1 - normalized entropy of the term), rows scaled to unit length
+    Terms in more than max_df (a fraction) of the rows, or in fewer than min_df rows, are
+    stop terms: they are weighted 0, and the pipeline drops their columns before ranking.
+    """
+
+    def __init__(self, scheme='proportion', max_df=None, min_df=1, k1=1.2, b=0.75):
+        if scheme not in TERM_WEIGHTING_SCHEMES:
+            raise ValueError(f"Unknown term weighting scheme: {scheme!r}")
+        self.scheme = scheme
+        self.max_df = max_df
+        self.min_df = min_df
+        self.k1 = k1
+        self.b = b
+        self.stop_terms = []
+        self.term_weights = {}
+        self.default_weight = 1.0
+        self.avg_length = 1.0
+
+    def _idf(self, df, n_rows):
+        if self.scheme == 'tfidf':
+            return np.log((1 + n_rows) / (1 + df)) + 1
+        if self.scheme == 'bm25':
+            return np.log(1 + (n_rows - df + 0.5) / (df + 0.5))
+        return np.ones(len(df))
+
+    @staticmethod
+    def _entropy_weights(counts, n_rows):
+        column_totals = np.asarray(counts.sum(axis=0)).ravel()
+        p = counts.data / column_totals[counts.indices]
+        entropy = np.bincount(counts.indices, weights=-p * np.log(p), minlength=counts.shape[1])
+        return 1 - entropy / np.log(max(n_rows, 2))
+
+    def fit(self, counts, vocabulary):
+        counts = sparse.csr_matrix(counts)
+        n_rows = counts.shape[0]
+        df = document_frequency(counts)
+        stop = df < self.min_df
+        if self.max_df is not None:
+            stop |= df > self.max_df * n_rows
+        self.stop_terms = [term for term, is_stop in zip(vocabulary.terms, stop) if is_stop]
+        counts = self._drop_stop_terms(counts, vocabulary)
+        self.avg_length = float(counts.sum()) / max(n_rows, 1) or 1.0
+        if self.scheme == 'log_entropy':
+            weights = self._entropy_weights(counts, n_rows)
+        else:
+            weights = self._idf(df, n_rows)
+        self.term_weights = {term: float(weight) for term, weight, is_stop
+                             in zip(vocabulary.terms, weights, stop) if not is_stop}
+        # Weight of a term unseen in fit: df = 0 (for log-entropy, all of its mass in one row)
+        self.default_weight = 1.0 if self.scheme == 'log_entropy' else float(self._idf(np.zeros(1), n_rows)[0])
+        return self
+
+    def _drop_stop_terms(self, counts, vocabulary):
+        if not self.stop_terms:
+            return counts
+        stop_terms = set(self.stop_terms)
+        keep = np.asarray([term not in stop_terms for term in vocabulary.terms], dtype=float)
+        counts = (counts @ sparse.diags(keep)).tocsr()
+        counts.eliminate_zeros()
+        return counts
+
+    def transform(self, counts, vocabulary):
+        """Weighted copy of a count matrix whose columns are vocabulary's terms."""
+        counts = self._drop_stop_terms(sparse.csr_matrix(counts, dtype=float), vocabulary)
+        if self.scheme == 'proportion':
+            return normalize_rows(counts)
+        weights = sparse.diags([self.term_weights.get(term, self.default_weight) for term in vocabulary.terms])
+        local = counts.copy()
+        if self.scheme == 'bm25':
+            row_lengths = np.repeat(np.asarray(counts.sum(axis=1)).ravel(), np.diff(counts.indptr))
+            local.data = local.data * (self.k1 + 1) / (
+                local.data + self.k1 * (1 - self.b + self.b * row_lengths / self.avg_length))
+            return (local @ weights).tocsr()
+        if self.scheme == 'log_entropy':
+            local.data = np.log1p(local.data)
+        return normalize_rows_l2(local @ weights)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'scheme': self.scheme, 'max_df': self.max_df, 'min_df': self.min_df, 'k1': self.k1,
+                       'b': self.b, 'stop_terms': self.stop_terms, 'term_weights': self.term_weights,
+                       'default_weight': self.default_weight, 'avg_length': self.avg_length}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            saved = json.load(f)
+        weighting = cls(saved['scheme'], saved['max_df'], saved['min_df'], saved['k1'], saved['b'])
+        weighting.stop_terms = saved['stop_terms']
+        weighting.term_weights = saved['term_weights']
+        weighting.default_weight = saved['default_weight']
+        weighting.avg_length = saved['avg_length']
+        return weighting
+
+
+def build_feature_matrix(counts, vocabulary, faculty_names, top_n=150, skip_most_common=0, weighting=None):
+    """Builds the normalized faculty x term feature matrix.
+
+    Rows are weighted over all terms (divided by each faculty member's total, or by a fitted
+    TermWeighting), then restricted to the terms ranked skip_most_common..top_n by overall
+    count. Returns (csr_matrix, faculty index array, term index array).
+    """
+    term_ids = select_top_terms(counts, top_n, skip_most_common)
+    weighted = normalize_rows(counts) if weighting is None else weighting.transform(counts, vocabulary)
+    features = weighted[:, term_ids].tocsr()
+    faculty_index = np.asarray(list(faculty_names), dtype=object)
+    term_index = np.asarray(vocabulary.terms, dtype=object)[term_ids]
+    return features, faculty_index, term_index
+
+
+def project_feature_matrix(counts, vocabulary, feature_terms, weighting=None):
+    """Normalizes new rows like build_feature_matrix, restricted to an existing list of feature terms.
+
+    Rows are weighted over all of their terms (by their total, or by the corpus'
+    TermWeighting); feature terms missing from the vocabulary get zero columns.
+    """
+    columns = [(vocabulary.term_ids[term], position) for position, term in enumerate(feature_terms)
+               if term in vocabulary.term_ids]
+    term_ids, positions = zip(*columns) if columns else ((), ())
+    selection = sparse.csr_matrix((np.ones(len(columns)), (term_ids, positions)),
+                                  shape=(len(vocabulary), len(feature_terms)))
+    weighted = normalize_rows(counts) if weighting is None else weighting.transform(counts, vocabulary)
+    return (weighted @ selection).tocsr()
+
+
+def _count_order(counts, tie_break=None):
+    # Stored entries sorted by row, then descending count, then tie_break (default: term id)
+    rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+    return np.lexsort((counts.indices if tie_break is None else tie_break, -counts.data, rows))
+
+
+def row_summaries(counts, first_seen=None):
+    """Returns (most common term id, mean count, number of distinct terms) of every row.
+
+    The most common term is the highest count. Ties go to the term seen first in the row
+    when first_seen (from count_terms, with the same columns) is given, else to the lower
+    term id. Rows without terms get -1 and a mean count of 0.
+    """
+    counts = sparse.csr_matrix(counts)
+    counts.sort_indices()
+    tie_break = None
+    if first_seen is not None:
+        first_seen = sparse.csr_matrix(first_seen)
+        first_seen.sort_indices()
+        tie_break = first_seen.data
+    n_unique = np.diff(counts.indptr)
+    nonempty = n_unique > 0
+    most_common = np.full(counts.shape[0], -1, dtype=np.int64)
+    most_common[nonempty] = counts.indices[_count_order(counts, tie_break)[counts.indptr[:-1][nonempty]]]
+    row_totals = np.asarray(counts.sum(axis=1)).ravel()
+    average = np.divide(row_totals, n_unique, out=np.zeros(counts.shape[0]), where=nonempty)
+    return most_common, average, n_unique
+
+
+def row_term_lists(counts, vocabulary, order='count'):
+    """Every row's terms, by descending count (ties in vocabulary order) or alphabetically (order='alpha')."""
+    counts = sparse.csr_matrix(counts)
+    terms = np.asarray(vocabulary.terms, dtype=object)
+    if order == 'alpha':
+        rank = np.empty(len(terms), dtype=np.int64)
+        rank[np.argsort(terms, kind='stable')] = np.arange(len(terms))
+        rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+        sort = np.lexsort((rank[counts.indices], rows))
+    else:
+        sort = _count_order(counts)
+    return [list(row) for row in np.split(terms[counts.indices[sort]], counts.indptr[1:-1])][:counts.shape[0]]
+
+
+def _row_kth_largest(matrix, k):
+    """Every row's k-th largest entry (stored entry for sparse rows; -inf if the row has fewer)."""
+    if not sparse.issparse(matrix):
+        n_cols = matrix.shape[1]
+        if k > n_cols:
+            return np.full(matrix.shape[0], -np.inf)
+        return np.partition(matrix, n_cols - k, axis=1)[:, n_cols - k]
+    counts = np.diff(matrix.indptr)
+    thresholds = np.full(matrix.shape[0], -np.inf)
+    full_rows = np.flatnonzero(counts >= k)
+    if len(full_rows) == 0:
+        return thresholds
+    # Take the row maximum off k times; the last maximum removed is the k-th largest
+    values = matrix.data[np.repeat(counts >= k, counts)].astype(float)
+    segment = np.repeat(np.arange(len(full_rows)), counts[full_rows])
+    starts = np.concatenate([[0], np.cumsum(counts[full_rows])[:-1]])
+    positions = np.arange(len(values))
+    for _ in range(k):
+        row_max = np.maximum.reduceat(values, starts)
+        first_max = np.minimum.reduceat(np.where(values == row_max[segment], positions, len(values)), starts)
+        values[first_max] = -np.inf
+    thresholds[full_rows] = row_max
+    return thresholds
+
+
+def top_terms_per_row(matrix, terms, k):
+    """Returns (term lists, weight lists) of every row's k largest positive entries.
+
+    matrix is dense or sparse; ties are broken by column order. Each row is first cut
+    down to the entries reaching its k-th largest value, so only those are sorted.
+    """
+    if sparse.issparse(matrix):
+        matrix = sparse.csr_matrix(matrix)
+        thresholds = _row_kth_largest(matrix, k)
+        rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+        candidates = (matrix.data >= thresholds[rows]) & (matrix.data > 0)
+        rows, cols, values = rows[candidates], matrix.indices[candidates], matrix.data[candidates]
+    else:
+        matrix = np.asarray(matrix, dtype=float)
+        thresholds = _row_kth_largest(matrix, k)
+        rows, cols = np.nonzero((matrix >= thresholds[:, None]) & (matrix > 0))
+        values = matrix[rows, cols]
+    order = np.lexsort((cols, -values, rows))
+    rows, cols, values = rows[order], cols[order], values[order]
+    row_starts = np.searchsorted(rows, np.arange(matrix.shape[0]))
+    keep = np.arange(len(rows)) - row_starts[rows] < k
+    rows, cols, values = rows[keep], cols[keep], values[keep]
+    boundaries = np.searchsorted(rows, np.arange(1, matrix.shape[0]))
+    terms = np.asarray(terms, dtype=object)
+    return ([list(row_terms) for row_terms in np.split(terms[cols], boundaries)],
+            [row_values.tolist() for row_values in np.split(values, boundaries)])
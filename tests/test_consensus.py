@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+from scipy.spatial.distance import squareform
+
+from consensus import co_association, stability_report
+
+
+def test_stability_report_from_condensed_consensus():
+    square = np.array([[0.0, 0.9, 0.8, 0.1],
+                       [0.9, 0.0, 0.7, 0.3],
+                       [0.8, 0.7, 0.0, 0.2],
+                       [0.1, 0.3, 0.2, 0.0]])
+    cluster_df, faculty_df = stability_report(squareform(square).astype(np.float32), [0, 0, 0, 1], list('abcd'))
+
+    assert cluster_df['Size'].tolist() == [3, 1]
+    assert cluster_df.loc[0, 'Consensus'] == pytest.approx(0.8)
+    assert np.isnan(cluster_df.loc[1, 'Consensus'])
+    assert faculty_df['Item_Consensus'][:3].tolist() == pytest.approx([0.85, 0.8, 0.75])
+    assert np.isnan(faculty_df['Item_Consensus'][3])
+    assert faculty_df['Best_Other_Consensus'].tolist() == pytest.approx([0.1, 0.3, 0.2, 0.2])
+
+
+def test_co_association_needs_more_rows_than_clusters():
+    with pytest.raises(ValueError, match='needs more than 5 faculty'):
+        co_association(np.eye(5), n_resamples=2, n_clusters=5, n_jobs=1)
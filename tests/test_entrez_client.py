@@ -0,0 +1,95 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from entrez_client import EntrezClient
+from instrumentation import RunRecorder
+
+
+class StubEutils:
+    """Local E-utilities stub: answers POSTs from a scripted list of (status, headers, body)."""
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []  # (perf_counter time, path, form body)
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+                with stub.lock:
+                    stub.requests.append((time.perf_counter(), self.path, body))
+                    status, headers, payload = stub.responses.pop(0) if stub.responses else (200, {}, b'ok')
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def times(self):
+        return [request_time for request_time, _, _ in self.requests]
+
+
+@pytest.fixture
+def stub():
+    server = StubEutils()
+    server.thread.start()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+
+
+def test_429_is_retried_with_backoff(stub):
+    stub.responses = [(429, {}, b'slow down'), (200, {}, b'<IdList/>')]
+    client = EntrezClient(base_url=stub.url, rate=1000, backoff=0.2)
+    assert client.esearch(term='Allison, Steven[Author]') == b'<IdList/>'
+    assert len(stub.requests) == 2
+    assert stub.requests[0][1] == '/esearch.fcgi'
+    # The first retry waits backoff * (1 + random()) seconds
+    assert stub.times()[1] - stub.times()[0] >= 0.2
+
+
+def test_retry_after_is_honored(stub):
+    stub.responses = [(503, {'Retry-After': '1'}, b''), (200, {}, b'done')]
+    # Without Retry-After the backoff would be at least 30 s
+    client = EntrezClient(base_url=stub.url, rate=1000, backoff=30)
+    start = time.perf_counter()
+    assert client.efetch(id='1') == b'done'
+    assert 1 <= stub.times()[1] - stub.times()[0] < 5
+    assert time.perf_counter() - start < 5
+
+
+@pytest.mark.parametrize('api_key, rate, n_requests', [(None, 3, 4), ('key', 10, 11)])
+def test_token_bucket_caps_request_rate(stub, api_key, rate, n_requests):
+    client = EntrezClient(base_url=stub.url, api_key=api_key, max_workers=4)
+    assert client.limiter.rate == rate
+    client.map(lambda pmid: client.efetch(id=pmid), range(n_requests))
+    times = sorted(stub.times())
+    # The bucket holds one token, so n requests span at least (n - 1) / rate seconds
+    assert times[-1] - times[0] >= (n_requests - 1) / rate * 0.95
+    assert ('api_key=key' in stub.requests[0][2]) == (api_key is not None)
+
+
+def test_failed_attempts_are_not_recorded(stub):
+    recorder = RunRecorder('test')
+    stub.responses = [(500, {}, b'error'), (200, {}, b'12345'), (404, {}, b'missing')]
+    client = EntrezClient(base_url=stub.url, rate=1000, backoff=0.01, recorder=recorder)
+    assert client.efetch(id='1') == b'12345'
+    with pytest.raises(Exception):
+        client.efetch(id='2')
+    stats = recorder.requests['efetch']
+    assert stats['count'] == 1
+    assert stats['retries'] == 1
+    assert stats['bytes'] == 5
+    assert sum(stats['histogram']) == 1
@@ -0,0 +1,73 @@
+from mesh_parser import MeshHeading, iter_articles, iter_mesh_headings
+
+EFETCH_XML = b"""<?xml version="1.0"?>
+<PubmedArticleSet>
+  <PubmedArticle>
+    <MedlineCitation Status="MEDLINE">
+      <PMID Version="1">111</PMID>
+      <Article>
+        <Journal><Title>J Test</Title></Journal>
+        <ArticleTitle>First article</ArticleTitle>
+      </Article>
+      <MeshHeadingList>
+        <MeshHeading>
+          <DescriptorName UI="D006801" MajorTopicYN="N">Humans</DescriptorName>
+        </MeshHeading>
+        <MeshHeading>
+          <DescriptorName UI="D009369" MajorTopicYN="N">Neoplasms</DescriptorName>
+          <QualifierName UI="Q000188" MajorTopicYN="Y">drug therapy</QualifierName>
+          <QualifierName UI="Q000473" MajorTopicYN="N">pathology</QualifierName>
+        </MeshHeading>
+      </MeshHeadingList>
+      <CommentsCorrectionsList>
+        <CommentsCorrections RefType="Cites"><PMID Version="1">999</PMID></CommentsCorrections>
+      </CommentsCorrectionsList>
+    </MedlineCitation>
+  </PubmedArticle>
+  <PubmedBookArticle>
+    <BookDocument>
+      <PMID Version="1">222</PMID>
+      <Book><BookTitle>Test Book</BookTitle></Book>
+    </BookDocument>
+  </PubmedBookArticle>
+  <PubmedArticle>
+    <MedlineCitation Status="In-Data-Review">
+      <Article><ArticleTitle>No PMID</ArticleTitle></Article>
+      <MeshHeadingList>
+        <MeshHeading><DescriptorName UI="D000818" MajorTopicYN="Y">Animals</DescriptorName></MeshHeading>
+      </MeshHeadingList>
+    </MedlineCitation>
+  </PubmedArticle>
+  <PubmedArticle>
+    <MedlineCitation Status="MEDLINE">
+      <PMID Version="1">333</PMID>
+      <MeshHeadingList>
+        <MeshHeading><DescriptorName UI="D051381" MajorTopicYN="Y">Rats</DescriptorName></MeshHeading>
+      </MeshHeadingList>
+    </MedlineCitation>
+  </PubmedArticle>
+  <DeleteCitation>
+    <PMID Version="1">444</PMID>
+    <PMID Version="1">555</PMID>
+  </DeleteCitation>
+</PubmedArticleSet>
+"""
+
+
+def test_iter_articles_yields_heading_tuples():
+    articles = list(iter_articles(EFETCH_XML))
+    assert articles == [
+        ('111', [
+            MeshHeading('111', 'Humans', 'D006801', False, ()),
+            MeshHeading('111', 'Neoplasms', 'D009369', True, ('drug therapy', 'pathology')),
+        ]),
+        ('222', []),
+        ('333', [MeshHeading('333', 'Rats', 'D051381', True, ())]),
+    ]
+
+
+def test_deleted_and_pmidless_citations_are_skipped(tmp_path):
+    path = tmp_path / 'efetch.xml'
+    path.write_bytes(EFETCH_XML)
+    pmids = [heading.pmid for heading in iter_mesh_headings(str(path))]
+    assert pmids == ['111', '111', '333']
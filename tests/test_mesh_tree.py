@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from mesh_tree import MeshTree, rollup_counts, rollup_matrix
+from term_matrix import TermVocabulary
+
+DESCRIPTOR_FILE = os.path.join(os.path.dirname(__file__), 'data', 'desc_sample.xml')
+TERMS = ['Breast Neoplasms', 'Rats', 'Tamoxifen', 'Neoplasms', 'Health Equity Research']
+
+
+@pytest.fixture(scope='module')
+def mesh_tree():
+    return MeshTree.from_descriptor_file(DESCRIPTOR_FILE)
+
+
+@pytest.fixture
+def counts():
+    return sparse.csr_matrix(np.array([[4, 2, 1, 0, 3],
+                                       [0, 5, 0, 2, 0],
+                                       [1, 0, 0, 0, 0]], dtype=float))
+
+
+def vocabulary_of(terms):
+    vocabulary = TermVocabulary()
+    for term in terms:
+        vocabulary.intern(term)
+    return vocabulary
+
+
+def test_descriptor_file_uses_each_record_own_name(mesh_tree):
+    assert len(mesh_tree) == 10
+    assert mesh_tree.tree_numbers['Breast Neoplasms'] == ('C04.588.180', 'C17.800.090.500')
+    assert mesh_tree.tree_numbers['Tamoxifen'] == ('D02.455',)
+    assert 'Antineoplastic Agents, Hormonal' not in mesh_tree
+
+
+def test_rollup_preserves_row_totals(mesh_tree, counts):
+    aggregation, rolled = rollup_matrix(TERMS, mesh_tree, depth=2)
+    rolled_counts = counts @ aggregation
+    assert np.allclose(rolled_counts.sum(axis=1), counts.sum(axis=1))
+    assert rolled.terms == ['Neoplasms by Site', 'Skin Diseases', 'Animals', 'Tamoxifen', 'Neoplasms',
+                            'Health Equity Research']
+    # Breast Neoplasms splits its count between its two branches
+    assert rolled_counts[0, rolled.term_ids['Neoplasms by Site']] == 2
+    assert rolled_counts[0, rolled.term_ids['Skin Diseases']] == 2
+
+
+def test_excluded_branches_drop_their_terms(mesh_tree, counts):
+    rolled_counts, rolled = rollup_counts(counts, vocabulary_of(TERMS), mesh_tree, depth=2,
+                                          exclude_branches=['B01'])
+    assert 'Animals' not in rolled.term_ids
+    rats = counts[:, TERMS.index('Rats')].toarray().ravel()
+    assert np.allclose(np.asarray(rolled_counts.sum(axis=1)).ravel(), np.asarray(counts.sum(axis=1)).ravel() - rats)
+
+
+def test_unmapped_terms_keep_their_column(mesh_tree, counts):
+    rolled_counts, rolled = rollup_counts(counts, vocabulary_of(TERMS), mesh_tree, depth=2)
+    assert rolled_counts[0, rolled.term_ids['Health Equity Research']] == 3
+
+    rolled_counts, rolled = rollup_counts(counts, vocabulary_of(TERMS), mesh_tree, depth=2, keep_unmapped=False)
+    assert 'Health Equity Research' not in rolled.term_ids
+    assert rolled_counts.sum() == counts.sum() - 3
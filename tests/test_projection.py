@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+from projection import fit_faculty_model, project_faculty, vectorize_faculty
+from term_matrix import DEFAULT_SOURCE_WEIGHTS, build_feature_matrix, count_terms
+
+
+def synthetic_faculty(n_groups=3, per_group=20, terms_per_group=8, seed=0):
+    """Faculty in n_groups research areas, each drawing its terms from its own block of terms."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for group in range(n_groups):
+        block = [f'Area {group} Term {term}' for term in range(terms_per_group)]
+        for member in range(per_group):
+            terms = rng.choice(block, size=12)
+            rows.append({'Faculty_Full_Name': f'Faculty {group}-{member}', 'pub_mesh_terms': '; '.join(terms)})
+    return pd.DataFrame(rows)
+
+
+def test_projecting_an_existing_row_returns_its_own_cluster():
+    df = synthetic_faculty()
+    source_weights = {'pub_mesh_terms': DEFAULT_SOURCE_WEIGHTS['pub_mesh_terms']}
+    counts, vocabulary = count_terms(df, source_weights)
+    features, faculty, terms = build_feature_matrix(counts, vocabulary, df['Faculty_Full_Name'].values, top_n=50)
+    model = fit_faculty_model(features, faculty, terms, num_components=2, n_clusters=3, n_neighbors=10,
+                              source_weights=source_weights, remove_terms=[])
+
+    for row in (0, 25, 59):
+        projected = vectorize_faculty(model, df.iloc[[row]])
+        assert np.allclose(projected.toarray(), features[row].toarray())
+        _, labels = project_faculty(model, projected)
+        assert labels[0] == model['labels'][row]
@@ -0,0 +1,34 @@
+from collections import Counter
+
+import pandas as pd
+
+from term_matrix import DEFAULT_SOURCE_WEIGHTS, count_terms, drop_terms, row_summaries, weighted_terms_string
+
+
+def baseline_most_common(terms_string):
+    # The original find_most_common_item: Counter over the weight-expanded '; ' string
+    item_counts = Counter(terms_string.split('; ')) if terms_string else Counter()
+    if not item_counts:
+        return None, 0
+    return item_counts.most_common(1)[0][0], sum(item_counts.values()) / len(item_counts)
+
+
+def test_row_summaries_match_counter_including_ties():
+    df = pd.DataFrame({
+        # Row 0 interns Soil before Carbon; row 1 lists Carbon first, tying with Soil
+        'Proposal_Mesh_Terms': ['Soil; Carbon', 'Carbon; Soil', None, 'Humans; Droughts'],
+        'Mapped_Mesh_Terms': ['Soil', None, None, 'Forests'],
+        'pub_mesh_terms': ['Carbon; Nitrogen', 'Nitrogen', None, 'Forests; Droughts; Humans'],
+    })
+    remove_terms = ['Humans']
+    counts, vocabulary, first_seen = count_terms(df, DEFAULT_SOURCE_WEIGHTS, first_seen=True)
+    first_seen, _ = drop_terms(first_seen, vocabulary, remove_terms)
+    counts, vocabulary = drop_terms(counts, vocabulary, remove_terms)
+    most_common_ids, average_frequency, _ = row_summaries(counts, first_seen)
+
+    for row, values in enumerate(zip(*(df[column] for column in DEFAULT_SOURCE_WEIGHTS))):
+        expected_term, expected_average = baseline_most_common(
+            weighted_terms_string(values, DEFAULT_SOURCE_WEIGHTS.values(), remove_terms))
+        term_id = most_common_ids[row]
+        assert (vocabulary.terms[term_id] if term_id >= 0 else None) == expected_term
+        assert average_frequency[row] == expected_average